@@ -0,0 +1,128 @@
+"""
+Voice + BGM mixing on decoded PCM.
+
+The final write used to pull a CompositeAudioClip (voice, and BGM with
+MultiplyVolume, AudioFadeOut and AudioLoop effects) chunk by chunk while
+encoding video. Here both tracks are decoded once to float32 arrays, gain,
+fade and loop are applied as array operations, and the mix is encoded to a
+single AAC file that the video writer muxes with a stream copy.
+
+Decoded tracks are cached in memory, so variants rendered by the same
+process decode the shared voice and BGM only once.
+"""
+
+import os
+import subprocess
+from functools import lru_cache
+
+import numpy as np
+from loguru import logger
+from moviepy.config import FFMPEG_BINARY
+
+from . import resources
+
+AUDIO_FPS = 44100
+CHANNELS = 2
+BGM_FADE_OUT = 3
+
+
+@lru_cache(maxsize=4)
+def _decode_cached(file_path: str, size: int, mtime_ns: int, audio_fps: int) -> np.ndarray:
+    result = subprocess.run(
+        [
+            FFMPEG_BINARY, "-v", "error", "-i", file_path, "-vn",
+            "-f", "f32le", "-acodec", "pcm_f32le",
+            "-ac", str(CHANNELS), "-ar", str(audio_fps), "-",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    samples = np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, CHANNELS)
+    # shared between callers through the cache
+    samples.flags.writeable = False
+    return samples
+
+
+resources.register_cache(_decode_cached.cache_clear)
+
+
+def decode(file_path: str, audio_fps: int = AUDIO_FPS) -> np.ndarray:
+    """Decode an audio file to a read-only (samples, channels) float32 array."""
+    st = os.stat(file_path)
+    return _decode_cached(os.path.abspath(file_path), st.st_size, st.st_mtime_ns, audio_fps)
+
+
+def fade_out(samples: np.ndarray, duration: float, audio_fps: int = AUDIO_FPS):
+    """Linearly fade the last `duration` seconds to silence, in place."""
+    n = min(len(samples), int(duration * audio_fps))
+    if n <= 0:
+        return
+    # same curve as afx.AudioFadeOut: gain = time left / fade duration
+    gain = np.arange(n, 0, -1, dtype=np.float32) / np.float32(duration * audio_fps)
+    samples[-n:] *= gain[:, None]
+
+
+def loop(samples: np.ndarray, n: int) -> np.ndarray:
+    """Repeat samples to exactly n frames."""
+    if len(samples) == 0:
+        return np.zeros((n, CHANNELS), dtype=np.float32)
+    repeats = -(-n // len(samples))
+    return np.tile(samples, (repeats, 1))[:n]
+
+
+def encode(samples: np.ndarray, output_file: str, audio_fps: int = AUDIO_FPS, codec: str = "aac"):
+    subprocess.run(
+        [
+            FFMPEG_BINARY, "-y", "-v", "error",
+            "-f", "f32le", "-ar", str(audio_fps), "-ac", str(CHANNELS), "-i", "-",
+            "-c:a", codec, output_file,
+        ],
+        input=np.ascontiguousarray(samples, dtype=np.float32).tobytes(),
+        check=True,
+        capture_output=True,
+    )
+
+
+def mix(
+    voice_file: str,
+    duration: float,
+    output_file: str,
+    voice_volume: float = 1.0,
+    bgm_file: str = "",
+    bgm_volume: float = 0.2,
+    audio_fps: int = AUDIO_FPS,
+) -> str:
+    """
+    Mix the voice track with looped background music and encode the result.
+
+    Args:
+        voice_file: Narration audio
+        duration: Length of the mix in seconds, normally the video duration
+        output_file: Encoded mix, an .m4a path
+        voice_volume: Gain applied to the voice
+        bgm_file: Background music, skipped when empty or undecodable
+        bgm_volume: Gain applied to the background music
+        audio_fps: Sample rate of the mix
+
+    Returns:
+        output_file
+    """
+    n = int(round(duration * audio_fps))
+    mixed = np.zeros((n, CHANNELS), dtype=np.float32)
+
+    voice = decode(voice_file, audio_fps)[:n]
+    mixed[:len(voice)] = voice
+    mixed *= np.float32(voice_volume)
+
+    if bgm_file:
+        try:
+            bgm = decode(bgm_file, audio_fps) * np.float32(bgm_volume)
+            # fade the end of the track before looping, as the clip effects did
+            fade_out(bgm, BGM_FADE_OUT, audio_fps)
+            mixed += loop(bgm, n)
+        except Exception as e:
+            logger.error(f"failed to add bgm: {str(e)}")
+
+    np.clip(mixed, -1.0, 1.0, out=mixed)
+    encode(mixed, output_file, audio_fps)
+    return output_file
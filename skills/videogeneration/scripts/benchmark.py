@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the video pipeline.
+
+Synthetic source clips, images, narration, background music and subtitles
+are generated locally with ffmpeg's lavfi sources, so nothing depends on
+Pexels, Pixabay or edge-tts. The render stages are then timed at several
+scales:
+
+- combine: combine_videos, segments rendered and merged into combined.mp4
+- generate: generate_video, subtitles and audio mix over a combined video
+- single_pass: render_video, segments, subtitles and audio in one encode
+- preprocess: preprocess_video, zoomed clips made from still images
+
+Every case runs in a fresh process, so its peak RSS and bytes written are
+its own and in-memory caches start cold. The segment and image clip
+caches are disabled unless --segment-cache is given. Planning and media generation are not
+timed. Results are written as JSON and, with --baseline, compared against
+an earlier results file.
+
+Usage:
+    python3 scripts/benchmark.py --scales smoke
+    python3 scripts/benchmark.py --scales small,medium --output after.json --baseline before.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+# Add scripts directory to path for local imports
+script_dir = Path(__file__).parent
+sys.path.insert(0, str(script_dir.parent))
+
+from moviepy.config import FFMPEG_BINARY
+
+from scripts import utils
+
+RESULTS_VERSION = 1
+
+# clips: source clips (or images), clip_seconds: length of each source,
+# narration_seconds: length of the voice track and so of the output
+SCALES = {
+    "smoke": {"clips": 2, "clip_seconds": 4, "narration_seconds": 6, "subtitles": 4},
+    "small": {"clips": 4, "clip_seconds": 6, "narration_seconds": 15, "subtitles": 10},
+    "medium": {"clips": 8, "clip_seconds": 10, "narration_seconds": 30, "subtitles": 30},
+    "large": {"clips": 16, "clip_seconds": 15, "narration_seconds": 60, "subtitles": 60},
+}
+
+# (width, height, fps) of the sources, cycled over the clips; the output is portrait 1080x1920 at 30 fps
+SOURCE_MIXES = {
+    # already at the output size and frame rate
+    "matched": [(1080, 1920, 30)],
+    # needs resizing, letterboxing and frame rate conversion
+    "mismatched": [(1280, 720, 25), (720, 720, 24), (1920, 1080, 30), (1080, 1920, 30)],
+}
+
+STAGES = ("combine", "generate", "single_pass", "preprocess")
+
+FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/System/Library/Fonts/Supplemental/Arial Unicode.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+]
+
+WORDS = (
+    "the quick light over quiet water morning city runs through every street while people "
+    "wait for trains and coffee shops open their doors to another busy day in spring"
+).split()
+
+
+def _ffmpeg(*args):
+    subprocess.run([FFMPEG_BINARY, "-y", "-v", "error", *args], check=True, capture_output=True)
+
+
+def _ffmpeg_version() -> str:
+    try:
+        result = subprocess.run([FFMPEG_BINARY, "-version"], capture_output=True, text=True)
+        return result.stdout.splitlines()[0]
+    except Exception:
+        return ""
+
+
+def _git_commit() -> str:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=script_dir, capture_output=True, text=True
+        )
+        return result.stdout.strip()
+    except Exception:
+        return ""
+
+
+def make_clip(file_path: str, width: int, height: int, fps: int, seconds: float, seed: int = 0):
+    if os.path.exists(file_path):
+        return
+    # light temporal noise keeps the encoder from coasting on the flat test pattern;
+    # about 6 Mbit/s at 1080x1920, in the range of stock footage
+    _ffmpeg(
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}:duration={seconds}",
+        "-vf", f"noise=alls=3:allf=t:all_seed={seed}",
+        "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-g", str(fps),
+        file_path,
+    )
+
+
+def make_image(file_path: str, width: int, height: int):
+    if os.path.exists(file_path):
+        return
+    _ffmpeg(
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=1",
+        "-vf", "noise=alls=3", "-frames:v", "1", file_path,
+    )
+
+
+def make_narration(file_path: str, seconds: float):
+    if os.path.exists(file_path):
+        return
+    # beeps rather than a constant tone, closer to speech for the encoder
+    _ffmpeg(
+        "-f", "lavfi", "-i", f"sine=frequency=220:beep_factor=3:sample_rate=24000:duration={seconds}",
+        "-c:a", "libmp3lame", "-b:a", "48k", file_path,
+    )
+
+
+def make_bgm(file_path: str, seconds: float):
+    if os.path.exists(file_path):
+        return
+    _ffmpeg(
+        "-f", "lavfi", "-i", f"anoisesrc=color=pink:amplitude=0.2:sample_rate=44100:duration={seconds}",
+        "-ac", "2", "-c:a", "libmp3lame", "-b:a", "128k", file_path,
+    )
+
+
+def make_subtitles(file_path: str, count: int, seconds: float, seed: int = 0):
+    if os.path.exists(file_path):
+        return
+    rng = random.Random(seed)
+    step = seconds / count
+    with open(file_path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            # a mix of one and two line captions
+            text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 14)))
+            f.write(utils.text_to_srt(i + 1, text, i * step, (i + 0.9) * step) + "\n")
+
+
+def prepare_media(media_dir: str, scale: str, mix: str) -> dict:
+    """Generate (or reuse) the synthetic inputs of one scale and source mix."""
+    spec = SCALES[scale]
+    os.makedirs(media_dir, exist_ok=True)
+    sources = SOURCE_MIXES[mix]
+
+    clips, images = [], []
+    for i in range(spec["clips"]):
+        width, height, fps = sources[i % len(sources)]
+        clip_file = os.path.join(media_dir, f"clip-{width}x{height}-{fps}-{spec['clip_seconds']}s-{i}.mp4")
+        make_clip(clip_file, width, height, fps, spec["clip_seconds"], seed=i)
+        clips.append(clip_file)
+        image_file = os.path.join(media_dir, f"image-{width}x{height}-{i}.png")
+        make_image(image_file, width, height)
+        images.append(image_file)
+
+    narration_file = os.path.join(media_dir, f"narration-{spec['narration_seconds']}s.mp3")
+    make_narration(narration_file, spec["narration_seconds"])
+    bgm_file = os.path.join(media_dir, "bgm-20s.mp3")
+    make_bgm(bgm_file, 20)
+    subtitle_file = os.path.join(media_dir, f"subtitles-{spec['subtitles']}-{spec['narration_seconds']}s.srt")
+    make_subtitles(subtitle_file, spec["subtitles"], spec["narration_seconds"])
+    # input of the generate stage, so it is timed without the combine stage
+    combined_file = os.path.join(media_dir, f"combined-1080x1920-30-{spec['narration_seconds']}s.mp4")
+    make_clip(combined_file, 1080, 1920, 30, spec["narration_seconds"])
+
+    return {
+        "clips": clips,
+        "images": images,
+        "narration": narration_file,
+        "bgm": bgm_file,
+        "subtitles": subtitle_file,
+        "combined": combined_file,
+    }
+
+
+def _write_bytes() -> int:
+    """Bytes this process and its finished children wrote to storage, 0 where /proc is missing."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def run_case(case: dict, media: dict, scratch_dir: str, font: str, segment_cache: bool) -> dict:
+    """Run one benchmark case; called in a fresh process."""
+    from scripts.config import config
+
+    if not segment_cache:
+        config.app.set("segment_cache_max_mb", 0)
+        config.app.set("image_clip_cache_max_mb", 0)
+
+    from scripts import probe, resources, video
+    from scripts.schema import MaterialInfo, VideoAspect, VideoParams
+
+    shutil.rmtree(scratch_dir, ignore_errors=True)
+    os.makedirs(scratch_dir)
+    params = VideoParams(
+        video_subject="benchmark",
+        video_aspect=VideoAspect.portrait,
+        video_clip_duration=5,
+        subtitle_enabled=True,
+        font_name=font,
+        bgm_type="random",
+        bgm_file=media["bgm"],
+        seed=0,
+        draft=case["draft"],
+        render_workers=case["workers"],
+        n_threads=video.OPTIMAL_THREADS,
+    )
+
+    stage = case["stage"]
+    output_file = os.path.join(scratch_dir, "output.mp4")
+    render_plan = None
+    materials = []
+    if stage in ("combine", "single_pass"):
+        subtitle_file = media["subtitles"] if stage == "single_pass" else ""
+        render_plan = video.plan_render(media["clips"], media["narration"], subtitle_file, params)
+    elif stage == "preprocess":
+        for image in media["images"]:
+            image_copy = os.path.join(scratch_dir, os.path.basename(image))
+            shutil.copy(image, image_copy)
+            materials.append(MaterialInfo(provider="local", url=image_copy))
+
+    written = _write_bytes()
+    resources.reset_peak()
+    started = time.perf_counter()
+    if stage == "combine":
+        video.combine_videos(
+            combined_video_path=output_file,
+            video_paths=media["clips"],
+            audio_file=media["narration"],
+            video_aspect=params.video_aspect,
+            max_clip_duration=params.video_clip_duration,
+            workers=params.render_workers,
+            draft=params.draft,
+            render_plan=render_plan,
+        )
+    elif stage == "generate":
+        video.generate_video(
+            video_path=media["combined"],
+            audio_path=media["narration"],
+            subtitle_path=media["subtitles"],
+            output_file=output_file,
+            params=params,
+        )
+    elif stage == "single_pass":
+        video.render_video(
+            video_paths=media["clips"],
+            audio_path=media["narration"],
+            subtitle_path=media["subtitles"],
+            output_file=output_file,
+            params=params,
+            render_plan=render_plan,
+        )
+    elif stage == "preprocess":
+        video.preprocess_video(materials, clip_duration=params.video_clip_duration)
+    wall_time = time.perf_counter() - started
+
+    if stage == "preprocess":
+        outputs = [m.url for m in materials if m.url.endswith(".mp4")]
+    else:
+        outputs = [output_file] if os.path.exists(output_file) else []
+    frames = 0
+    for output in outputs:
+        info = probe.probe(output)
+        frames += int(round(info.duration * info.fps))
+
+    result = {
+        "wall_time": round(wall_time, 3),
+        "frames": frames,
+        "fps": round(frames / wall_time, 2) if wall_time > 0 else 0,
+        "peak_rss_mb": round(resources.peak_rss_mb(), 1),
+        "children_peak_rss_mb": round(resources.children_peak_rss_mb(), 1),
+        "bytes_written": _write_bytes() - written,
+        "output_bytes": sum(os.path.getsize(o) for o in outputs),
+    }
+    shutil.rmtree(scratch_dir, ignore_errors=True)
+    return result
+
+
+def run_in_process(case: dict, media: dict, scratch_dir: str, font: str, segment_cache: bool) -> dict:
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_case, case, media, scratch_dir, font, segment_cache).result()
+
+
+def summarize(runs: list) -> dict:
+    """Median of every metric over repeated runs; wall times of all runs are kept."""
+    summary = {}
+    for key in runs[0]:
+        values = [run[key] for run in runs]
+        summary[key] = statistics.median(values)
+    summary["wall_times"] = [run["wall_time"] for run in runs]
+    return summary
+
+
+def compare(results: list, baseline: dict, threshold: float) -> list:
+    """Compare results with a baseline results file by case id; slower by more than threshold is a regression."""
+    previous = {r["id"]: r for r in baseline.get("results", []) if "error" not in r}
+    comparisons = []
+    for result in results:
+        before = previous.get(result["id"])
+        if before is None or "error" in result:
+            continue
+        wall_ratio = result["wall_time"] / before["wall_time"] if before["wall_time"] else 0
+        comparisons.append({
+            "id": result["id"],
+            "wall_time": result["wall_time"],
+            "baseline_wall_time": before["wall_time"],
+            "wall_ratio": round(wall_ratio, 3),
+            "fps_change": round(result["fps"] - before["fps"], 2),
+            "peak_rss_change_mb": round(result["peak_rss_mb"] - before["peak_rss_mb"], 1),
+            "bytes_written_change": result["bytes_written"] - before["bytes_written"],
+            "regression": wall_ratio > 1 + threshold,
+        })
+    return comparisons
+
+
+def build_cases(scales, mixes, stages, workers: int, draft: bool) -> list:
+    cases = []
+    for scale in scales:
+        for mix in mixes:
+            for stage in stages:
+                if stage == "generate" and mix != mixes[0]:
+                    # generate only reads the synthetic combined video, the source mix doesn't matter
+                    continue
+                case_id = f"{stage}/{scale}/{mix}" + ("/draft" if draft else "")
+                cases.append({
+                    "id": case_id, "stage": stage, "scale": scale, "mix": mix,
+                    "workers": workers, "draft": draft, **SCALES[scale],
+                })
+    return cases
+
+
+def _split(value: str, allowed) -> list:
+    items = [v.strip() for v in value.split(",") if v.strip()]
+    unknown = [v for v in items if v not in allowed]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown value(s) {', '.join(unknown)}, choose from {', '.join(allowed)}")
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the video pipeline with synthetic media")
+    parser.add_argument("--scales", type=lambda v: _split(v, SCALES), default=["small"],
+                       help=f"Comma-separated scales: {', '.join(SCALES)}")
+    parser.add_argument("--mixes", type=lambda v: _split(v, SOURCE_MIXES), default=list(SOURCE_MIXES),
+                       help=f"Comma-separated source mixes: {', '.join(SOURCE_MIXES)}")
+    parser.add_argument("--stages", type=lambda v: _split(v, STAGES), default=list(STAGES),
+                       help=f"Comma-separated stages: {', '.join(STAGES)}")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case, the median is reported")
+    parser.add_argument("--render-workers", type=int, default=1, help="Segment render processes")
+    parser.add_argument("--draft", action="store_true", default=False, help="Benchmark draft renders")
+    parser.add_argument("--segment-cache", action="store_true", default=False,
+                       help="Keep the segment and image clip caches enabled (measures warm reruns)")
+    parser.add_argument("--font", type=str, default=None, help="Subtitle font file")
+    parser.add_argument("--work-dir", type=str, default=utils.storage_dir("benchmark"),
+                       help="Synthetic media and scratch files, media is reused across runs")
+    parser.add_argument("--output", type=str, default=None, help="Results JSON file")
+    parser.add_argument("--baseline", type=str, default=None, help="Earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                       help="Wall time increase over the baseline counted as a regression (0.1 = 10%%)")
+    parser.add_argument("--fail-on-regression", action="store_true", default=False,
+                       help="Exit with status 1 when any case regressed")
+    args = parser.parse_args()
+
+    font = args.font or next((f for f in FONT_CANDIDATES if os.path.exists(f)), "")
+    if not font:
+        parser.error("no subtitle font found, pass --font")
+
+    work_dir = os.path.abspath(os.path.expanduser(args.work_dir))
+    output = args.output or os.path.join(work_dir, f"results-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    cases = build_cases(args.scales, args.mixes, args.stages, args.render_workers, args.draft)
+    print(f"🏁 {len(cases)} cases, {args.repeat} run(s) each, work dir: {work_dir}")
+
+    results = []
+    for case in cases:
+        media = prepare_media(os.path.join(work_dir, "media", case["mix"]), case["scale"], case["mix"])
+        scratch_dir = os.path.join(work_dir, "scratch", case["id"].replace("/", "-"))
+        try:
+            runs = [
+                run_in_process(case, media, scratch_dir, font, args.segment_cache)
+                for _ in range(max(1, args.repeat))
+            ]
+        except Exception as e:
+            print(f"❌ {case['id']}: {e}")
+            results.append({**case, "error": str(e)})
+            continue
+        result = {**case, **summarize(runs)}
+        results.append(result)
+        print(
+            f"🎬 {case['id']}: {result['wall_time']:.2f}s, {result['frames']} frames, {result['fps']:.1f} fps, "
+            f"peak rss {result['peak_rss_mb']:.0f} MB, {result['bytes_written'] / 1024 / 1024:.1f} MB written"
+        )
+
+    report = {
+        "version": RESULTS_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "ffmpeg": _ffmpeg_version(),
+            "commit": _git_commit(),
+        },
+        "options": {
+            "render_workers": args.render_workers,
+            "draft": args.draft,
+            "segment_cache": args.segment_cache,
+            "repeat": args.repeat,
+            "font": font,
+        },
+        "results": results,
+    }
+
+    regressions = []
+    if baseline is not None:
+        comparisons = compare(results, baseline, args.threshold)
+        report["baseline"] = {"file": os.path.abspath(args.baseline), "comparisons": comparisons}
+        print(f"\n📊 Compared with {args.baseline}:")
+        for c in comparisons:
+            mark = "🔴" if c["regression"] else "🟢"
+            print(
+                f"  {mark} {c['id']}: {c['baseline_wall_time']:.2f}s -> {c['wall_time']:.2f}s "
+                f"(x{c['wall_ratio']:.2f}), fps {c['fps_change']:+.1f}, peak rss {c['peak_rss_change_mb']:+.0f} MB"
+            )
+        regressions = [c for c in comparisons if c["regression"]]
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📄 Results: {output}")
+
+    if regressions and args.fail_on_regression:
+        print(f"❌ {len(regressions)} case(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Stage checkpoints of a task, so a rerun resumes where the last run stopped.
+
+checkpoint.json in the task directory records, for every finished stage, a
+hash of the stage's inputs, the content hashes of the artifacts it wrote
+(script.json, audio.mp3, subtitle.srt, materials, render plans,
+combined-N.mp4, final-N.mp4) and a small JSON result. A stage whose inputs
+hash the same as in the last run and whose artifacts are still there,
+unchanged, is skipped and its result reused. Inputs include the content
+hashes of upstream artifacts, so a stage that does run invalidates the
+stages depending on what it wrote.
+
+Checkpoints are always recorded but only reused when the task's params
+ask to resume: config the stages read, such as the LLM model or voice
+provider, is not part of their inputs.
+"""
+
+import json
+import os
+import threading
+import time
+from os import path
+from typing import Iterable, Optional
+
+from loguru import logger
+
+from . import probe, trace, utils
+from .schema import VideoParams
+
+CHECKPOINT_VERSION = 1
+
+# Params that change how fast a task runs, not what it produces
+RUN_ONLY_PARAMS = {
+    "n_threads",
+    "render_workers",
+    "render_threads_per_worker",
+    "render_cpu_budget",
+    "profile_stages",
+    "resume",
+}
+
+
+def file_input(file_path: str) -> str:
+    """Content hash of an input file, "" when it doesn't exist."""
+    if not file_path or not path.isfile(file_path):
+        return ""
+    return probe.content_hash(file_path)
+
+
+def params_input(params: VideoParams) -> dict:
+    data = params.model_dump(mode="json", warnings=False)
+    return {k: v for k, v in data.items() if k not in RUN_ONLY_PARAMS}
+
+
+def input_key(inputs) -> str:
+    return utils.md5(json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str))
+
+
+class Checkpoints:
+    """
+    The checkpoints of one task. Safe to use from the threads rendering
+    variants; every put() rewrites checkpoint.json atomically, so a crash
+    loses at most the stage that was running.
+    """
+
+    def __init__(self, task_id: str, enabled: bool = True, reuse: bool = True):
+        self.file = path.join(utils.task_dir(task_id), "checkpoint.json")
+        self.enabled = enabled
+        # without reuse stages are recorded for a later resumed run, but all of them run
+        self.reuse = enabled and reuse
+        self._lock = threading.Lock()
+        self._stages = self._load() if self.reuse else {}
+
+    def _load(self) -> dict:
+        if not path.exists(self.file):
+            return {}
+        try:
+            with open(self.file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"ignoring corrupt checkpoint file {self.file}: {str(e)}")
+            return {}
+        if data.get("version") != CHECKPOINT_VERSION:
+            return {}
+        return data.get("stages", {})
+
+    def _save(self):
+        tmp_file = f"{self.file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(
+                {"version": CHECKPOINT_VERSION, "stages": self._stages},
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+        os.replace(tmp_file, self.file)
+
+    def get(self, stage: str, inputs) -> Optional[dict]:
+        """The result saved for stage when its inputs and artifacts are unchanged, None otherwise."""
+        if not self.reuse:
+            return None
+        with self._lock:
+            entry = self._stages.get(stage)
+        if not entry or entry.get("key") != input_key(inputs):
+            return None
+        for file_path, file_hash in entry.get("artifacts", {}).items():
+            if file_input(file_path) != file_hash:
+                logger.info(f"stage {stage}: {file_path} is missing or changed, running it again")
+                return None
+        logger.info(f"stage {stage}: inputs unchanged since the last run, reusing its results")
+        trace.add("stages_skipped")
+        return entry.get("result") or {}
+
+    def put(self, stage: str, inputs, result: dict = None, artifacts: Iterable[str] = ()):
+        """Record that stage finished with inputs, writing artifacts and returning result."""
+        if not self.enabled:
+            return
+        try:
+            entry = {
+                "key": input_key(inputs),
+                "artifacts": {
+                    path.abspath(p): file_input(p) for p in artifacts if p and path.isfile(p)
+                },
+                "result": result or {},
+                "finished_at": time.time(),
+            }
+            with self._lock:
+                self._stages[stage] = entry
+                self._save()
+        except Exception as e:
+            # a missing checkpoint only costs running the stage again
+            logger.warning(f"failed to save checkpoint of stage {stage}: {str(e)}")
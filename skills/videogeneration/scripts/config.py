@@ -42,6 +42,10 @@ class AppConfig:
             return value if value else default
         
         return self._vg_config.get(key, default)
+
+    def set(self, key: str, value):
+        """Override a configuration value for this process (not saved to verso.json)."""
+        self._vg_config[key] = value
     
     def __getitem__(self, key: str):
         return self.get(key)
@@ -19,6 +19,7 @@ PUNCTUATIONS = [
 
 TASK_STATE_FAILED = -1
 TASK_STATE_COMPLETE = 1
+TASK_STATE_QUEUED = 2
 TASK_STATE_PROCESSING = 4
 
 FILE_TYPE_VIDEOS = ["mp4", "mov", "mkv", "webm"]
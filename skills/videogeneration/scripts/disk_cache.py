@@ -0,0 +1,149 @@
+"""
+Size-bounded on-disk file cache with LRU eviction.
+
+Entries are plain files named by key inside one directory. A file's mtime
+is its last access time (reads touch it), so eviction removes the least
+recently used files first. Writes go through a temp file and os.replace,
+so several processes can share one cache directory without locking.
+lock() serializes the work that produces an entry, in .locks/ where lock
+files stay until they have been idle for a day.
+"""
+
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from loguru import logger
+
+from . import utils
+
+TMP_SUFFIX = ".tmp"
+LOCK_DIR = ".locks"
+# lock files are refreshed whenever taken, older ones belong to nobody
+LOCK_MAX_AGE = 24 * 3600
+
+
+def copy_file(src: str, dst: str):
+    """
+    Copy src to dst through a temp file, so dst is replaced atomically and
+    never shares an inode with src: later writes to either path can't
+    change the other.
+    """
+    tmp_file = f"{dst}.{os.getpid()}.{threading.get_ident()}{TMP_SUFFIX}"
+    try:
+        shutil.copyfile(src, tmp_file)
+        os.replace(tmp_file, dst)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+class DiskCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key: str, ext: str = "") -> str:
+        return os.path.join(self.root, f"{key}{ext}")
+
+    def get(self, key: str, ext: str = "") -> Optional[str]:
+        """Return the cached file path and mark it as recently used, or None."""
+        file_path = self.path(key, ext)
+        try:
+            if os.path.getsize(file_path) <= 0:
+                return None
+            os.utime(file_path)
+        except OSError:
+            return None
+        return file_path
+
+    def put(self, key: str, src: str, ext: str = "", move: bool = False) -> str:
+        """Store src under key, moving or copying it, then enforce the size limit."""
+        file_path = self.path(key, ext)
+        tmp_file = f"{file_path}.{os.getpid()}.{threading.get_ident()}{TMP_SUFFIX}"
+        try:
+            # a copy, never a link: the caller may write to src again
+            if move:
+                shutil.move(src, tmp_file)
+            else:
+                shutil.copyfile(src, tmp_file)
+            os.replace(tmp_file, file_path)
+            os.utime(file_path)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        self.evict()
+        return file_path
+
+    @contextmanager
+    def lock(self, key: str):
+        """
+        Hold key's lock against other threads and processes, e.g. while
+        producing its entry. Waiters should get() again once they hold it.
+        """
+        lock_dir = os.path.join(self.root, LOCK_DIR)
+        os.makedirs(lock_dir, exist_ok=True)
+        # never removed while in use: a waiter would lock a deleted file
+        with utils.file_lock(os.path.join(lock_dir, f"{key}.lock")):
+            yield
+
+    def _prune_locks(self):
+        lock_dir = os.path.join(self.root, LOCK_DIR)
+        if not os.path.isdir(lock_dir):
+            return
+        now = time.time()
+        with os.scandir(lock_dir) as it:
+            for entry in it:
+                try:
+                    if now - entry.stat().st_mtime > LOCK_MAX_AGE:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def remove(self, key: str, ext: str = ""):
+        try:
+            os.remove(self.path(key, ext))
+        except OSError:
+            pass
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                # in-flight writes of other processes, unless they were abandoned long ago
+                if entry.name.endswith(TMP_SUFFIX) and time.time() - st.st_mtime < 3600:
+                    continue
+                entries.append((entry.path, st.st_size, st.st_mtime))
+        return entries
+
+    def evict(self):
+        """Remove least recently used files until the cache fits in max_bytes."""
+        self._prune_locks()
+        if self.max_bytes <= 0:
+            return
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+
+        entries.sort(key=lambda e: e[2])
+        for file_path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(file_path)
+                total -= size
+                logger.debug(f"evicted cache file: {file_path}")
+            except OSError:
+                # already removed by another process
+                pass
@@ -0,0 +1,165 @@
+"""
+Streaming HTTP downloads of material files.
+
+download() streams a URL into "{dest}.part" one chunk at a time and renames
+it to dest only once it is complete, so a file at dest is always whole.
+An interrupted transfer leaves the .part file behind, and the next attempt
+(a retry, or a later task wanting the same URL) continues it with a Range
+request instead of starting over. Every thread keeps its own pooled
+requests session, so repeated downloads from one host reuse connections.
+
+Threads and processes downloading the same destination take turns, the
+later ones finding the file already there.
+
+Downloads can be cancelled between chunks with a threading.Event, e.g. once
+enough materials have arrived; the .part file is kept for later.
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from loguru import logger
+
+from .config import config
+from . import resources
+from . import utils
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
+)
+# connect and read timeouts
+TIMEOUT = (60, 240)
+ATTEMPTS = 3
+RETRY_DELAY = 2.0
+
+_local = threading.local()
+# one download per destination at a time, concurrent tasks may want the same clip
+_dest_locks = {}
+_dest_locks_lock = threading.Lock()
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+def concurrency() -> int:
+    """Downloads to run at once, download_concurrency in the videoGeneration config."""
+    try:
+        return max(1, int(config.app.get("download_concurrency", 4) or 4))
+    except (TypeError, ValueError):
+        return 4
+
+
+def session() -> requests.Session:
+    """This thread's session, kept alive between downloads."""
+    s = getattr(_local, "session", None)
+    if s is None:
+        s = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        s.headers["User-Agent"] = USER_AGENT
+        _local.session = s
+    return s
+
+
+def _total_size(response: requests.Response, offset: int) -> Optional[int]:
+    """Full size of the file from Content-Range or Content-Length, None when unknown."""
+    content_range = response.headers.get("Content-Range", "")
+    match = re.search(r"/(\d+)$", content_range)
+    if match:
+        return int(match.group(1))
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit():
+        return offset + int(length)
+    return None
+
+
+def _fetch(url: str, part_file: str, cancel: Optional[threading.Event]) -> int:
+    """Continue part_file from its current size, returning the bytes received."""
+    offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with session().get(
+        url,
+        headers=headers,
+        proxies=config.proxy,
+        verify=False,
+        timeout=TIMEOUT,
+        stream=True,
+    ) as r:
+        if r.status_code == 416 and offset:
+            # nothing left to send: the part is already whole, or it is stale
+            if _total_size(r, 0) == offset:
+                return 0
+            # truncated rather than removed, waiting processes hold a lock on this file
+            open(part_file, "wb").close()
+            raise IOError(f"range not satisfiable, restarting {url}")
+        r.raise_for_status()
+        if offset and r.status_code != 206:
+            # the server ignored the range and sends everything
+            offset = 0
+        total = _total_size(r, offset)
+
+        received = 0
+        with open(part_file, "ab" if offset else "wb") as f:
+            for chunk in r.iter_content(chunk_size=resources.download_chunk_size()):
+                if cancel is not None and cancel.is_set():
+                    raise DownloadCancelled(url)
+                f.write(chunk)
+                received += len(chunk)
+
+    if total is not None and offset + received < total:
+        raise IOError(f"connection closed after {offset + received} of {total} bytes")
+    return received
+
+
+def _dest_lock(dest: str) -> threading.Lock:
+    with _dest_locks_lock:
+        return _dest_locks.setdefault(os.path.abspath(dest), threading.Lock())
+
+
+def download(url: str, dest: str, cancel: Optional[threading.Event] = None) -> int:
+    """
+    Download url to dest, atomically, retrying and resuming interrupted
+    transfers. Returns the bytes transferred by this call, 0 when another
+    thread downloaded dest meanwhile.
+    """
+    with _dest_lock(dest):
+        if os.path.exists(dest):
+            return 0
+        part_file = f"{dest}.part"
+        # other processes wanting dest wait here instead of writing the same part file
+        with utils.file_lock(part_file):
+            if os.path.exists(dest):
+                # finished by another process; drop the empty part file the lock created
+                if os.path.exists(part_file) and os.path.getsize(part_file) == 0:
+                    os.remove(part_file)
+                return 0
+            return _download(url, dest, cancel)
+
+
+def _download(url: str, dest: str, cancel: Optional[threading.Event]) -> int:
+    part_file = f"{dest}.part"
+    received = 0
+    for attempt in range(1, ATTEMPTS + 1):
+        try:
+            received += _fetch(url, part_file, cancel)
+            os.replace(part_file, dest)
+            return received
+        except IOError as e:
+            # requests errors are IOErrors too; a 4xx won't change on retry
+            response = getattr(e, "response", None)
+            if attempt == ATTEMPTS or (response is not None and response.status_code < 500):
+                raise
+            resumed_at = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+            logger.warning(
+                f"download interrupted at {resumed_at} bytes, resuming (attempt {attempt + 1}): {str(e)}"
+            )
+            time.sleep(RETRY_DELAY * attempt)
+    return received
@@ -0,0 +1,81 @@
+"""
+Frame transforms for fitting source footage into the output frame.
+
+Scale and offsets are computed once per segment. Scaling is normally left
+to the ffmpeg decoder (see decoder_resolution), so the per-frame work is
+one copy of the scaled pixels into a padded buffer that is allocated once
+and reused, instead of compositing a ColorClip background and a resized
+clip for every frame.
+"""
+
+from typing import Tuple
+
+import numpy as np
+from PIL import Image
+
+
+def fit_size(src_size: Tuple[int, int], dst_size: Tuple[int, int]) -> Tuple[int, int]:
+    """Return the size src_size scales to when fitted inside dst_size, keeping its aspect ratio."""
+    src_w, src_h = src_size
+    dst_w, dst_h = dst_size
+    src_ratio = src_w / src_h
+    dst_ratio = dst_w / dst_h
+
+    if src_ratio == dst_ratio:
+        return dst_w, dst_h
+    if src_ratio > dst_ratio:
+        scale_factor = dst_w / src_w
+    else:
+        scale_factor = dst_h / src_h
+    return int(src_w * scale_factor), int(src_h * scale_factor)
+
+
+class LetterboxTransform:
+    """
+    Place frames centered on a solid background of the output size.
+
+    Frames that don't already have the fitted size are resized first, so the
+    transform also works when the decoder did not scale. The returned array
+    is the shared buffer: consumers must use it before requesting the next
+    frame, which holds for moviepy's writers and effects.
+    """
+
+    def __init__(self, src_size: Tuple[int, int], dst_size: Tuple[int, int], color=(0, 0, 0)):
+        self.dst_size = tuple(dst_size)
+        self.fitted_size = fit_size(src_size, dst_size)
+        fitted_w, fitted_h = self.fitted_size
+        dst_w, dst_h = self.dst_size
+        # same placement as moviepy's "center" position
+        self.x = (dst_w - fitted_w) // 2
+        self.y = (dst_h - fitted_h) // 2
+        self.padded = self.fitted_size != self.dst_size
+        self.color = np.array(color, dtype=np.uint8)
+        self._buffer = None
+
+    def resize(self, frame: np.ndarray) -> np.ndarray:
+        fitted_w, fitted_h = self.fitted_size
+        if frame.shape[1] == fitted_w and frame.shape[0] == fitted_h:
+            return frame
+        resized = Image.fromarray(frame).resize(self.fitted_size, Image.Resampling.LANCZOS)
+        return np.asarray(resized)
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        frame = self.resize(frame)
+        if not self.padded:
+            return frame
+
+        if self._buffer is None:
+            dst_w, dst_h = self.dst_size
+            self._buffer = np.empty((dst_h, dst_w, 3), dtype=np.uint8)
+            self._buffer[:] = self.color
+        fitted_w, fitted_h = self.fitted_size
+        self._buffer[self.y:self.y + fitted_h, self.x:self.x + fitted_w] = frame[:, :, :3]
+        return self._buffer
+
+
+def decoder_resolution(src_size: Tuple[int, int], dst_size: Tuple[int, int]):
+    """Target resolution to have ffmpeg scale frames while decoding, or None when no scaling is needed."""
+    fitted = fit_size(src_size, dst_size)
+    if fitted == tuple(src_size):
+        return None
+    return fitted
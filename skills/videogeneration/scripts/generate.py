@@ -24,11 +24,13 @@ sys.path.insert(0, str(script_dir.parent))
 
 # Local module imports
 from scripts.verso_llm import generate_script, generate_terms
-from scripts.schema import VideoParams, VideoAspect, VideoConcatMode, MaterialInfo
-from scripts import utils
+from scripts.schema import VideoParams, VideoAspect, VideoConcatMode, VideoCutMode, VideoRenderMode, MaterialInfo
 from scripts import voice
 from scripts import material
+from scripts import material_store
 from scripts import video
+from scripts import resources
+from scripts import trace
 
 
 def load_verso_config() -> dict:
@@ -59,7 +61,7 @@ def cleanup_old_videos(output_base: Path, retention_days: int):
     for item in output_base.iterdir():
         # Clean up old videogeneration-* subfolders, new task-* subfolders, and final video files
         is_task_dir = item.is_dir() and (item.name.startswith("videogeneration-") or item.name.startswith("task-"))
-        is_final_video = item.is_file() and item.name.startswith("final-") and item.name.endswith(".mp4")
+        is_final_video = item.is_file() and item.name.startswith(("final-", "draft-")) and item.name.endswith(".mp4")
         
         if not (is_task_dir or is_final_video):
             continue
@@ -92,18 +94,12 @@ def cleanup_old_videos(output_base: Path, retention_days: int):
             continue
 
 
-def cleanup_cache_videos():
-    """Remove cached source videos after each run."""
-    cache_dir = utils.storage_dir("cache_videos")
-    if not os.path.exists(cache_dir):
-        return
+def trim_material_store():
+    """Evict least recently used source videos once the material library is over its quota."""
     try:
-        for entry in os.listdir(cache_dir):
-            path = os.path.join(cache_dir, entry)
-            if os.path.isfile(path):
-                os.remove(path)
+        material_store.store().evict()
     except Exception as e:
-        print(f"⚠️  Could not clean cache_videos: {e}")
+        print(f"⚠️  Could not trim the material library: {e}")
 
 
 def get_output_dir(config: dict, topic: str, custom_dir: str = None) -> tuple:
@@ -171,11 +167,12 @@ def generate_video_from_params(params: VideoParams, task_dir: str, config: dict)
     # Step 1: Generate or use provided script
     if not params.video_script:
         print("📝 Generating script with Verso LLM...")
-        params.video_script = generate_script(
-            params.video_subject,
-            params.video_language or "en",
-            paragraph_number=2
-        )
+        with trace.stage("script"):
+            params.video_script = generate_script(
+                params.video_subject,
+                params.video_language or "en",
+                paragraph_number=2
+            )
         result["script"] = params.video_script
     
     print(f"📜 Script: {params.video_script[:100]}...")
@@ -185,12 +182,13 @@ def generate_video_from_params(params: VideoParams, task_dir: str, config: dict)
         print("🔍 Generating search terms...")
         # Check if cinematic_style is enabled in config
         cinematic = config.get('_cinematic_style', False)
-        params.video_terms = generate_terms(
-            params.video_subject,
-            params.video_script,
-            amount=5,
-            cinematic_style=cinematic
-        )
+        with trace.stage("terms"):
+            params.video_terms = generate_terms(
+                params.video_subject,
+                params.video_script,
+                amount=5,
+                cinematic_style=cinematic
+            )
         result["terms"] = params.video_terms
     
     print(f"🏷️  Terms: {', '.join(params.video_terms)}")
@@ -198,12 +196,13 @@ def generate_video_from_params(params: VideoParams, task_dir: str, config: dict)
     # Step 3: Generate TTS audio
     print("🎙️  Generating voice narration...")
     audio_file = os.path.join(task_dir, "audio.mp3")
-    sub_maker = voice.tts(
-        text=params.video_script,
-        voice_name=params.voice_name or "en-US-JennyNeural",
-        voice_rate=params.voice_rate or 1.0,
-        voice_file=audio_file,
-    )
+    with trace.stage("audio"):
+        sub_maker = voice.tts(
+            text=params.video_script,
+            voice_name=params.voice_name or "en-US-JennyNeural",
+            voice_rate=params.voice_rate or 1.0,
+            voice_file=audio_file,
+        )
     
     if not sub_maker or not os.path.exists(audio_file):
         print("❌ TTS generation failed")
@@ -217,7 +216,8 @@ def generate_video_from_params(params: VideoParams, task_dir: str, config: dict)
     subtitle_file = os.path.join(task_dir, "subtitle.srt")
     if params.subtitle_enabled:
         print("📝 Generating subtitles...")
-        voice.create_subtitle(sub_maker, params.video_script, subtitle_file)
+        with trace.stage("subtitle"):
+            voice.create_subtitle(sub_maker, params.video_script, subtitle_file)
         if os.path.exists(subtitle_file):
             result["subtitle_path"] = subtitle_file
     
@@ -226,23 +226,30 @@ def generate_video_from_params(params: VideoParams, task_dir: str, config: dict)
     video_files = []
     
     if params.video_materials:
-        # Use provided local materials
-        for mat in params.video_materials:
-            if mat.url and os.path.exists(mat.url):
-                video_files.append(mat.url)
+        # Use provided local materials, images become slowly zooming clips
+        materials = [mat for mat in params.video_materials if mat.url and os.path.exists(mat.url)]
+        with trace.stage("materials"):
+            materials = video.preprocess_video(
+                materials,
+                clip_duration=params.video_clip_duration,
+                video_size=VideoAspect(params.video_aspect).to_resolution(),
+                workers=params.render_workers or 1,
+            )
+        video_files = [mat.url for mat in materials]
     else:
         # Download from stock video APIs
-        video_files = material.download_videos(
-            task_id=os.path.basename(task_dir),
-            search_terms=params.video_terms,
-            source=params.video_source,
-            video_aspect=params.video_aspect,
-            video_contact_mode=params.video_concat_mode,
-            audio_duration=audio_duration,
-            max_clip_duration=config.get('_min_clip_duration', 5),
-            quality_filter=config.get('_quality_filter', True),
-            diversity_threshold=config.get('_diversity_threshold', 0.3),
-        )
+        with trace.stage("materials"):
+            video_files = material.download_videos(
+                task_id=os.path.basename(task_dir),
+                search_terms=params.video_terms,
+                source=params.video_source,
+                video_aspect=params.video_aspect,
+                video_contact_mode=params.video_concat_mode,
+                audio_duration=audio_duration,
+                max_clip_duration=config.get('_min_clip_duration', 5),
+                quality_filter=config.get('_quality_filter', True),
+                diversity_threshold=config.get('_diversity_threshold', 0.3),
+            )
     
     if not video_files:
         print("❌ No video materials found")
@@ -250,6 +257,75 @@ def generate_video_from_params(params: VideoParams, task_dir: str, config: dict)
     
     print(f"📦 Found {len(video_files)} video clips")
     
+    # Record every planning decision so a draft can be re-rendered at full quality
+    plan_file = os.path.join(task_dir, "render_plan.json")
+    render_plan = video.plan_render(
+        video_files, audio_file, subtitle_file if params.subtitle_enabled else "", params
+    )
+    video.save_render_plan(render_plan, plan_file)
+    result["render_plan"] = plan_file
+    print(f"🗺️  Render plan: {plan_file} (seed {render_plan.seed})")
+
+    # A short teaser first, so the opening can be checked while the full video renders
+    if params.preview_duration and not params.draft:
+        preview_file = os.path.join(task_dir, "preview.mp4")
+        print(f"👀 Rendering {params.preview_duration:g}s preview...")
+        try:
+            with trace.stage("preview"):
+                video.render_preview(
+                    audio_path=audio_file,
+                    subtitle_path=subtitle_file if params.subtitle_enabled else "",
+                    output_file=preview_file,
+                    params=params,
+                    render_plan=render_plan,
+                    seconds=params.preview_duration,
+                )
+        except Exception as e:
+            print(f"⚠️  Preview failed: {e}")
+        if os.path.exists(preview_file):
+            result["preview"] = preview_file
+            print(f"👀 Preview: {preview_file}")
+
+    with trace.stage("video"):
+        result["videos"] = render_from_plan(params, render_plan, task_dir)
+    return result
+
+
+def render_from_plan(params: VideoParams, render_plan, task_dir: str) -> list:
+    """
+    Render the video described by a render plan.
+
+    Drafts are written to draft.mp4 so the full render (final.mp4) can later
+    be made from the same plan in the same task directory.
+    """
+    name = "draft" if params.draft else "final"
+    if not render_plan.segments:
+        print("❌ No usable video segments in the render plan")
+        return []
+    video_files = list(dict.fromkeys(segment.file_path for segment in render_plan.segments))
+    missing = [f for f in video_files if not os.path.exists(f)]
+    if missing:
+        print(f"❌ Planned video materials are missing: {', '.join(missing)}")
+        return []
+
+    audio_file = render_plan.audio_file
+    subtitle_file = render_plan.subtitle_file if params.subtitle_enabled else ""
+    final_video = os.path.join(task_dir, f"{name}.mp4")
+
+    if params.render_mode == VideoRenderMode.single_pass:
+        print(f"🎥 Rendering {name} video in a single pass...")
+        combined_video = os.path.join(task_dir, "combined.mp4") if params.keep_intermediates else ""
+        video.render_video(
+            video_paths=video_files,
+            audio_path=audio_file,
+            subtitle_path=subtitle_file,
+            output_file=final_video,
+            params=params,
+            combined_video_path=combined_video,
+            render_plan=render_plan,
+        )
+        return [final_video] if os.path.exists(final_video) else []
+
     # Step 6: Combine videos with audio
     print("🎥 Combining video clips...")
     combined_video = os.path.join(task_dir, "combined.mp4")
@@ -261,29 +337,30 @@ def generate_video_from_params(params: VideoParams, task_dir: str, config: dict)
         video_aspect=params.video_aspect,
         video_concat_mode=params.video_concat_mode,
         video_transition_mode=params.video_transition_mode,
-        max_clip_duration=5,
+        max_clip_duration=render_plan.max_clip_duration,
+        workers=params.render_workers or 1,
+        threads_per_worker=params.render_threads_per_worker or 0,
+        cut_mode=params.cut_mode,
+        draft=params.draft,
+        render_plan=render_plan,
     )
     
     if not os.path.exists(combined_video):
         print("❌ Video combining failed")
-        return result
+        return []
     
     # Step 7: Generate final video with subtitles
-    print("✨ Generating final video...")
-    final_video = os.path.join(task_dir, "final.mp4")
+    print(f"✨ Generating {name} video...")
     
     video.generate_video(
         video_path=combined_video,
         audio_path=audio_file,
-        subtitle_path=subtitle_file if params.subtitle_enabled else "",
+        subtitle_path=subtitle_file,
         output_file=final_video,
-        params=params,
+        params=video.params_for_plan(params, render_plan),
     )
     
-    if os.path.exists(final_video):
-        result["videos"].append(final_video)
-    
-    return result
+    return [final_video] if os.path.exists(final_video) else []
 
 
 def main():
@@ -311,11 +388,15 @@ Examples:
 
   # Chinese video with custom voice
   python3 generate.py --topic "人工智能" --language zh-CN --voice "zh-CN-YunxiNeural"
+
+  # Quick low-resolution draft, then the full render of exactly that draft
+  python3 generate.py --topic "AI" --draft
+  python3 generate.py --from-plan ~/Projects/tmp/task-AI-20250101-120000/render_plan.json
         """
     )
     
     # Basic options
-    parser.add_argument("--topic", required=True, help="Video topic/subject")
+    parser.add_argument("--topic", default=None, help="Video topic/subject (required unless --from-plan is given)")
     parser.add_argument("--language", default="en-US", help="Language code (e.g., en-US, zh-CN)")
     parser.add_argument("--voice", default="en-US-JennyNeural", help="Voice name for TTS")
     parser.add_argument("--aspect", choices=["portrait", "landscape"], default="portrait",
@@ -348,12 +429,44 @@ Examples:
                        help="Add cinematic descriptors to search terms for better aesthetics")
     parser.add_argument("--min-clip-duration", type=int, default=8,
                        help="Minimum duration for video clips in seconds")
+
+    # Performance options
+    parser.add_argument("--render-workers", type=int, default=config.get("renderWorkers", 1),
+                       help="Number of processes rendering video segments in parallel")
+    parser.add_argument("--render-mode", choices=["staged", "single-pass"], default=config.get("renderMode", "staged"),
+                       help="staged writes temp and combined clips; single-pass encodes the final video once")
+    parser.add_argument("--keep-intermediates", action="store_true", default=False,
+                       help="Also write combined.mp4 in single-pass mode (for debugging)")
+    parser.add_argument("--threads-per-worker", type=int, default=config.get("renderThreadsPerWorker", 0),
+                       help="Encoder threads per render worker (0 = split CPU cores evenly)")
+    parser.add_argument("--cut-mode", choices=["fixed", "keyframe"], default=config.get("cutMode", "fixed"),
+                       help="keyframe snaps cuts to source keyframes so untouched segments are stream copied")
+    parser.add_argument("--draft", action="store_true", default=False,
+                       help="Render a low-resolution, low-fps draft with a fast encoder preset")
+    parser.add_argument("--seed", type=int, default=None,
+                       help="Random seed for segment order, transitions and BGM choice")
+    parser.add_argument("--preview", type=float, default=config.get("previewSeconds", 0),
+                       help="Seconds of draft-quality preview to render before the full video (0 = off, the default)")
+    parser.add_argument("--memory-budget", type=int, default=config.get("renderMemoryBudgetMb", config.get("render_memory_budget_mb", 0)),
+                       help="Memory budget in MB; fewer workers and smaller buffers are used to stay under it (0 = no limit)")
+    parser.add_argument("--profile", type=str, default="",
+                       help="Comma-separated stages to run under cProfile (script, terms, audio, subtitle, materials, preview, video, or all)")
+    parser.add_argument("--from-plan", type=str, default=None,
+                       help="Render from a task's render_plan.json (e.g. the full render of a draft)")
     
     args = parser.parse_args()
     
     # Validate
+    if not args.topic and not args.from_plan:
+        parser.error("--topic is required unless --from-plan is given")
     if args.source == "local" and not args.materials:
         parser.error("--materials is required when --source=local")
+
+    resources.set_budget_mb(args.memory_budget)
+
+    if args.from_plan:
+        render_plan_main(args)
+        return
     
     # Setup directories
     output_base, task_dir_path = get_output_dir(config, args.topic, args.out_dir)
@@ -417,6 +530,15 @@ Examples:
         subtitle_enabled=not args.no_subtitle,
         bgm_file=args.bgm,
         font_name=args.font,
+        render_workers=args.render_workers,
+        render_threads_per_worker=args.threads_per_worker,
+        render_mode=VideoRenderMode(args.render_mode.replace("-", "_")),
+        keep_intermediates=args.keep_intermediates,
+        cut_mode=VideoCutMode(args.cut_mode),
+        draft=args.draft,
+        seed=args.seed,
+        preview_duration=args.preview,
+        profile_stages=[s.strip() for s in args.profile.split(",") if s.strip()],
     )
     
     # Store quality parameters in config for use in generate_video_from_params
@@ -425,47 +547,103 @@ Examples:
     config['_cinematic_style'] = args.cinematic_style
     config['_min_clip_duration'] = args.min_clip_duration
     
-    # Generate video
-    result = generate_video_from_params(params, task_dir, config)
-    
+    # Generate video, tracing every stage to trace.json in the task directory
+    with trace.task_trace(task_dir_path.name, os.path.join(task_dir, "trace.json"), params.profile_stages):
+        result = generate_video_from_params(params, task_dir, config)
+    
+    metadata = {
+        "topic": args.topic,
+        "script": result.get("script", ""),
+        "terms": result.get("terms", []),
+        "custom_script": bool(script_text),
+        "custom_terms": bool(video_terms),
+        "source": args.source,
+    }
+    publish_results(result, args.topic, output_base, task_dir_path, metadata, draft=params.draft)
+
+
+def render_plan_main(args):
+    """Re-render a task from its render_plan.json, e.g. the full-quality render of a draft."""
+    plan_path = Path(args.from_plan).expanduser().resolve()
+    if plan_path.is_dir():
+        plan_path = plan_path / "render_plan.json"
+    if not plan_path.exists():
+        print(f"❌ Render plan not found: {plan_path}")
+        sys.exit(1)
+
+    render_plan = video.load_render_plan(str(plan_path))
+    params = VideoParams(**render_plan.params)
+    # The plan fixes the content; only rendering options come from the command line
+    params.draft = args.draft
+    params.render_workers = args.render_workers
+    params.render_threads_per_worker = args.threads_per_worker
+    params.render_mode = VideoRenderMode(args.render_mode.replace("-", "_"))
+    params.keep_intermediates = args.keep_intermediates
+
+    task_dir_path = plan_path.parent
+    output_base = task_dir_path.parent
+    print(f"🎬 Rendering from plan: {plan_path}")
+    print(f"   Topic: {params.video_subject}")
+    print(f"   Seed: {render_plan.seed}, segments: {len(render_plan.segments)}")
+    print(f"   Quality: {'draft' if params.draft else 'full'}")
+    print()
+
+    profile_stages = [s.strip() for s in args.profile.split(",") if s.strip()]
+    # keep the original run's trace.json
+    with trace.task_trace(task_dir_path.name, str(task_dir_path / "trace-plan.json"), profile_stages):
+        with trace.stage("video"):
+            videos = render_from_plan(params, render_plan, str(task_dir_path))
+    result = {
+        "script": params.video_script,
+        "terms": params.video_terms or [],
+        "videos": videos,
+    }
+    metadata = {
+        "topic": params.video_subject,
+        "script": params.video_script,
+        "terms": params.video_terms or [],
+        "source": params.video_source,
+        "render_plan": str(plan_path),
+    }
+    publish_results(result, params.video_subject, output_base, task_dir_path, metadata, draft=params.draft)
+
+
+def publish_results(result: dict, topic: str, output_base: Path, task_dir_path: Path, metadata: dict, draft: bool = False):
+    """Copy rendered videos next to the task folders and save the task metadata."""
     if result.get("videos"):
         print()
         print("✅ Video generation complete!")
         
         # Create final video name with topic and timestamp
-        safe_topic = "".join(c if c.isalnum() else "_" for c in args.topic[:30]).strip("_")
+        safe_topic = "".join(c if c.isalnum() else "_" for c in topic[:30]).strip("_")
         timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        prefix = "draft" if draft else "final"
         
         # Copy videos to output directory (base)
         for i, video_path in enumerate(result["videos"], 1):
             if os.path.exists(video_path):
-                file_name = f"final-{safe_topic}-{timestamp}-{i}.mp4"
+                file_name = f"{prefix}-{safe_topic}-{timestamp}-{i}.mp4"
                 dest = output_base / file_name
                 shutil.copy(video_path, dest)
                 print(f"   📹 {dest}")
         
         # Save metadata to task folder
-        metadata = {
-            "topic": args.topic,
-            "script": result.get("script", ""),
-            "terms": result.get("terms", []),
-            "custom_script": bool(script_text),
-            "custom_terms": bool(video_terms),
-            "source": args.source,
-            "generated_at": datetime.now().isoformat(),
-        }
+        metadata = dict(metadata, draft=draft, generated_at=datetime.now().isoformat())
         with open(task_dir_path / "metadata.json", "w", encoding="utf-8") as f:
             json.dump(metadata, f, ensure_ascii=False, indent=2)
         
         print()
         print(f"📁 Task artifacts (logs, materials): {task_dir_path}")
         print(f"📁 Final video(s) directly in: {output_base}")
+        if draft:
+            print(f"🗺️  Full render of this draft: python3 generate.py --from-plan {task_dir_path / 'render_plan.json'}")
     else:
         print("❌ Video generation failed")
-        cleanup_cache_videos()
+        trim_material_store()
         sys.exit(1)
 
-    cleanup_cache_videos()
+    # recently used clips are kept, so a draft's render plan can still be rendered
+    trim_material_store()
 
 
 if __name__ == "__main__":
@@ -1,14 +1,21 @@
+import contextvars
 import os
 import random
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import List
 from urllib.parse import urlencode
 
 import requests
 from loguru import logger
-from moviepy.video.io.VideoFileClip import VideoFileClip
 
 from .config import config
 from .schema import MaterialInfo, VideoAspect, VideoConcatMode
+from . import downloader
+from . import material_store
+from . import probe
+from . import search_cache
+from . import trace
 from . import utils
 
 requested_count = 0
@@ -126,6 +133,47 @@ def get_api_key(cfg_key: str):
     return api_keys[requested_count % len(api_keys)]
 
 
+def parse_pexels_response(
+    response: dict,
+    minimum_duration: int,
+    video_aspect: VideoAspect = VideoAspect.portrait,
+    quality_filter: bool = True,
+) -> List[MaterialInfo]:
+    """Materials in a raw Pexels search response, e.g. one from the search cache."""
+    video_width, video_height = VideoAspect(video_aspect).to_resolution()
+    video_items = []
+    if "videos" not in response:
+        logger.error(f"search videos failed: {response}")
+        return video_items
+    videos = response["videos"]
+    # loop through each video in the result
+    for v in videos:
+        duration = v["duration"]
+        # check if video has desired minimum duration
+        if duration < minimum_duration:
+            continue
+        video_files = v["video_files"]
+        # loop through each url to determine the best quality
+        for video in video_files:
+            w = int(video["width"])
+            h = int(video["height"])
+            
+            # Exact resolution match as per user request to ensure visual consistency
+            if w == video_width and h == video_height:
+                item = MaterialInfo()
+                item.provider = "pexels"
+                item.url = video["link"]
+                item.duration = duration
+                video_items.append(item)
+                break
+    
+    # Apply quality filtering if enabled
+    if quality_filter and video_items:
+        video_items = filter_by_quality(video_items, minimum_duration)
+    
+    return video_items
+
+
 def search_videos_pexels(
     search_term: str,
     minimum_duration: int,
@@ -133,58 +181,31 @@ def search_videos_pexels(
     quality_filter: bool = True,
 ) -> List[MaterialInfo]:
     aspect = VideoAspect(video_aspect)
-    video_orientation = aspect.name
-    video_width, video_height = aspect.to_resolution()
-    api_key = get_api_key("pexels_api_keys")
-    headers = {
-        "Authorization": api_key,
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
-    }
     # Build URL - request more results for better filtering
-    params = {"query": search_term, "per_page": 50, "orientation": video_orientation}
-    query_url = f"https://api.pexels.com/videos/search?{urlencode(params)}"
-    logger.info(f"searching videos: {query_url}, with proxies: {config.proxy}")
+    params = {"query": search_term, "per_page": 50, "orientation": aspect.name}
+
+    def fetch():
+        api_key = get_api_key("pexels_api_keys")
+        headers = {
+            "Authorization": api_key,
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
+        }
+        query_url = f"https://api.pexels.com/videos/search?{urlencode(params)}"
+        logger.info(f"searching videos: {query_url}, with proxies: {config.proxy}")
+        with trace.span("search", provider="pexels", term=search_term):
+            r = requests.get(
+                query_url,
+                headers=headers,
+                proxies=config.proxy,
+                verify=False,
+                timeout=(30, 60),
+            )
+            return r.json()
 
     try:
-        r = requests.get(
-            query_url,
-            headers=headers,
-            proxies=config.proxy,
-            verify=False,
-            timeout=(30, 60),
-        )
-        response = r.json()
-        video_items = []
-        if "videos" not in response:
-            logger.error(f"search videos failed: {response}")
-            return video_items
-        videos = response["videos"]
-        logger.info(f"Pexels search for '{search_term}' returned {len(videos)} raw videos")
-        # loop through each video in the result
-        for v in videos:
-            duration = v["duration"]
-            # check if video has desired minimum duration
-            if duration < minimum_duration:
-                continue
-            video_files = v["video_files"]
-            # loop through each url to determine the best quality
-            for video in video_files:
-                w = int(video["width"])
-                h = int(video["height"])
-                
-                # Exact resolution match as per user request to ensure visual consistency
-                if w == video_width and h == video_height:
-                    item = MaterialInfo()
-                    item.provider = "pexels"
-                    item.url = video["link"]
-                    item.duration = duration
-                    video_items.append(item)
-                    break
-        
-        # Apply quality filtering if enabled
-        if quality_filter and video_items:
-            video_items = filter_by_quality(video_items, minimum_duration)
-        
+        response = search_cache.search("pexels", params, fetch, valid=lambda r: "videos" in r)
+        video_items = parse_pexels_response(response, minimum_duration, aspect, quality_filter)
+        logger.info(f"Pexels search for '{search_term}' returned {len(video_items)} videos")
         return video_items
     except Exception as e:
         logger.error(f"search videos failed: {str(e)}")
@@ -192,6 +213,48 @@ def search_videos_pexels(
     return []
 
 
+def parse_pixabay_response(
+    response: dict,
+    minimum_duration: int,
+    video_aspect: VideoAspect = VideoAspect.portrait,
+    quality_filter: bool = True,
+) -> List[MaterialInfo]:
+    """Materials in a raw Pixabay search response, e.g. one from the search cache."""
+    video_width, video_height = VideoAspect(video_aspect).to_resolution()
+    video_items = []
+    if "hits" not in response:
+        logger.error(f"search videos failed: {response}")
+        return video_items
+    videos = response["hits"]
+    # loop through each video in the result
+    for v in videos:
+        duration = v["duration"]
+        # check if video has desired minimum duration
+        if duration < minimum_duration:
+            continue
+        video_files = v["videos"]
+        # loop through each url to determine the best quality
+        for video_type in video_files:
+            video = video_files[video_type]
+            w = int(video["width"])
+            h = int(video["height"])
+            
+            # Exact resolution match as per user request to ensure visual consistency
+            if w == video_width and h == video_height:
+                item = MaterialInfo()
+                item.provider = "pixabay"
+                item.url = video["url"]
+                item.duration = duration
+                video_items.append(item)
+                break
+    
+    # Apply quality filtering if enabled
+    if quality_filter and video_items:
+        video_items = filter_by_quality(video_items, minimum_duration)
+    
+    return video_items
+
+
 def search_videos_pixabay(
     search_term: str,
     minimum_duration: int,
@@ -199,69 +262,44 @@ def search_videos_pixabay(
     quality_filter: bool = True,
 ) -> List[MaterialInfo]:
     aspect = VideoAspect(video_aspect)
-
-    video_width, video_height = aspect.to_resolution()
-
-    api_key = get_api_key("pixabay_api_keys")
-    # Build URL
+    # Build URL, the api key is added when requesting so it stays out of the cache key
     params = {
         "q": search_term,
         "video_type": "all",  # Accepted values: "all", "film", "animation"
         "per_page": 50,
-        "key": api_key,
     }
-    query_url = f"https://pixabay.com/api/videos/?{urlencode(params)}"
-    logger.info(f"searching videos: {query_url}, with proxies: {config.proxy}")
+
+    def fetch():
+        api_key = get_api_key("pixabay_api_keys")
+        query_url = f"https://pixabay.com/api/videos/?{urlencode({**params, 'key': api_key})}"
+        logger.info(f"searching videos: {query_url}, with proxies: {config.proxy}")
+        with trace.span("search", provider="pixabay", term=search_term):
+            r = requests.get(
+                query_url, proxies=config.proxy, verify=False, timeout=(30, 60)
+            )
+            return r.json()
 
     try:
-        r = requests.get(
-            query_url, proxies=config.proxy, verify=False, timeout=(30, 60)
-        )
-        response = r.json()
-        video_items = []
-        if "hits" not in response:
-            logger.error(f"search videos failed: {response}")
-            return video_items
-        videos = response["hits"]
-        # loop through each video in the result
-        for v in videos:
-            duration = v["duration"]
-            # check if video has desired minimum duration
-            if duration < minimum_duration:
-                continue
-            video_files = v["videos"]
-            # loop through each url to determine the best quality
-            for video_type in video_files:
-                video = video_files[video_type]
-                w = int(video["width"])
-                h = int(video["height"])
-                
-                # Exact resolution match as per user request to ensure visual consistency
-                if w == video_width and h == video_height:
-                    item = MaterialInfo()
-                    item.provider = "pixabay"
-                    item.url = video["url"]
-                    item.duration = duration
-                    video_items.append(item)
-                    break
-        
-        # Apply quality filtering if enabled
-        if quality_filter and video_items:
-            video_items = filter_by_quality(video_items, minimum_duration)
-        
-        return video_items
+        response = search_cache.search("pixabay", params, fetch, valid=lambda r: "hits" in r)
+        return parse_pixabay_response(response, minimum_duration, aspect, quality_filter)
     except Exception as e:
         logger.error(f"search videos failed: {str(e)}")
 
     return []
 
 
-def save_video(video_url: str, save_dir: str = "") -> str:
+def save_video(video_url: str, save_dir: str = "", cancel: threading.Event = None) -> str:
+    """
+    Download a material and return its path, "" when the file isn't a
+    usable video. Without save_dir the material library (material_store)
+    is used, so clips downloaded by earlier tasks are reused. Raises
+    downloader.DownloadCancelled once cancel is set.
+    """
     if not save_dir:
-        save_dir = utils.storage_dir("cache_videos")
+        return _save_to_store(video_url, cancel)
 
     if not os.path.exists(save_dir):
-        os.makedirs(save_dir)
+        os.makedirs(save_dir, exist_ok=True)
 
     url_without_query = video_url.split("?")[0]
     url_hash = utils.md5(url_without_query)
@@ -271,31 +309,15 @@ def save_video(video_url: str, save_dir: str = "") -> str:
     # if video already exists, return the path
     if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
         logger.info(f"video already exists: {video_path}")
+        trace.add("material_cache_hits")
         return video_path
 
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
-    }
-
-    # if video does not exist, download it
-    with open(video_path, "wb") as f:
-        f.write(
-            requests.get(
-                video_url,
-                headers=headers,
-                proxies=config.proxy,
-                verify=False,
-                timeout=(60, 240),
-            ).content
-        )
+    _download(video_url, video_path, cancel)
 
     if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
         try:
-            clip = VideoFileClip(video_path)
-            duration = clip.duration
-            fps = clip.fps
-            clip.close()
-            if duration > 0 and fps > 0:
+            info = probe.probe(video_path)
+            if info.duration > 0 and info.fps > 0:
                 return video_path
         except Exception as e:
             try:
@@ -306,6 +328,44 @@ def save_video(video_url: str, save_dir: str = "") -> str:
     return ""
 
 
+def _save_to_store(video_url: str, cancel: threading.Event = None) -> str:
+    store = material_store.store()
+    with store.url_lock(video_url):
+        video_path = store.lookup(video_url)
+        if video_path:
+            logger.info(f"video already exists: {video_path}")
+            trace.add("material_cache_hits")
+            return video_path
+
+        incoming_path = store.incoming_path(video_url)
+        _download(video_url, incoming_path, cancel)
+        if not os.path.exists(incoming_path) or os.path.getsize(incoming_path) <= 0:
+            return ""
+        try:
+            return store.add(video_url, incoming_path)
+        except Exception as e:
+            logger.warning(str(e))
+    return ""
+
+
+def _download(video_url: str, video_path: str, cancel: threading.Event = None):
+    # streamed to a .part file renamed once complete, an interrupted download is resumed next time
+    logger.info(f"downloading video: {video_url}")
+    with trace.span("download", url=video_url.split("?")[0]) as span:
+        downloaded = downloader.download(video_url, video_path, cancel)
+    span.attrs["bytes"] = downloaded
+    trace.add("bytes_downloaded", downloaded)
+    trace.add("material_downloads")
+
+
+def search_concurrency() -> int:
+    """Searches to run at once, search_concurrency in the videoGeneration config."""
+    try:
+        return max(1, int(config.app.get("search_concurrency", 5) or 5))
+    except (TypeError, ValueError):
+        return 5
+
+
 def download_videos(
     task_id: str,
     search_terms: List[str],
@@ -317,102 +377,176 @@ def download_videos(
     quality_filter: bool = True,
     diversity_threshold: float = 0.3,
     video_subject: str = "",
+    cancel: threading.Event = None,
 ) -> List[str]:
-    valid_video_items = []
-    valid_video_urls = []
-    found_duration = 0.0
+    """
+    Search every term and download materials for audio_duration seconds of
+    narration, as one pipeline: the searches run concurrently, their
+    results go through the duplicate and diversity checks as they arrive,
+    and downloads start with the first results instead of after the last
+    search. The subject is searched as a fallback when the terms don't
+    find enough footage. Everything stops once enough has been downloaded.
+    With sequential concat, paths are returned in search order (term, then
+    result) whichever search answered first; with random concat the
+    candidates of all searches are downloaded in random order. Setting
+    cancel stops the searches and downloads, and nothing is returned.
+    """
     search_videos = search_videos_pexels
     if source == "pixabay":
         search_videos = search_videos_pixabay
 
-    # 1. Primary search using generated terms
-    for search_term in search_terms:
-        video_items = search_videos(
-            search_term=search_term,
-            minimum_duration=max_clip_duration,
-            video_aspect=video_aspect,
-            quality_filter=quality_filter,
-        )
-        logger.info(f"found {len(video_items)} videos for '{search_term}'")
-
-        for item in video_items:
-            if item.url not in valid_video_urls:
-                # Apply diversity check if enabled
-                if diversity_threshold > 0:
-                    diversity_score = calculate_diversity_score(
-                        valid_video_items, item, diversity_threshold
-                    )
-                    if diversity_score < diversity_threshold:
-                        logger.info(f"skipping similar video (diversity: {diversity_score:.2f}): {item.url[:50]}")
-                        continue
-                
-                valid_video_items.append(item)
-                valid_video_urls.append(item.url)
-                found_duration += item.duration
-
-    # 2. Fallback search using video_subject if we don't have enough potential material
+    material_directory = config.app.get("material_directory", "").strip()
+    if material_directory == "task":
+        material_directory = utils.task_dir(task_id)
+    elif material_directory and not os.path.isdir(material_directory):
+        material_directory = ""
+
     # We check if found_duration (total raw length) is at least 3x the required audio duration
     # to ensure we have enough "room" for high-quality variety.
     required_raw_duration = audio_duration * 3.0
-    if video_subject and found_duration < required_raw_duration:
-        logger.info(f"insufficient material found ({found_duration:.2f}s < {required_raw_duration:.2f}s), performing fallback search with subject: '{video_subject}'")
-        fallback_items = search_videos(
-            search_term=video_subject,
+    # Increase redundancy to 200% (2.0x) to ensure variety
+    required_duration = audio_duration * 2.0
+    # Also ensure we have at least a decent number of unique sources
+    # (e.g., 10) if the API has them, to avoid relying on too few videos.
+    min_unique_sources = 10
+
+    valid_video_items = []
+    valid_video_urls = set()
+    found_duration = 0.0
+    # (order key, item) waiting for a download slot; search order, or random for random concat
+    random_order = video_contact_mode.value == VideoConcatMode.random.value
+    candidates = []
+    saved_paths = {}
+    total_duration = 0.0
+    enough = threading.Event()
+    fallback_searched = not video_subject
+
+    def accept(rank, video_items, fallback=False):
+        nonlocal found_duration
+        for position, item in enumerate(video_items):
+            if item.url in valid_video_urls:
+                continue
+            # Apply diversity check if enabled, the fallback only fills up
+            if diversity_threshold > 0 and not fallback:
+                diversity_score = calculate_diversity_score(
+                    valid_video_items, item, diversity_threshold
+                )
+                if diversity_score < diversity_threshold:
+                    logger.info(f"skipping similar video (diversity: {diversity_score:.2f}): {item.url[:50]}")
+                    continue
+
+            valid_video_items.append(item)
+            valid_video_urls.add(item.url)
+            found_duration += item.duration
+            candidates.append(((random.random(), 0) if random_order else (rank, position), item))
+            if fallback and found_duration >= required_raw_duration * 2:  # Stop if we found plenty
+                break
+        # popped from the end
+        candidates.sort(key=lambda c: c[0], reverse=True)
+
+    searches = {}
+    downloads = {}
+    search_executor = ThreadPoolExecutor(max_workers=search_concurrency())
+    download_executor = ThreadPoolExecutor(max_workers=downloader.concurrency())
+
+    def search(rank, search_term):
+        future = search_executor.submit(
+            contextvars.copy_context().run,
+            search_videos,
+            search_term=search_term,
             minimum_duration=max_clip_duration,
             video_aspect=video_aspect,
             quality_filter=quality_filter,
         )
-        for item in fallback_items:
-            if item.url not in valid_video_urls:
-                valid_video_items.append(item)
-                valid_video_urls.append(item.url)
-                found_duration += item.duration
-                if found_duration >= required_raw_duration * 2: # Stop if we found plenty
-                    break
+        searches[future] = (rank, search_term)
+
+    try:
+        # 1. Primary search using generated terms, all at once
+        for rank, search_term in enumerate(search_terms):
+            search(rank, search_term)
+        # without terms, the subject is all there is to search
+        if not searches and not fallback_searched:
+            fallback_searched = True
+            search(len(search_terms), video_subject)
+
+        while searches or downloads or (candidates and not enough.is_set()):
+            if cancel is not None and cancel.is_set() and not enough.is_set():
+                logger.info("material download cancelled")
+                enough.set()
+                candidates.clear()
+                searches.clear()
+
+            # start downloads as soon as there are candidates
+            while candidates and not enough.is_set() and len(downloads) < downloader.concurrency():
+                key, item = candidates.pop()
+                future = download_executor.submit(
+                    contextvars.copy_context().run,
+                    save_video,
+                    video_url=item.url,
+                    save_dir=material_directory,
+                    cancel=enough,
+                )
+                downloads[future] = (key, item)
+
+            # wake up now and then to notice cancel
+            done, _ = wait(
+                list(searches) + list(downloads),
+                timeout=0.5 if cancel is not None else None,
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                if future in searches:
+                    rank, search_term = searches.pop(future)
+                    try:
+                        video_items = future.result()
+                    except Exception as e:
+                        logger.error(f"search videos failed: {str(e)}")
+                        video_items = []
+                    logger.info(f"found {len(video_items)} videos for '{search_term}'")
+                    if not enough.is_set():
+                        accept(rank, video_items, fallback=rank == len(search_terms))
+                    continue
+
+                key, item = downloads.pop(future)
+                try:
+                    saved_video_path = future.result()
+                except downloader.DownloadCancelled:
+                    continue
+                except Exception as e:
+                    logger.error(f"failed to download video: {utils.to_json(item)} => {str(e)}")
+                    continue
+                if saved_video_path:
+                    logger.info(f"video saved: {saved_video_path}")
+                    saved_paths[key] = saved_video_path
+                    # Now we count the FULL duration since we utilize ALL segments
+                    # of the video in the final render.
+                    total_duration += item.duration
+
+            if not enough.is_set() and total_duration >= required_duration and len(saved_paths) >= min_unique_sources:
+                logger.info(
+                    f"downloaded sufficient videos: {total_duration:.2f}s >= {required_duration:.2f}s and {len(saved_paths)} unique sources (audio: {audio_duration:.2f}s)"
+                )
+                # cancels the downloads still running, searches still running are ignored
+                enough.set()
+                candidates.clear()
+                searches.clear()
+
+            # 2. Fallback search using video_subject once the terms turned out not to be enough
+            if not searches and not fallback_searched and found_duration < required_raw_duration and not enough.is_set():
+                logger.info(f"insufficient material found ({found_duration:.2f}s < {required_raw_duration:.2f}s), performing fallback search with subject: '{video_subject}'")
+                fallback_searched = True
+                search(len(search_terms), video_subject)
+    finally:
+        search_executor.shutdown(wait=False, cancel_futures=True)
+        download_executor.shutdown(wait=True)
+
+    if cancel is not None and cancel.is_set():
+        return []
 
     logger.info(
         f"found total videos: {len(valid_video_items)}, required duration: {audio_duration} seconds, found duration: {found_duration} seconds"
     )
-    video_paths = []
-
-    material_directory = config.app.get("material_directory", "").strip()
-    if material_directory == "task":
-        material_directory = utils.task_dir(task_id)
-    elif material_directory and not os.path.isdir(material_directory):
-        material_directory = ""
-
-    if video_contact_mode.value == VideoConcatMode.random.value:
-        random.shuffle(valid_video_items)
-
-    total_duration = 0.0
-    for item in valid_video_items:
-        try:
-            logger.info(f"downloading video: {item.url}")
-            saved_video_path = save_video(
-                video_url=item.url, save_dir=material_directory
-            )
-            if saved_video_path:
-                logger.info(f"video saved: {saved_video_path}")
-                video_paths.append(saved_video_path)
-                
-                # Now we count the FULL duration since we utilize ALL segments
-                # of the video in the final render.
-                total_duration += item.duration
-                
-                # Increase redundancy to 200% (2.0x) to ensure variety
-                required_duration = audio_duration * 2.0
-                
-                # Also ensure we have at least a decent number of unique sources
-                # (e.g., 10) if the API has them, to avoid relying on too few videos.
-                min_unique_sources = 10
-                
-                if total_duration >= required_duration and len(video_paths) >= min_unique_sources:
-                    logger.info(
-                        f"downloaded sufficient videos: {total_duration:.2f}s >= {required_duration:.2f}s and {len(video_paths)} unique sources (audio: {audio_duration:.2f}s)"
-                    )
-                    break
-        except Exception as e:
-            logger.error(f"failed to download video: {utils.to_json(item)} => {str(e)}")
+    video_paths = [saved_paths[key] for key in sorted(saved_paths)]
     logger.success(f"downloaded {len(video_paths)} videos")
     return video_paths
 
@@ -0,0 +1,234 @@
+"""
+Content-addressed library of downloaded materials.
+
+Downloaded clips are kept in storage/cache_videos under the sha1 of their
+content, so the same clip reached through different URLs is stored once.
+index.json maps source URLs to clips and records each clip's size, last
+access and probe metadata. Instead of wiping the library after every run,
+least recently used clips are evicted once it grows beyond
+material_store_max_mb (default 4096) in the videoGeneration config, so
+repeat topics reuse local clips instead of downloading them again.
+
+Several tasks and processes can share the library: a url is fetched
+under a lock file of its own, so it is downloaded once, index updates
+hold a file lock, clips are moved in with os.replace, and clips used
+within the last hour are never evicted, as a running task may still read
+them.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict
+from typing import List, Optional
+
+from loguru import logger
+
+from .config import config
+from . import probe
+from . import trace
+from . import utils
+
+INDEX_VERSION = 1
+INDEX_FILE = "index.json"
+LOCK_FILE = ".lock"
+INCOMING_DIR = "incoming"
+# clips used this recently may belong to a running task
+RECENT_SECONDS = 3600
+# unfinished downloads are kept this long for resuming
+INCOMING_MAX_AGE = 24 * 3600
+
+_thread_lock = threading.Lock()
+# one lookup-download-add per url at a time, concurrent tasks may want the same clip;
+# the thread locks come before the file locks, which serialize processes
+_url_locks = {}
+_url_locks_lock = threading.Lock()
+
+
+def _sha1(file_path: str) -> str:
+    h = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class MaterialStore:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(self.root, INCOMING_DIR), exist_ok=True)
+
+    @staticmethod
+    def url_key(url: str) -> str:
+        return utils.md5(url.split("?")[0])
+
+    def incoming_path(self, url: str) -> str:
+        """Where to download url before add() moves it into the library."""
+        return os.path.join(self.root, INCOMING_DIR, f"vid-{self.url_key(url)}.mp4")
+
+    @contextmanager
+    def url_lock(self, url: str):
+        """Held while fetching url into the library, so it is downloaded once by all processes."""
+        url_key = self.url_key(url)
+        with _url_locks_lock:
+            lock = _url_locks.setdefault(url_key, threading.Lock())
+        with lock, utils.file_lock(os.path.join(self.root, INCOMING_DIR, f"vid-{url_key}.lock")):
+            yield
+
+    def _clip_path(self, digest: str) -> str:
+        return os.path.join(self.root, f"{digest}.mp4")
+
+    @contextmanager
+    def _index(self):
+        """The index, locked against other threads and processes, saved afterwards."""
+        with _thread_lock, utils.file_lock(os.path.join(self.root, LOCK_FILE)):
+            index = self._load_index()
+            yield index
+            self._save_index(index)
+
+    def _load_index(self) -> dict:
+        index_file = os.path.join(self.root, INDEX_FILE)
+        if os.path.exists(index_file):
+            try:
+                with open(index_file, "r", encoding="utf-8") as f:
+                    index = json.load(f)
+                if index.get("version") == INDEX_VERSION:
+                    return index
+            except Exception as e:
+                logger.warning(f"rebuilding corrupt material index {index_file}: {str(e)}")
+        # clips of a lost index are picked up again as unindexed files by evict()
+        return {"version": INDEX_VERSION, "urls": {}, "clips": {}}
+
+    def _save_index(self, index: dict):
+        index_file = os.path.join(self.root, INDEX_FILE)
+        tmp_file = f"{index_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_file, index_file)
+
+    def lookup(self, url: str) -> Optional[str]:
+        """The stored clip of url, marked as just used, or None."""
+        url_key = self.url_key(url)
+        with self._index() as index:
+            digest = index["urls"].get(url_key)
+            clip = index["clips"].get(digest) if digest else None
+            if clip is not None:
+                clip_path = self._clip_path(digest)
+                if os.path.exists(clip_path):
+                    clip["last_access"] = time.time()
+                    return clip_path
+                # removed behind our back
+                index["clips"].pop(digest, None)
+            index["urls"].pop(url_key, None)
+
+        # plain vid-<md5>.mp4 file of the layout before the index
+        legacy_path = os.path.join(self.root, f"vid-{url_key}.mp4")
+        if os.path.exists(legacy_path) and os.path.getsize(legacy_path) > 0:
+            try:
+                return self.add(url, legacy_path)
+            except Exception as e:
+                # add() removes a file it rejects, the legacy file is only left when hashing failed
+                logger.warning(f"dropping unusable cached video {legacy_path}: {str(e)}")
+                if os.path.exists(legacy_path):
+                    os.remove(legacy_path)
+        return None
+
+    def add(self, url: str, src: str) -> str:
+        """
+        Move the downloaded file src into the library as the clip of url and
+        return its path. Raises ValueError, removing src, when it isn't a
+        usable video.
+        """
+        digest = _sha1(src)
+        clip_path = self._clip_path(digest)
+        # identical content from another url or task, replacing it is harmless
+        os.replace(src, clip_path)
+        try:
+            info = probe.probe(clip_path)
+            if info.duration <= 0 or info.fps <= 0:
+                raise ValueError("no video stream")
+        except Exception as e:
+            os.remove(clip_path)
+            raise ValueError(f"invalid video file: {url} => {str(e)}")
+
+        metadata = {k: v for k, v in asdict(info).items() if k not in ("path", "keyframes", "content_hash")}
+        with self._index() as index:
+            clip = index["clips"].setdefault(digest, {"added": time.time(), "urls": []})
+            url_key = self.url_key(url)
+            if url_key not in clip["urls"]:
+                clip["urls"].append(url_key)
+            clip.update(size=os.path.getsize(clip_path), last_access=time.time(), probe=metadata)
+            index["urls"][url_key] = digest
+        self.evict()
+        return clip_path
+
+    def entries(self) -> List[dict]:
+        """Stored clips with their path, size, last access, urls and probe metadata."""
+        with self._index() as index:
+            return [
+                dict(clip, path=self._clip_path(digest), sha1=digest)
+                for digest, clip in index["clips"].items()
+            ]
+
+    def evict(self):
+        """Remove least recently used clips until the library fits in max_bytes."""
+        now = time.time()
+        removed = 0
+        with self._index() as index:
+            candidates = [
+                (clip.get("last_access", 0), clip.get("size", 0), self._clip_path(digest), digest)
+                for digest, clip in index["clips"].items()
+            ]
+            total = sum(size for _, size, _, _ in candidates)
+            indexed = {os.path.basename(path) for _, _, path, _ in candidates}
+            with os.scandir(self.root) as it:
+                for entry in it:
+                    if not entry.is_file() or entry.name in indexed or not entry.name.endswith(".mp4"):
+                        continue
+                    # files of an older layout or of a lost index, evicted in LRU order too
+                    st = entry.stat()
+                    candidates.append((st.st_mtime, st.st_size, entry.path, None))
+                    total += st.st_size
+
+            candidates.sort()
+            for last_access, size, clip_path, digest in candidates:
+                if total <= self.max_bytes or now - last_access < RECENT_SECONDS:
+                    break
+                try:
+                    os.remove(clip_path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"failed to evict {clip_path}: {str(e)}")
+                    continue
+                total -= size
+                removed += 1
+                if digest is not None:
+                    for url_key in index["clips"].pop(digest).get("urls", []):
+                        index["urls"].pop(url_key, None)
+
+        incoming = os.path.join(self.root, INCOMING_DIR)
+        for name in os.listdir(incoming):
+            file_path = os.path.join(incoming, name)
+            try:
+                if now - os.path.getmtime(file_path) > INCOMING_MAX_AGE:
+                    os.remove(file_path)
+            except OSError:
+                pass
+
+        if removed:
+            trace.add("material_store_evictions", removed)
+            logger.info(f"evicted {removed} clips from the material store, {total / 1024 / 1024:.0f} MB left")
+
+
+def store() -> MaterialStore:
+    """The material library in storage/cache_videos, sized by material_store_max_mb."""
+    try:
+        max_mb = max(0.0, float(config.app.get("material_store_max_mb", 4096)))
+    except (TypeError, ValueError):
+        max_mb = 4096
+    return MaterialStore(utils.storage_dir("cache_videos", create=True), int(max_mb * 1024 * 1024))
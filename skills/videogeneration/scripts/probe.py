@@ -0,0 +1,216 @@
+"""
+Media probing with a persistent on-disk cache.
+
+Every probe used to spawn ffmpeg, and the same file is typically probed
+several times per task (material validation, segment planning, concat
+checks). Results are cached in memory and under storage/cache_probe, keyed
+by the file's absolute path, size and mtime, so a changed file is re-probed
+automatically.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+from dataclasses import asdict, dataclass, fields
+from typing import List, Optional
+
+from loguru import logger
+from moviepy.config import FFMPEG_BINARY
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from . import trace
+from . import utils
+
+# bump when MediaInfo fields change so stale cache entries are ignored
+PROBE_VERSION = 2
+
+_lock = threading.Lock()
+_memory_cache = {}
+
+
+@dataclass
+class MediaInfo:
+    path: str = ""
+    duration: float = 0.0
+    fps: float = 0.0
+    width: int = 0
+    height: int = 0
+    video_codec: str = ""
+    video_profile: str = ""
+    has_video: bool = False
+    has_audio: bool = False
+    audio_fps: int = 0
+    content_hash: str = ""
+    # None until requested, keyframe probing reads the whole file
+    keyframes: Optional[List[float]] = None
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+
+def _cache_dir() -> str:
+    return utils.storage_dir("cache_probe", create=True)
+
+
+def _cache_key(file_path: str) -> str:
+    st = os.stat(file_path)
+    return utils.md5(f"{os.path.abspath(file_path)}|{st.st_size}|{st.st_mtime_ns}|v{PROBE_VERSION}")
+
+
+def _load(key: str) -> Optional[MediaInfo]:
+    with _lock:
+        info = _memory_cache.get(key)
+    if info is not None:
+        return info
+
+    cache_file = os.path.join(_cache_dir(), f"{key}.json")
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        names = {f.name for f in fields(MediaInfo)}
+        info = MediaInfo(**{k: v for k, v in data.items() if k in names})
+    except Exception as e:
+        logger.warning(f"ignoring corrupt probe cache entry {cache_file}: {str(e)}")
+        return None
+
+    with _lock:
+        _memory_cache[key] = info
+    return info
+
+
+def _store(key: str, info: MediaInfo):
+    with _lock:
+        _memory_cache[key] = info
+
+    cache_file = os.path.join(_cache_dir(), f"{key}.json")
+    tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(asdict(info), f)
+        os.replace(tmp_file, cache_file)
+    except Exception as e:
+        logger.warning(f"failed to write probe cache entry {cache_file}: {str(e)}")
+        try:
+            os.remove(tmp_file)
+        except Exception:
+            pass
+
+
+def _probe_streams(file_path: str) -> MediaInfo:
+    infos = ffmpeg_parse_infos(file_path)
+    size = infos.get("video_size") or [0, 0]
+    # ffmpeg applies rotation metadata when decoding, report the displayed size
+    if abs(infos.get("video_rotation", 0)) in (90, 270):
+        size = [size[1], size[0]]
+    return MediaInfo(
+        path=os.path.abspath(file_path),
+        duration=float(infos.get("duration") or 0.0),
+        fps=float(infos.get("video_fps") or 0.0),
+        width=int(size[0]),
+        height=int(size[1]),
+        video_codec=infos.get("video_codec_name") or "",
+        video_profile=infos.get("video_profile") or "",
+        has_video=bool(infos.get("video_found")),
+        has_audio=bool(infos.get("audio_found")),
+        audio_fps=int(infos.get("audio_fps") or 0),
+    )
+
+
+def _probe_keyframes(file_path: str) -> List[float]:
+    """Return the presentation times of the first video stream's keyframes."""
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe:
+        # packet flags come from the container index, nothing is decoded
+        result = subprocess.run(
+            [
+                ffprobe, "-v", "error", "-select_streams", "v:0",
+                "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0",
+                file_path,
+            ],
+            check=True,
+            capture_output=True,
+        )
+        keyframes = []
+        for line in result.stdout.decode("utf-8", errors="ignore").splitlines():
+            parts = line.strip().split(",")
+            if len(parts) >= 2 and "K" in parts[1] and parts[0] not in ("", "N/A"):
+                keyframes.append(float(parts[0]))
+        return sorted(keyframes)
+
+    # ffmpeg only: decode keyframes alone and read their timestamps from showinfo
+    result = subprocess.run(
+        [
+            FFMPEG_BINARY, "-hide_banner", "-nostats", "-skip_frame", "nokey",
+            "-i", file_path, "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    output = result.stderr.decode("utf-8", errors="ignore")
+    return sorted(float(t) for t in re.findall(r"pts_time:\s*([0-9.]+)", output))
+
+
+def probe(file_path: str, keyframes: bool = False) -> MediaInfo:
+    """
+    Probe a media file, using the cache when the file is unchanged.
+
+    Args:
+        file_path: Path to a video, image or audio file
+        keyframes: Also resolve keyframe positions (slower on first probe)
+
+    Returns:
+        MediaInfo for the file; raises if the file can't be read
+    """
+    key = _cache_key(file_path)
+    info = _load(key)
+    if info is None:
+        trace.add("probe_cache_misses")
+        info = _probe_streams(file_path)
+        _store(key, info)
+    else:
+        trace.add("probe_cache_hits")
+
+    if keyframes and info.keyframes is None and info.has_video:
+        try:
+            info.keyframes = _probe_keyframes(file_path)
+        except Exception as e:
+            logger.warning(f"failed to probe keyframes of {file_path}: {str(e)}")
+            info.keyframes = []
+        _store(key, info)
+
+    return info
+
+
+def content_hash(file_path: str) -> str:
+    """Return a sha1 of the file content, cached alongside the probe result."""
+    key = _cache_key(file_path)
+    info = _load(key)
+    if info is not None and info.content_hash:
+        return info.content_hash
+
+    h = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    if info is None:
+        try:
+            info = _probe_streams(file_path)
+        except Exception:
+            # not a media file ffmpeg understands, only the hash is cached
+            info = MediaInfo(path=os.path.abspath(file_path))
+    info.content_hash = digest
+    _store(key, info)
+    return digest
+
+
+def get_duration(file_path: str) -> float:
+    return probe(file_path).duration
@@ -0,0 +1,271 @@
+"""
+Process memory accounting and the render memory budget.
+
+Stages run inside stage(name), which logs wall time, resident memory, the
+peak resident memory reached during the stage and allocation counts. On
+Linux the peak is reset at the start of every stage (VmHWM via
+/proc/self/clear_refs), elsewhere it is the process high-water mark.
+Traced Python allocations are added when tracemalloc is running, e.g.
+with PYTHONTRACEMALLOC=1.
+
+The budget (renderMemoryBudgetMb in the videoGeneration config, 0 for no
+limit) is enforced by degrading rather than failing: pools are sized with
+fit_workers from an estimate of what one more worker costs, downloads use
+smaller buffers, and in-memory caches are dropped once resident memory
+passes the budget. It is a budget for this process and the processes it
+starts, so several render jobs can be packed on one node.
+"""
+
+import gc
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+from loguru import logger
+
+from .config import config
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MB = 1024 * 1024
+
+# A spawned render worker with moviepy and numpy imported, before any frames
+WORKER_BASE_MB = 120
+# Decoded source frame, transformed frame and the reader's and writer's pipe
+# buffers, all RGB24
+FRAME_BUFFERS = 6
+# Frames x264 keeps for lookahead and reference at the default presets,
+# YUV 4:2:0
+ENCODER_FRAMES = 50
+
+DOWNLOAD_CHUNK = 1 * MB
+DOWNLOAD_CHUNK_LOW = 64 * 1024
+
+_budget_mb: Optional[int] = None
+_caches: List[Callable[[], None]] = []
+# usage of the stages running right now, in any thread
+_active_stages: List["StageUsage"] = []
+_active_stages_lock = threading.Lock()
+
+
+def set_budget_mb(budget_mb: int):
+    """Override the configured memory budget, 0 for no limit."""
+    global _budget_mb
+    _budget_mb = max(0, int(budget_mb or 0))
+
+
+def budget_mb() -> int:
+    if _budget_mb is not None:
+        return _budget_mb
+    try:
+        # render_memory_budget_mb is the name of earlier releases
+        value = config.app.get("renderMemoryBudgetMb", config.app.get("render_memory_budget_mb", 0))
+        return max(0, int(value or 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _proc_status_kb(field: str) -> Optional[int]:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _maxrss_mb(who) -> float:
+    if resource is None:
+        return 0.0
+    maxrss = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss / MB if sys.platform == "darwin" else maxrss / 1024
+
+
+def rss_mb() -> float:
+    """Current resident memory of this process."""
+    kb = _proc_status_kb("VmRSS")
+    if kb is not None:
+        return kb / 1024
+    # no /proc, the high-water mark is the closest cheap measure
+    return _maxrss_mb(resource.RUSAGE_SELF) if resource else 0.0
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process since the last reset_peak()."""
+    kb = _proc_status_kb("VmHWM")
+    if kb is not None:
+        return kb / 1024
+    return _maxrss_mb(resource.RUSAGE_SELF) if resource else 0.0
+
+
+def children_peak_rss_mb() -> float:
+    """Largest peak resident memory of any finished child process (ffmpeg, render workers)."""
+    return _maxrss_mb(resource.RUSAGE_CHILDREN) if resource else 0.0
+
+
+def reset_peak() -> bool:
+    """Reset the peak resident memory counter, where the OS allows it."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def headroom_mb() -> Optional[float]:
+    """Budget left for new allocations and child processes, None without a budget."""
+    budget = budget_mb()
+    if not budget:
+        return None
+    return budget - rss_mb()
+
+
+def over_budget() -> bool:
+    headroom = headroom_mb()
+    return headroom is not None and headroom <= 0
+
+
+def estimate_render_mb(width: int, height: int, threads: int = 1) -> float:
+    """
+    Rough resident memory of one process decoding, transforming and encoding
+    frames at width x height, including its ffmpeg children.
+    """
+    rgb_frame = width * height * 3
+    yuv_frame = width * height * 3 / 2
+    encoder_frames = ENCODER_FRAMES + 2 * max(1, threads)
+    return WORKER_BASE_MB + (FRAME_BUFFERS * rgb_frame + encoder_frames * yuv_frame) / MB
+
+
+def fit_workers(requested: int, worker_mb: float, what: str = "workers") -> int:
+    """
+    Reduce requested to the number of workers of worker_mb each that fit in
+    the remaining budget, never below one.
+    """
+    requested = max(1, requested)
+    headroom = headroom_mb()
+    if headroom is None or requested == 1:
+        return requested
+    fitting = max(1, min(requested, int(headroom // max(worker_mb, 1))))
+    if fitting < requested:
+        logger.warning(
+            f"memory budget {budget_mb()} MB: running {fitting} {what} instead of {requested} "
+            f"({headroom:.0f} MB left, about {worker_mb:.0f} MB each)"
+        )
+    return fitting
+
+
+def download_chunk_size() -> int:
+    """Read size for streamed downloads, smaller once the budget is exhausted."""
+    return DOWNLOAD_CHUNK_LOW if over_budget() else DOWNLOAD_CHUNK
+
+
+def register_cache(clear: Callable[[], None]):
+    """Register an in-memory cache's clear function, called by trim() under memory pressure."""
+    _caches.append(clear)
+
+
+def trim():
+    """Drop registered in-memory caches and collect garbage."""
+    for clear in _caches:
+        try:
+            clear()
+        except Exception as e:
+            logger.warning(f"failed to clear cache: {str(e)}")
+    gc.collect()
+
+
+class StageUsage:
+    def __init__(self, name: str):
+        self.name = name
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.rss_mb = 0.0
+        self.peak_rss_mb = 0.0
+        # "process" when other stages ran at the same time: the peak counter is
+        # process-wide, so it wasn't reset for this stage and covers them too
+        self.peak_scope = "stage"
+        self.children_peak_rss_mb = 0.0
+        # net memory blocks still allocated by the interpreter at the end of the stage
+        self.allocated_blocks = 0
+        self.gc_collections = 0
+        # peak traced Python memory, only when tracemalloc is tracing
+        self.traced_peak_mb = None
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    def __str__(self):
+        text = (
+            f"stage {self.name}: {self.wall_time:.2f}s wall, {self.cpu_time:.2f}s cpu, "
+            f"rss {self.rss_mb:.0f} MB, {'peak' if self.peak_scope == 'stage' else 'process peak'} {self.peak_rss_mb:.0f} MB, "
+            f"children peak {self.children_peak_rss_mb:.0f} MB, "
+            f"{self.allocated_blocks:+d} blocks, {self.gc_collections} gc runs"
+        )
+        if self.traced_peak_mb is not None:
+            text += f", traced peak {self.traced_peak_mb:.1f} MB"
+        return text
+
+
+def _gc_collections() -> int:
+    return sum(s["collections"] for s in gc.get_stats())
+
+
+@contextmanager
+def stage(name: str, records: list = None):
+    """
+    Measure a pipeline stage and log its resource usage when it ends.
+
+    The StageUsage is yielded and appended to records when given. Stages
+    running at the same time in other threads share the process-wide peak
+    memory counter, their peak_scope is "process" then. When the
+    stage leaves the process over its memory budget, caches are trimmed so
+    the next stage starts lower.
+    """
+    usage = StageUsage(name)
+    with _active_stages_lock:
+        if _active_stages:
+            # overlapping stages, e.g. materials next to audio: resetting the
+            # counter would clobber the other stages' peaks
+            usage.peak_scope = "process"
+            for other in _active_stages:
+                other.peak_scope = "process"
+        else:
+            reset_peak()
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+        _active_stages.append(usage)
+    blocks = sys.getallocatedblocks()
+    collections = _gc_collections()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield usage
+    finally:
+        with _active_stages_lock:
+            _active_stages.remove(usage)
+        usage.wall_time = time.perf_counter() - wall_start
+        usage.cpu_time = time.process_time() - cpu_start
+        usage.rss_mb = rss_mb()
+        usage.peak_rss_mb = peak_rss_mb()
+        usage.children_peak_rss_mb = children_peak_rss_mb()
+        usage.allocated_blocks = sys.getallocatedblocks() - blocks
+        usage.gc_collections = _gc_collections() - collections
+        if tracemalloc.is_tracing():
+            usage.traced_peak_mb = tracemalloc.get_traced_memory()[1] / MB
+        logger.info(str(usage))
+        if records is not None:
+            records.append(usage)
+
+        if over_budget():
+            logger.warning(f"rss {usage.rss_mb:.0f} MB is over the {budget_mb()} MB memory budget, trimming caches")
+            trim()
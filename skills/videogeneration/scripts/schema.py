@@ -27,6 +27,16 @@ class VideoTransitionMode(str, Enum):
     slide_out = "SlideOut"
 
 
+class VideoRenderMode(str, Enum):
+    staged = "staged"  # temp clips -> combined video -> final video
+    single_pass = "single_pass"  # one timeline, encoded once
+
+
+class VideoCutMode(str, Enum):
+    fixed = "fixed"  # max_clip_duration windows from the start of each source
+    keyframe = "keyframe"  # windows snapped to keyframes, untouched ones are stream copied
+
+
 class VideoAspect(str, Enum):
     landscape = "16:9"
     portrait = "9:16"
@@ -103,9 +113,52 @@ class VideoParams(BaseModel):
     stroke_color: Optional[str] = "#000000"
     stroke_width: float = 1.5
     n_threads: Optional[int] = 2
+    render_workers: Optional[int] = 1  # Segment render processes, 1 renders sequentially
+    render_threads_per_worker: Optional[int] = 0  # 0 splits the CPU threads across workers
+    render_cpu_budget: Optional[int] = 0  # Cores shared by concurrent variants, 0 uses all but one
+    render_mode: Optional[VideoRenderMode] = VideoRenderMode.staged.value
+    keep_intermediates: Optional[bool] = False  # Write combined videos in single pass mode, for debugging
+    cut_mode: Optional[VideoCutMode] = VideoCutMode.fixed.value
+    draft: Optional[bool] = False  # Low resolution, low fps, fast preset, for checking cuts and subtitles
+    seed: Optional[int] = None  # Seeds segment order, transitions and BGM choice, random when unset
+    preview_duration: Optional[float] = 0  # Seconds of draft-quality teaser rendered before the full video, 0 disables
+    profile_stages: Optional[List[str]] = None  # Stages run under cProfile ("video", "materials", ...), "all" for every stage
+    resume: Optional[bool] = False  # Skip stages whose inputs are unchanged since the last run of this task
     paragraph_number: Optional[int] = 1
 
 
+class RenderPlanSegment(BaseModel):
+    file_path: str
+    start_time: float
+    end_time: float
+    width: int
+    height: int
+    keyframe_aligned: bool = False
+    transition: Optional[str] = None
+    side: str = "left"
+
+
+class RenderPlan(BaseModel):
+    """
+    Planning decisions of a render, saved as render_plan.json.
+
+    Rendering from a plan reuses its segments, BGM and the recorded audio and
+    subtitle files, so a final render reproduces the draft it was checked in.
+    """
+
+    version: int = 1
+    seed: int
+    params: dict = {}  # VideoParams the plan was made with
+    audio_file: str
+    audio_hash: str = ""
+    subtitle_file: str = ""
+    subtitle_hash: str = ""
+    bgm_file: str = ""
+    audio_duration: float
+    max_clip_duration: int = 5
+    segments: List[RenderPlanSegment] = []
+
+
 class SubtitleRequest(BaseModel):
     video_script: str
     video_language: Optional[str] = ""
@@ -0,0 +1,167 @@
+"""
+On-disk cache of raw stock video search responses.
+
+Searches are keyed by provider and normalized query parameters (API keys
+left out, the search term lower-cased), and the provider's response is
+stored as is, so results can be filtered again offline. Entries are
+served for search_cache_ttl_hours (default 24). For search_cache_stale_hours
+after that (default 168) an entry is still served at once while a
+background request refreshes it; older entries are refetched, and only
+served when the request fails or returns an error. The cache lives in
+storage/cache_search, LRU-bounded by search_cache_max_mb (default 64, 0
+disables it).
+
+With search_cache_offline set, cached entries are served whatever their
+age and nothing is requested, e.g. to replay the searches of earlier runs
+in benchmarks.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from loguru import logger
+
+from .config import config
+from .disk_cache import TMP_SUFFIX, DiskCache
+from . import trace, utils
+
+# bump when the stored entry format changes
+SEARCH_CACHE_VERSION = 1
+# query parameters that don't change the results
+_IGNORED_PARAMS = {"key"}
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def _config_float(key: str, default: float) -> float:
+    try:
+        return float(config.app.get(key, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _cache() -> Optional[DiskCache]:
+    max_mb = _config_float("search_cache_max_mb", 64)
+    if max_mb <= 0:
+        return None
+    return DiskCache(utils.storage_dir("cache_search", create=True), int(max_mb * 1024 * 1024))
+
+
+def offline() -> bool:
+    return bool(config.app.get("search_cache_offline", False))
+
+
+def cache_key(provider: str, params: dict) -> str:
+    normalized = {
+        k: (v.strip().lower() if isinstance(v, str) and k in ("query", "q") else v)
+        for k, v in params.items()
+        if k not in _IGNORED_PARAMS
+    }
+    return utils.md5(f"{provider}|{json.dumps(normalized, sort_keys=True)}|v{SEARCH_CACHE_VERSION}")
+
+
+def _load(cache: DiskCache, key: str) -> Optional[dict]:
+    file_path = cache.get(key, ".json")
+    if not file_path:
+        return None
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        if "response" in entry and "fetched_at" in entry:
+            return entry
+    except Exception as e:
+        logger.warning(f"ignoring corrupt search cache entry {file_path}: {str(e)}")
+    return None
+
+
+def _store(cache: DiskCache, key: str, provider: str, params: dict, response: dict):
+    entry = {
+        "provider": provider,
+        "params": {k: v for k, v in params.items() if k not in _IGNORED_PARAMS},
+        "fetched_at": time.time(),
+        "response": response,
+    }
+    tmp_file = f"{cache.path(key, '.json')}.{os.getpid()}.{threading.get_ident()}.write{TMP_SUFFIX}"
+    try:
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        cache.put(key, tmp_file, ".json", move=True)
+    except Exception as e:
+        logger.warning(f"failed to write search cache entry: {str(e)}")
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def _fetch_and_store(cache, key, provider, params, fetch, valid) -> dict:
+    response = fetch()
+    # error responses are returned, not cached
+    if valid(response):
+        _store(cache, key, provider, params, response)
+    return response
+
+
+def _revalidate(cache, key, provider, params, fetch, valid):
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def run():
+        try:
+            _fetch_and_store(cache, key, provider, params, fetch, valid)
+        except Exception as e:
+            logger.warning(f"failed to refresh cached {provider} search: {str(e)}")
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+    threading.Thread(target=run, name=f"search-refresh-{key[:8]}", daemon=True).start()
+
+
+def search(
+    provider: str,
+    params: dict,
+    fetch: Callable[[], dict],
+    valid: Callable[[dict], bool] = lambda response: True,
+) -> dict:
+    """
+    The raw response of a search with params, from the cache or from
+    fetch(). Only responses passing valid() are cached.
+    """
+    cache = _cache()
+    if cache is None:
+        return fetch()
+
+    key = cache_key(provider, params)
+    entry = _load(cache, key)
+    if entry is not None:
+        age_hours = (time.time() - entry["fetched_at"]) / 3600
+        ttl_hours = _config_float("search_cache_ttl_hours", 24)
+        if offline() or age_hours < ttl_hours:
+            trace.add("search_cache_hits")
+            return entry["response"]
+        if age_hours < ttl_hours + _config_float("search_cache_stale_hours", 168):
+            trace.add("search_cache_stale")
+            _revalidate(cache, key, provider, params, fetch, valid)
+            return entry["response"]
+
+    if offline():
+        raise LookupError(f"no cached {provider} search for {params.get('query') or params.get('q')}")
+
+    trace.add("search_cache_misses")
+    try:
+        response = _fetch_and_store(cache, key, provider, params, fetch, valid)
+    except Exception as e:
+        if entry is None:
+            raise
+        logger.warning(f"{provider} search failed, using the cached response from before: {str(e)}")
+        return entry["response"]
+    if entry is not None and not valid(response):
+        logger.warning(f"{provider} search returned an error, using the cached response from before")
+        return entry["response"]
+    return response
@@ -0,0 +1,195 @@
+"""
+Subtitle burn-in with pre-rasterized caption sprites.
+
+Every caption used to become a TextClip inside a CompositeVideoClip, so each
+output frame walked all caption clips and blended them through float masks.
+Here every caption is rasterized once into an RGBA sprite (cached by text
+and style, so variants sharing a script share sprites), the cues are
+indexed by time, and only the captions active at a frame are alpha blended
+into a reused frame buffer with integer math.
+"""
+
+import bisect
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from . import resources, text_layout
+
+
+class CaptionSprite:
+    """
+    A rasterized caption, cropped to its visible pixels.
+
+    premultiplied holds rgb * alpha and inverse_alpha holds 255 - alpha, both
+    as uint16, so blending is one multiply-add per channel. Sprites are shared
+    through the rasterize cache and must not be modified.
+    """
+
+    def __init__(self, rgba: np.ndarray, width: int, height: int):
+        # full box size, used for positioning like the TextClip it replaces
+        self.width = width
+        self.height = height
+
+        alpha = rgba[:, :, 3]
+        rows = np.flatnonzero(alpha.any(axis=1))
+        cols = np.flatnonzero(alpha.any(axis=0))
+        if rows.size == 0:
+            self.offset_x = self.offset_y = 0
+            self.premultiplied = None
+            self.inverse_alpha = None
+            return
+
+        top, bottom = rows[0], rows[-1] + 1
+        left, right = cols[0], cols[-1] + 1
+        self.offset_x = int(left)
+        self.offset_y = int(top)
+        visible = rgba[top:bottom, left:right].astype(np.uint16)
+        alpha = visible[:, :, 3:4]
+        self.premultiplied = visible[:, :, :3] * alpha
+        self.inverse_alpha = 255 - alpha
+
+
+@lru_cache(maxsize=1024)
+def rasterize_caption(
+    text: str,
+    font_path: str,
+    font_size: int,
+    color: str,
+    bg_color,
+    stroke_color: Optional[str],
+    stroke_width: int,
+    interline: int,
+    size: Tuple[int, int],
+) -> CaptionSprite:
+    """
+    Render a caption the way moviepy's TextClip(method="label") does: left
+    aligned lines, centered in a box of the given size.
+
+    Args:
+        bg_color: Box color, or anything that isn't a color string (None,
+            True) for a transparent box
+
+    Returns:
+        The cached CaptionSprite
+    """
+    img_width, img_height = size
+    font = text_layout.get_font(font_path, font_size)
+    bg = bg_color if isinstance(bg_color, str) and bg_color else (0, 0, 0, 0)
+    img = Image.new("RGBA", (img_width, img_height), color=bg)
+    draw = ImageDraw.Draw(img)
+
+    left, top, right, bottom = draw.multiline_textbbox(
+        (0, 0),
+        text,
+        font=font,
+        spacing=interline,
+        align="left",
+        stroke_width=stroke_width,
+        anchor="ls",
+    )
+    text_width, text_height = int(right - left), int(bottom - top)
+    ascent, _ = font.getmetrics()
+    x = (img_width - text_width) / 2 + stroke_width
+    y = (img_height - text_height) / 2 + ascent + stroke_width
+
+    draw.multiline_text(
+        xy=(x, y),
+        text=text,
+        fill=color,
+        font=font,
+        spacing=interline,
+        align="left",
+        stroke_width=stroke_width,
+        stroke_fill=stroke_color,
+        anchor="ls",
+    )
+    return CaptionSprite(np.asarray(img), img_width, img_height)
+
+
+resources.register_cache(rasterize_caption.cache_clear)
+
+
+class Caption:
+    def __init__(self, start: float, end: float, sprite: CaptionSprite, x: float, y: float):
+        self.start = start
+        self.end = end
+        self.sprite = sprite
+        # moviepy truncates clip positions to whole pixels when compositing
+        self.x = int(x) + sprite.offset_x
+        self.y = int(y) + sprite.offset_y
+
+
+class SubtitleOverlay:
+    """
+    Frame transform that burns captions into frames.
+
+    Use as video_clip.transform(overlay). Frames with no active caption are
+    passed through untouched; otherwise the returned array is a buffer that
+    is reused for the next frame, which moviepy's writers allow.
+    """
+
+    def __init__(self, captions: List[Caption]):
+        self.captions = sorted(
+            (c for c in captions if c.sprite.premultiplied is not None and c.end > c.start),
+            key=lambda c: c.start,
+        )
+        self.starts = [c.start for c in self.captions]
+        # running maximum of end times, so a lookup can stop scanning back
+        # as soon as no earlier caption can still be on screen
+        self.max_ends = []
+        max_end = float("-inf")
+        for c in self.captions:
+            max_end = max(max_end, c.end)
+            self.max_ends.append(max_end)
+        self._buffer = None
+
+    def active(self, t: float) -> List[Caption]:
+        """Captions on screen at t (start <= t < end), in start order."""
+        i = bisect.bisect_right(self.starts, t) - 1
+        result = []
+        while i >= 0 and self.max_ends[i] > t:
+            if self.captions[i].end > t:
+                result.append(self.captions[i])
+            i -= 1
+        result.reverse()
+        return result
+
+    def __call__(self, get_frame, t):
+        frame = get_frame(t)
+        captions = self.active(t)
+        if not captions:
+            return frame
+
+        if self._buffer is None or self._buffer.shape != frame.shape:
+            self._buffer = np.empty(frame.shape, dtype=np.uint8)
+        # decoded frames may be read-only or shared, blend into our own copy
+        np.copyto(self._buffer, frame, casting="unsafe")
+        for caption in captions:
+            _blend(self._buffer, caption)
+        return self._buffer
+
+
+def _blend(frame: np.ndarray, caption: Caption):
+    sprite = caption.sprite
+    sprite_h, sprite_w = sprite.inverse_alpha.shape[:2]
+    frame_h, frame_w = frame.shape[:2]
+
+    # clip the sprite to the frame, captions may overhang the edges
+    x0, y0 = max(caption.x, 0), max(caption.y, 0)
+    x1 = min(caption.x + sprite_w, frame_w)
+    y1 = min(caption.y + sprite_h, frame_h)
+    if x1 <= x0 or y1 <= y0:
+        return
+    sx, sy = x0 - caption.x, y0 - caption.y
+    sprite_rows = slice(sy, sy + y1 - y0)
+    sprite_cols = slice(sx, sx + x1 - x0)
+
+    region = frame[y0:y1, x0:x1, :3]
+    blended = region * sprite.inverse_alpha[sprite_rows, sprite_cols]
+    blended += sprite.premultiplied[sprite_rows, sprite_cols]
+    blended += 127
+    blended //= 255
+    region[:] = blended
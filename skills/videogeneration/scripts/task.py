@@ -1,17 +1,24 @@
+import contextvars
 import math
 import os.path
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from os import path
 
 from loguru import logger
 
 from .config import config
 from . import const
-from .schema import VideoConcatMode, VideoParams
-from . import llm, material, subtitle, video, voice
+from .schema import VideoAspect, VideoConcatMode, VideoParams, VideoRenderMode
+from . import audio_mix, checkpoint, llm, material, probe, resources, subtitle, task_queue, trace, video, voice
 from . import state as sm
 from . import utils
 
+# Headroom over the estimated narration length when downloading materials
+# before TTS has run, so they rarely need topping up
+AUDIO_ESTIMATE_MARGIN = 1.2
+
 
 def generate_script(task_id, params):
     logger.info("\n\n## generating video script")
@@ -159,11 +166,14 @@ def generate_subtitle(task_id, params, video_script, sub_maker, audio_file):
     return subtitle_path
 
 
-def get_video_materials(task_id, params, video_terms, audio_duration):
+def get_video_materials(task_id, params, video_terms, audio_duration, cancel=None):
     if params.video_source == "local":
         logger.info("\n\n## preprocess local materials")
         materials = video.preprocess_video(
-            materials=params.video_materials, clip_duration=params.video_clip_duration
+            materials=params.video_materials,
+            clip_duration=params.video_clip_duration,
+            video_size=VideoAspect(params.video_aspect).to_resolution(),
+            workers=params.render_workers or 1,
         )
         if not materials:
             sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
@@ -183,8 +193,11 @@ def get_video_materials(task_id, params, video_terms, audio_duration):
             audio_duration=audio_duration * params.video_count,
             max_clip_duration=params.video_clip_duration,
             video_subject=params.video_subject,
+            cancel=cancel,
         )
         if not downloaded_videos:
+            if cancel is not None and cancel.is_set():
+                return None
             sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
             logger.error(
                 "failed to download videos, maybe the network is not available. if you are in China, please use a VPN."
@@ -193,69 +206,437 @@ def get_video_materials(task_id, params, video_terms, audio_duration):
         return downloaded_videos
 
 
-def generate_final_videos(
-    task_id, params, downloaded_videos, audio_file, subtitle_path
+def plan_variant(
+    task_id, index, params, downloaded_videos, audio_file, subtitle_path, checkpoints, inputs
 ):
-    final_video_paths = []
-    combined_video_paths = []
-    video_concat_mode = (
-        params.video_concat_mode if params.video_count == 1 else VideoConcatMode.random
-    )
-    video_transition_mode = params.video_transition_mode
+    """
+    Plan one video variant and save the plan as render_plan-{index}.json in
+    the task directory, or load the plan saved by an earlier run with the
+    same inputs, so a resumed task renders the same cuts and BGM.
+    """
+    plan_file = path.join(utils.task_dir(task_id), f"render_plan-{index}.json")
+    if checkpoints.get(f"plan-{index}", inputs) is not None:
+        return video.load_render_plan(plan_file)
+
+    if params.seed is not None:
+        # distinct but reproducible choices for every variant
+        params = params.model_copy(update={"seed": params.seed + index - 1})
+    render_plan = video.plan_render(downloaded_videos, audio_file, subtitle_path, params)
+    video.save_render_plan(render_plan, plan_file)
+    checkpoints.put(f"plan-{index}", inputs, artifacts=[plan_file])
+    return render_plan
+
+
+def render_variant(
+    task_id,
+    index,
+    params,
+    render_plan,
+    downloaded_videos,
+    audio_file,
+    subtitle_path,
+    on_progress,
+    checkpoints,
+    inputs,
+):
+    """
+    Render one planned video variant, calling on_progress(fraction) as its stages finish.
+
+    combined-{index}.mp4 and final-{index}.mp4 are checkpointed separately,
+    so a failed final pass reuses the combined video on the next run.
+    Returns (final_video_path, combined_video_path); combined_video_path is
+    empty when no intermediate is written.
+    """
+    final_video_path = path.join(utils.task_dir(task_id), f"final-{index}.mp4")
+
+    if params.render_mode == VideoRenderMode.single_pass:
+        combined_video_path = ""
+        if params.keep_intermediates:
+            combined_video_path = path.join(
+                utils.task_dir(task_id), f"combined-{index}.mp4"
+            )
+        if checkpoints.get(f"video-{index}", inputs) is None:
+            logger.info(f"\n\n## rendering video in a single pass: {index} => {final_video_path}")
+            video.render_video(
+                video_paths=downloaded_videos,
+                audio_path=audio_file,
+                subtitle_path=subtitle_path,
+                output_file=final_video_path,
+                params=params,
+                combined_video_path=combined_video_path,
+                render_plan=render_plan,
+            )
+            checkpoints.put(
+                f"video-{index}", inputs, artifacts=[final_video_path, combined_video_path]
+            )
+        on_progress(1.0)
+        return final_video_path, combined_video_path
 
-    _progress = 50
-    for i in range(params.video_count):
-        index = i + 1
-        combined_video_path = path.join(
-            utils.task_dir(task_id), f"combined-{index}.mp4"
-        )
+    combined_video_path = path.join(
+        utils.task_dir(task_id), f"combined-{index}.mp4"
+    )
+    if checkpoints.get(f"combine-{index}", inputs) is None:
         logger.info(f"\n\n## combining video: {index} => {combined_video_path}")
         video.combine_videos(
             combined_video_path=combined_video_path,
             video_paths=downloaded_videos,
             audio_file=audio_file,
             video_aspect=params.video_aspect,
-            video_concat_mode=video_concat_mode,
-            video_transition_mode=video_transition_mode,
+            video_concat_mode=params.video_concat_mode,
+            video_transition_mode=params.video_transition_mode,
             max_clip_duration=params.video_clip_duration,
             threads=params.n_threads,
+            workers=params.render_workers or 1,
+            threads_per_worker=params.render_threads_per_worker or 0,
+            cut_mode=params.cut_mode,
+            draft=params.draft,
+            render_plan=render_plan,
         )
+        checkpoints.put(f"combine-{index}", inputs, artifacts=[combined_video_path])
+    on_progress(0.5)
 
-        _progress += 50 / params.video_count / 2
-        sm.state.update_task(task_id, progress=_progress)
-
-        final_video_path = path.join(utils.task_dir(task_id), f"final-{index}.mp4")
-
+    final_inputs = {**inputs, "combined": checkpoint.file_input(combined_video_path)}
+    if checkpoints.get(f"video-{index}", final_inputs) is None:
         logger.info(f"\n\n## generating video: {index} => {final_video_path}")
         video.generate_video(
             video_path=combined_video_path,
             audio_path=audio_file,
             subtitle_path=subtitle_path,
             output_file=final_video_path,
+            params=video.params_for_plan(params, render_plan),
+        )
+        checkpoints.put(f"video-{index}", final_inputs, artifacts=[final_video_path])
+    on_progress(0.5)
+    return final_video_path, combined_video_path
+
+
+def render_preview(task_id, params, render_plan, audio_file, subtitle_path):
+    """Render the preview_duration second teaser of the first variant, returning its path or ""."""
+    if not params.preview_duration or params.preview_duration <= 0:
+        return ""
+    preview_path = path.join(utils.task_dir(task_id), "preview.mp4")
+    try:
+        video.render_preview(
+            audio_path=audio_file,
+            subtitle_path=subtitle_path,
+            output_file=preview_path,
             params=params,
+            render_plan=render_plan,
+            seconds=params.preview_duration,
         )
+    except Exception as e:
+        logger.error(f"failed to render preview: {str(e)}")
+        return ""
+    if not path.exists(preview_path):
+        return ""
+    logger.info(f"preview ready: {preview_path}")
+    return preview_path
 
-        _progress += 50 / params.video_count / 2
-        sm.state.update_task(task_id, progress=_progress)
 
+def generate_final_videos(
+    task_id, params, downloaded_videos, audio_file, subtitle_path, checkpoints=None
+):
+    """
+    Render all video_count variants, several at a time within the CPU budget.
+
+    Variants only share read-only inputs, so they are independent once
+    materials, audio and subtitles exist. The CPU budget is split between
+    the variants running at the same time, and fewer of them run at once
+    when they would not fit in the memory budget. Sources are probed once up
+    front, and the voice and every distinct background music picked by the
+    variants' plans are decoded once, so every variant reuses the same probe
+    results and decoded audio. A segment cut by several variants is encoded by one of them and
+    copied by the others (video.render_segment). With
+    preview_duration set, a draft-quality teaser of the first variant is
+    reported as the task's preview before the full renders start. Plans and
+    renders already finished by an earlier run with the same inputs are
+    reused from checkpoints.
+    """
+    checkpoints = checkpoints or checkpoint.Checkpoints(task_id, enabled=False)
+    cpu_budget = params.render_cpu_budget or video.OPTIMAL_THREADS
+    workers = max(1, params.render_workers or 1)
+    concurrency = max(1, min(params.video_count, cpu_budget // workers))
+    settings = video.render_settings(params.video_aspect, params.draft)
+    variant_mb = workers * resources.estimate_render_mb(
+        settings.width, settings.height, max(1, cpu_budget // (concurrency * workers))
+    )
+    concurrency = resources.fit_workers(concurrency, variant_mb, "concurrent variants")
+
+    overrides = {
+        "video_concat_mode": (
+            params.video_concat_mode if params.video_count == 1 else VideoConcatMode.random
+        ),
+    }
+    if concurrency > 1:
+        overrides["render_threads_per_worker"] = params.render_threads_per_worker or max(
+            1, cpu_budget // (concurrency * workers)
+        )
+        overrides["n_threads"] = max(1, cpu_budget // concurrency)
+    variant_params = params.model_copy(update=overrides)
+
+    for video_path in downloaded_videos:
+        try:
+            probe.probe(video_path)
+        except Exception as e:
+            logger.warning(f"failed to probe {video_path}: {str(e)}")
+    # the task's own params, the variant overrides depend on the machine
+    task_inputs = {
+        "params": checkpoint.params_input(params),
+        "materials": [[v, checkpoint.file_input(v)] for v in downloaded_videos],
+        "audio": checkpoint.file_input(audio_file),
+        "subtitle": checkpoint.file_input(subtitle_path),
+    }
+    # planning is cheap once sources are probed, do it for every variant up front
+    render_plans = {
+        index: plan_variant(
+            task_id,
+            index,
+            variant_params,
+            downloaded_videos,
+            audio_file,
+            subtitle_path,
+            checkpoints,
+            {**task_inputs, "index": index},
+        )
+        for index in range(1, params.video_count + 1)
+    }
+    # each plan picks its own BGM; every variant's mix reads the voice and
+    # the BGM from audio_mix's cache instead of decoding them again
+    shared_audio = [audio_file] + sorted({plan.bgm_file for plan in render_plans.values() if plan.bgm_file})
+    for audio_path in shared_audio:
+        try:
+            audio_mix.decode(audio_path)
+        except Exception as e:
+            logger.warning(f"failed to decode {audio_path}: {str(e)}")
+    # a variant's render depends on its saved plan, which records sources, audio, subtitles and BGM
+    render_inputs = {
+        index: {
+            "params": task_inputs["params"],
+            "plan": checkpoint.file_input(
+                path.join(utils.task_dir(task_id), f"render_plan-{index}.json")
+            ),
+        }
+        for index in render_plans
+    }
+
+    # extra task fields that later progress updates must repeat, MemoryState replaces the whole entry
+    task_fields = {}
+    with trace.span("preview"):
+        preview_path = ""
+        if checkpoints.get("preview", render_inputs[1]) is not None:
+            preview_path = path.join(utils.task_dir(task_id), "preview.mp4")
+        else:
+            preview_path = render_preview(
+                task_id, variant_params, render_plans[1], audio_file, subtitle_path
+            )
+            if preview_path:
+                checkpoints.put("preview", render_inputs[1], artifacts=[preview_path])
+    if preview_path:
+        task_fields["preview"] = preview_path
+        sm.state.update_task(task_id, progress=50, **task_fields)
+
+    logger.info(
+        f"rendering {params.video_count} videos, {concurrency} at a time, cpu budget: {cpu_budget}"
+    )
+
+    progress_lock = threading.Lock()
+    progress = {"value": 50}
+
+    def on_progress(fraction):
+        with progress_lock:
+            progress["value"] += 50 / params.video_count * fraction
+            sm.state.update_task(task_id, progress=progress["value"], **task_fields)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            # a context copy per variant, so renders record into the task's trace
+            executor.submit(
+                contextvars.copy_context().run,
+                render_variant,
+                task_id,
+                index,
+                variant_params,
+                render_plans[index],
+                downloaded_videos,
+                audio_file,
+                subtitle_path,
+                on_progress,
+                checkpoints,
+                render_inputs[index],
+            ): index
+            for index in range(1, params.video_count + 1)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                logger.error(f"failed to render video {index}: {str(e)}")
+
+    final_video_paths = []
+    combined_video_paths = []
+    for index in sorted(results):
+        final_video_path, combined_video_path = results[index]
         final_video_paths.append(final_video_path)
-        combined_video_paths.append(combined_video_path)
+        if combined_video_path:
+            combined_video_paths.append(combined_video_path)
 
     return final_video_paths, combined_video_paths
 
 
+def estimate_audio_duration(params, video_script):
+    """
+    Narration length for sizing the material download before the audio
+    exists: the length of a custom audio file, otherwise a generous
+    estimate from the script.
+    """
+    if params.custom_audio_file and os.path.exists(params.custom_audio_file):
+        audio_duration = voice.get_audio_duration(params.custom_audio_file)
+        if audio_duration:
+            return audio_duration
+    return math.ceil(
+        voice.estimate_duration(video_script, params.voice_rate) * AUDIO_ESTIMATE_MARGIN
+    )
+
+
+def audio_stage(task_id, params, video_script, checkpoints, usage):
+    """Generate the audio, or reuse it when the script and voice haven't changed since the last run."""
+    audio_inputs = {
+        "video_script": video_script,
+        "voice_name": params.voice_name,
+        "voice_rate": params.voice_rate,
+        "custom_audio_file": params.custom_audio_file or "",
+        "custom_audio": checkpoint.file_input(params.custom_audio_file),
+    }
+    with trace.stage("audio", usage):
+        saved = checkpoints.get("audio", audio_inputs)
+        if saved is not None:
+            audio_file = saved.get("audio_file")
+            audio_duration = saved.get("audio_duration")
+            # edge subtitles need the TTS word timings, kept with the checkpoint
+            sub_maker = voice.sub_maker_from_dict(saved["sub_maker"]) if saved.get("sub_maker") else None
+        else:
+            with task_queue.limit("network"):
+                audio_file, audio_duration, sub_maker = generate_audio(
+                    task_id, params, video_script
+                )
+    if audio_file and saved is None:
+        checkpoints.put(
+            "audio",
+            audio_inputs,
+            {
+                "audio_file": audio_file,
+                "audio_duration": audio_duration,
+                "sub_maker": voice.sub_maker_to_dict(sub_maker) if sub_maker else None,
+            },
+            artifacts=[audio_file],
+        )
+    return audio_file, audio_duration, sub_maker
+
+
+def subtitle_stage(task_id, params, video_script, sub_maker, audio_file, checkpoints, usage):
+    """Generate the subtitles, or reuse them when the audio and script haven't changed since the last run."""
+    subtitle_inputs = {
+        "audio": checkpoint.file_input(audio_file),
+        "video_script": video_script,
+        "subtitle_enabled": params.subtitle_enabled,
+        "subtitle_provider": config.app.get("subtitle_provider", "edge"),
+    }
+    with trace.stage("subtitle", usage):
+        saved = checkpoints.get("subtitle", subtitle_inputs)
+        if saved is not None:
+            return saved.get("subtitle_path", "")
+        subtitle_path = generate_subtitle(
+            task_id, params, video_script, sub_maker, audio_file
+        )
+    checkpoints.put(
+        "subtitle", subtitle_inputs, {"subtitle_path": subtitle_path}, artifacts=[subtitle_path]
+    )
+    return subtitle_path
+
+
+def materials_stage(
+    task_id, params, video_terms, audio_duration, checkpoints, usage, stage_name="materials", cancel=None
+):
+    """
+    Get materials for audio_duration seconds of narration, or reuse the ones
+    of the last run when the sources and the duration haven't changed.
+    Downloading stops, returning None, once cancel is set.
+    """
+    materials_inputs = {
+        "video_source": params.video_source,
+        "video_materials": [
+            [m.url, checkpoint.file_input(m.url)] for m in params.video_materials or []
+        ],
+        "video_terms": video_terms,
+        "video_subject": params.video_subject,
+        "video_aspect": params.video_aspect,
+        "video_concat_mode": params.video_concat_mode,
+        "video_clip_duration": params.video_clip_duration,
+        "video_count": params.video_count,
+        "audio_duration": audio_duration,
+    }
+    with trace.stage(stage_name, usage):
+        saved = checkpoints.get(stage_name, materials_inputs)
+        if saved is not None:
+            return saved.get("materials")
+        with task_queue.limit("cpu" if params.video_source == "local" else "network"):
+            downloaded_videos = get_video_materials(
+                task_id, params, video_terms, audio_duration, cancel
+            )
+    if downloaded_videos:
+        checkpoints.put(
+            stage_name, materials_inputs, {"materials": downloaded_videos}, artifacts=downloaded_videos
+        )
+    return downloaded_videos
+
+
 def start(task_id, params: VideoParams, stop_at: str = "video"):
+    """
+    Run the task's stages up to stop_at, tracing them to trace.json in the
+    task directory (profile-{stage}.prof too for params.profile_stages).
+    Temp files go to the task's own scratch directory, removed at the end,
+    so tasks running at the same time never share one.
+    """
     logger.info(f"start task: {task_id}, stop_at: {stop_at}")
+    trace_file = path.join(utils.task_dir(task_id), "trace.json")
+    scratch_dir = path.join(utils.task_dir(task_id), "scratch")
+    with trace.task_trace(task_id, trace_file, profile_stages=params.profile_stages or ()):
+        with utils.scratch_dir(scratch_dir):
+            return run_stages(task_id, params, stop_at)
+
+
+def run_stages(task_id, params: VideoParams, stop_at: str = "video"):
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=5)
 
     if type(params.video_concat_mode) is str:
         params.video_concat_mode = VideoConcatMode(params.video_concat_mode)
 
+    # resource usage of every stage, reported with the finished task
+    usage = []
+    # with params.resume, stages finished by an earlier run of this task with the same inputs are skipped
+    checkpoints = checkpoint.Checkpoints(task_id, reuse=bool(params.resume))
+
     # 1. Generate script
-    video_script = generate_script(task_id, params)
+    script_inputs = {
+        "video_subject": params.video_subject,
+        "video_script": params.video_script,
+        "video_language": params.video_language,
+        "paragraph_number": params.paragraph_number,
+    }
+    with trace.stage("script", usage):
+        saved = checkpoints.get("script", script_inputs)
+        if saved is not None:
+            video_script = saved.get("script")
+        else:
+            with task_queue.limit("network"):
+                video_script = generate_script(task_id, params)
     if not video_script or "Error: " in video_script:
         sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
         return
+    if saved is None:
+        checkpoints.put("script", script_inputs, {"script": video_script})
 
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=10)
 
@@ -268,10 +649,23 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
     # 2. Generate terms
     video_terms = ""
     if params.video_source != "local":
-        video_terms = generate_terms(task_id, params, video_script)
+        terms_inputs = {
+            "video_subject": params.video_subject,
+            "video_script": video_script,
+            "video_terms": params.video_terms,
+        }
+        with trace.stage("terms", usage):
+            saved = checkpoints.get("terms", terms_inputs)
+            if saved is not None:
+                video_terms = saved.get("terms")
+            else:
+                with task_queue.limit("network"):
+                    video_terms = generate_terms(task_id, params, video_script)
         if not video_terms:
             sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
             return
+        if saved is None:
+            checkpoints.put("terms", terms_inputs, {"terms": video_terms})
 
     save_script_data(task_id, video_script, video_terms, params)
 
@@ -283,45 +677,80 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
 
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=20)
 
-    # 3. Generate audio
-    audio_file, audio_duration, sub_maker = generate_audio(
-        task_id, params, video_script
-    )
-    if not audio_file:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-        return
-
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=30)
+    # 3-5. Audio and subtitles in this thread, materials next to them. Searching
+    # and downloading only needs the terms and a narration length, so it starts
+    # right away with an estimate of the length and is topped up if the
+    # narration comes out longer.
+    materials_duration = 0
+    materials_future = None
+    # stops the materials when audio or subtitles fail, so the task fails right away
+    cancel_materials = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        if stop_at not in ("audio", "subtitle"):
+            materials_duration = estimate_audio_duration(params, video_script)
+            materials_future = executor.submit(
+                contextvars.copy_context().run,
+                materials_stage,
+                task_id,
+                params,
+                video_terms,
+                materials_duration,
+                checkpoints,
+                usage,
+                cancel=cancel_materials,
+            )
 
-    if stop_at == "audio":
-        sm.state.update_task(
-            task_id,
-            state=const.TASK_STATE_COMPLETE,
-            progress=100,
-            audio_file=audio_file,
+        # 3. Generate audio
+        audio_file, audio_duration, sub_maker = audio_stage(
+            task_id, params, video_script, checkpoints, usage
         )
-        return {"audio_file": audio_file, "audio_duration": audio_duration}
+        if not audio_file:
+            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            return
 
-    # 4. Generate subtitle
-    subtitle_path = generate_subtitle(
-        task_id, params, video_script, sub_maker, audio_file
-    )
+        sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=30)
 
-    if stop_at == "subtitle":
-        sm.state.update_task(
-            task_id,
-            state=const.TASK_STATE_COMPLETE,
-            progress=100,
-            subtitle_path=subtitle_path,
+        if stop_at == "audio":
+            sm.state.update_task(
+                task_id,
+                state=const.TASK_STATE_COMPLETE,
+                progress=100,
+                audio_file=audio_file,
+            )
+            return {"audio_file": audio_file, "audio_duration": audio_duration}
+
+        # 4. Generate subtitle
+        subtitle_path = subtitle_stage(
+            task_id, params, video_script, sub_maker, audio_file, checkpoints, usage
         )
-        return {"subtitle_path": subtitle_path}
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=40)
+        if stop_at == "subtitle":
+            sm.state.update_task(
+                task_id,
+                state=const.TASK_STATE_COMPLETE,
+                progress=100,
+                subtitle_path=subtitle_path,
+            )
+            return {"subtitle_path": subtitle_path}
 
-    # 5. Get video materials
-    downloaded_videos = get_video_materials(
-        task_id, params, video_terms, audio_duration
-    )
+        sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=40)
+
+        # 5. Get video materials
+        downloaded_videos = materials_future.result()
+    finally:
+        # without waiting: the materials are done on success, cancelled otherwise
+        cancel_materials.set()
+        executor.shutdown(wait=False)
+
+    if downloaded_videos and params.video_source != "local" and audio_duration > materials_duration:
+        logger.info(
+            f"narration is {audio_duration}s, longer than the {materials_duration}s estimate, "
+            "downloading more materials"
+        )
+        downloaded_videos = materials_stage(
+            task_id, params, video_terms, audio_duration, checkpoints, usage, "materials-refined"
+        )
     if not downloaded_videos:
         sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
         return
@@ -338,9 +767,10 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50)
 
     # 6. Generate final videos
-    final_video_paths, combined_video_paths = generate_final_videos(
-        task_id, params, downloaded_videos, audio_file, subtitle_path
-    )
+    with trace.stage("video", usage), task_queue.limit("cpu"):
+        final_video_paths, combined_video_paths = generate_final_videos(
+            task_id, params, downloaded_videos, audio_file, subtitle_path, checkpoints
+        )
 
     if not final_video_paths:
         sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
@@ -359,7 +789,11 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
         "audio_duration": audio_duration,
         "subtitle_path": subtitle_path,
         "materials": downloaded_videos,
+        "resource_usage": [u.to_dict() for u in usage],
     }
+    preview_path = path.join(utils.task_dir(task_id), "preview.mp4")
+    if params.preview_duration and path.exists(preview_path):
+        kwargs["preview"] = preview_path
     sm.state.update_task(
         task_id, state=const.TASK_STATE_COMPLETE, progress=100, **kwargs
     )
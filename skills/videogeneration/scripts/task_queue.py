@@ -0,0 +1,165 @@
+"""
+A bounded queue running many video tasks on one machine.
+
+TaskQueue runs submitted tasks (task.start) in a fixed set of worker
+threads, highest priority first, and blocks submit() once max_pending
+tasks are waiting, so a producer of hundreds of topics can't outrun the
+machine. Inside a task, stages take a slot of their kind while they run:
+
+- "network" for LLM, TTS and material search and download
+- "cpu" for preprocessing local materials and rendering
+
+so network-bound tasks keep going while the CPU slots are busy rendering,
+and no more renders run at once than the CPU slots allow. Each rendering
+task gets an equal share of the cores unless its params set
+render_cpu_budget. Task state is reported through state.state as usual,
+TASK_STATE_QUEUED until a worker picks the task up.
+
+Limits are per process (set_limits); without a TaskQueue, limit() doesn't
+wait. Config keys, in the videoGeneration section: queue_network_slots
+(default 4), queue_cpu_slots (default 1), queue_workers (default the sum
+of both) and queue_max_pending (default 64).
+"""
+
+import itertools
+import math
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from loguru import logger
+
+from . import const
+from . import state as sm
+from . import trace, utils
+from .config import config
+from .schema import VideoParams
+
+_limits = {}
+
+
+def _config_int(key: str, default: int) -> int:
+    try:
+        return max(1, int(config.app.get(key, default) or default))
+    except (TypeError, ValueError):
+        return default
+
+
+def set_limits(**slots: int):
+    """Set the number of slots per kind, e.g. set_limits(network=4, cpu=1)."""
+    for kind, count in slots.items():
+        _limits[kind] = threading.BoundedSemaphore(max(1, count))
+
+
+@contextmanager
+def limit(kind: str):
+    """Hold a slot of kind ("network" or "cpu") for the block, waiting for one when all are taken."""
+    semaphore = _limits.get(kind)
+    if semaphore is None:
+        yield
+        return
+    started = time.perf_counter()
+    with semaphore:
+        trace.add(f"{kind}_slot_wait", round(time.perf_counter() - started, 3))
+        yield
+
+
+class TaskQueue:
+    def __init__(
+        self,
+        workers: int = 0,
+        network_slots: int = 0,
+        cpu_slots: int = 0,
+        max_pending: int = 0,
+    ):
+        self.network_slots = network_slots or _config_int("queue_network_slots", 4)
+        self.cpu_slots = cpu_slots or _config_int("queue_cpu_slots", 1)
+        # enough workers for every slot, so a slot is never free while tasks are waiting
+        self.workers = workers or _config_int("queue_workers", self.network_slots + self.cpu_slots)
+        self.max_pending = max_pending or _config_int("queue_max_pending", 64)
+        set_limits(network=self.network_slots, cpu=self.cpu_slots)
+
+        self._queue = queue.PriorityQueue()
+        self._pending = threading.BoundedSemaphore(self.max_pending)
+        self._order = itertools.count()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f"task-worker-{i + 1}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(
+            f"task queue: {self.workers} workers, {self.network_slots} network slots, "
+            f"{self.cpu_slots} cpu slots, up to {self.max_pending} pending tasks"
+        )
+
+    def submit(
+        self,
+        params: VideoParams,
+        task_id: str = "",
+        priority: int = 0,
+        stop_at: str = "video",
+        timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Queue a task and return its id. Higher priorities run first, equal
+        ones in submission order. Blocks while max_pending tasks are
+        waiting, raising queue.Full after timeout seconds (0 doesn't wait).
+        """
+        if self._closed:
+            raise RuntimeError("task queue is shut down")
+        if not self._pending.acquire(timeout=timeout):
+            raise queue.Full(f"{self.max_pending} tasks are already waiting")
+        task_id = task_id or utils.get_uuid()
+        sm.state.update_task(task_id, state=const.TASK_STATE_QUEUED, progress=0, priority=priority)
+        self._queue.put((-priority, next(self._order), task_id, params, stop_at))
+        return task_id
+
+    def join(self):
+        """Wait until every submitted task has finished."""
+        self._queue.join()
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting tasks; workers exit once the tasks already queued have run."""
+        self._closed = True
+        for _ in self._threads:
+            # sorts after every task
+            self._queue.put((math.inf, next(self._order), None, None, None))
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown(wait=True)
+
+    def _work(self):
+        while True:
+            _, _, task_id, params, stop_at = self._queue.get()
+            try:
+                if task_id is None:
+                    return
+                self._pending.release()
+                self._run(task_id, params, stop_at)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, task_id: str, params: VideoParams, stop_at: str):
+        # task takes its slots from this module
+        from . import task
+
+        if self.cpu_slots > 1 and not params.render_cpu_budget:
+            params = params.model_copy(
+                update={"render_cpu_budget": max(1, (os.cpu_count() or 1) // self.cpu_slots)}
+            )
+        try:
+            task.start(task_id, params, stop_at)
+        except Exception as e:
+            logger.error(f"task {task_id} failed: {str(e)}")
+            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
@@ -0,0 +1,129 @@
+"""
+Text measurement and line breaking for captions.
+
+Fonts are loaded once per (path, size) and glyph advance widths are cached
+per font, so breaking a caption is a single pass summing cached widths.
+The previous wrap_text opened the font on every call and re-measured the
+whole growing line after every word, or every character for CJK text,
+which is quadratic in the caption length.
+
+Widths are sums of glyph advances, so kerning is ignored; at caption sizes
+that is a pixel or two per line.
+"""
+
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from PIL import ImageFont
+
+
+@lru_cache(maxsize=32)
+def get_font(font_path: str, font_size: int):
+    """Return a cached PIL font, or Pillow's default font when font_path is empty."""
+    if font_path:
+        return ImageFont.truetype(font_path, font_size)
+    return ImageFont.load_default(font_size)
+
+
+class FontMetrics:
+    def __init__(self, font_path: str, font_size: int):
+        self.font = get_font(font_path, font_size)
+        self._advances: Dict[str, float] = {}
+
+    def advance(self, char: str) -> float:
+        width = self._advances.get(char)
+        if width is None:
+            width = self.font.getlength(char)
+            self._advances[char] = width
+        return width
+
+    def width(self, text: str) -> float:
+        return sum(self.advance(c) for c in text)
+
+    def line_height(self, text: str) -> int:
+        """Ink height of text on one line, as the old getbbox based measure reported it."""
+        left, top, right, bottom = self.font.getbbox(text)
+        return bottom - top
+
+
+@lru_cache(maxsize=32)
+def get_metrics(font_path: str, font_size: int) -> FontMetrics:
+    return FontMetrics(font_path, font_size)
+
+
+def _break_words(words: List[str], metrics: FontMetrics, max_width: float):
+    """Greedy word wrap, or None when a single word is wider than max_width."""
+    space = metrics.advance(" ")
+    lines = []
+    line: List[str] = []
+    line_width = 0.0
+    for word in words:
+        word_width = metrics.width(word)
+        if word_width > max_width:
+            return None
+        if not line:
+            line, line_width = [word], word_width
+            continue
+        if line_width + space + word_width <= max_width:
+            line.append(word)
+            line_width += space + word_width
+        else:
+            lines.append(" ".join(line))
+            line, line_width = [word], word_width
+    if line:
+        lines.append(" ".join(line))
+    return lines
+
+
+def _break_chars(text: str, metrics: FontMetrics, max_width: float) -> List[str]:
+    """Greedy per-character wrap, used for CJK text and words that don't fit a line."""
+    lines = []
+    start = 0
+    # trailing spaces don't count towards a line's width
+    line_width = 0.0
+    pending_space = 0.0
+    for i, char in enumerate(text):
+        advance = metrics.advance(char)
+        if char.isspace():
+            pending_space += advance
+            continue
+        if i > start and line_width + pending_space + advance > max_width:
+            lines.append(text[start:i])
+            start = i
+            line_width, pending_space = advance, 0.0
+        else:
+            line_width += pending_space + advance
+            pending_space = 0.0
+    if start < len(text):
+        lines.append(text[start:])
+    return lines
+
+
+def wrap_text(text: str, max_width: float, font_path: str, font_size: int) -> Tuple[str, int]:
+    """
+    Break text into lines no wider than max_width.
+
+    Words are kept whole when every word fits on a line; otherwise the text
+    is broken between characters, which is the normal path for Chinese.
+
+    Args:
+        text: Caption text
+        max_width: Maximum line width in pixels
+        font_path: Font file, or "" for Pillow's default font
+        font_size: Font size in pixels
+
+    Returns:
+        The wrapped text joined with newlines, and its height (line count
+        times the single line height)
+    """
+    metrics = get_metrics(font_path, font_size)
+    text = text.strip()
+    height = metrics.line_height(text)
+    if metrics.width(text) <= max_width:
+        return text, height
+
+    lines = _break_words(text.split(), metrics, max_width)
+    if lines is None:
+        lines = [line.strip() for line in _break_chars(text, metrics, max_width)]
+        lines = [line for line in lines if line]
+    return "\n".join(lines), len(lines) * height
@@ -0,0 +1,219 @@
+"""
+Per-task traces: timed spans, counters and events, saved as trace.json.
+
+task_trace() makes a trace current for the calling context (contextvars),
+so code anywhere in the pipeline records into it without a trace being
+passed around:
+
+- stage() for pipeline stages: a span with the stage's resource usage,
+  optionally run under cProfile
+- span() for timed sections such as search requests, LLM and TTS calls
+- add() for counters such as downloaded bytes and cache hits
+- event() for per-item records such as rendered segments
+
+Without a current trace these calls only time their block. Work handed to
+a thread pool must run in a copy of the context
+(contextvars.copy_context().run) to record into the task's trace; render
+worker processes don't record, the parent records their results.
+"""
+
+import contextvars
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Optional
+
+from loguru import logger
+
+from . import resources
+
+TRACE_VERSION = 1
+
+
+class Span:
+    def __init__(self, name: str, parent: Optional["Span"], offset: float, attrs: dict):
+        self.name = name
+        self.parent = parent
+        # seconds since the trace started
+        self.start = offset
+        self.wall_time = 0.0
+        # CPU time of the whole process, including other threads
+        self.cpu_time = 0.0
+        self.attrs = attrs
+        self.counters = {}
+
+    def path(self) -> str:
+        return f"{self.parent.path()}/{self.name}" if self.parent else self.name
+
+    def to_dict(self) -> dict:
+        data = {
+            "name": self.path(),
+            "start": round(self.start, 3),
+            "wall_time": round(self.wall_time, 3),
+            "cpu_time": round(self.cpu_time, 3),
+        }
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.counters:
+            data["counters"] = self.counters
+        return data
+
+
+class Trace:
+    def __init__(self, task_id: str, output_dir: str = "", profile_stages: Iterable[str] = ()):
+        self.task_id = task_id
+        self.output_dir = output_dir
+        self.profile_stages = {s.strip() for s in profile_stages or () if s and s.strip()}
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+        self.events = []
+        self._lock = threading.Lock()
+
+    def offset(self) -> float:
+        return time.perf_counter() - self._started
+
+    def add(self, name: str, value, span: Optional[Span]):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            while span is not None:
+                span.counters[name] = span.counters.get(name, 0) + value
+                span = span.parent
+
+    def add_span(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def add_event(self, event: dict):
+        with self._lock:
+            self.events.append(event)
+
+    def should_profile(self, stage_name: str) -> bool:
+        return "all" in self.profile_stages or stage_name in self.profile_stages
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+            return {
+                "version": TRACE_VERSION,
+                "task_id": self.task_id,
+                "started_at": self.started_at,
+                "wall_time": round(self.offset(), 3),
+                "counters": dict(self.counters),
+                "spans": [s.to_dict() for s in spans],
+                "events": list(self.events),
+            }
+
+    def save(self, trace_file: str):
+        tmp_file = f"{trace_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp_file, trace_file)
+
+
+_trace: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+_span: contextvars.ContextVar = contextvars.ContextVar("trace_span", default=None)
+
+
+def current() -> Optional[Trace]:
+    return _trace.get()
+
+
+@contextmanager
+def task_trace(task_id: str, trace_file: str, profile_stages: Iterable[str] = ()):
+    """
+    Trace everything run in this context until the block ends, then write
+    trace_file. Profiles of the stages in profile_stages ("all" for every
+    stage) are written next to it as profile-{stage}.prof.
+    """
+    t = Trace(task_id, os.path.dirname(trace_file), profile_stages)
+    trace_token = _trace.set(t)
+    span_token = _span.set(None)
+    try:
+        yield t
+    finally:
+        _span.reset(span_token)
+        _trace.reset(trace_token)
+        try:
+            t.save(trace_file)
+            logger.info(f"trace saved: {trace_file}")
+        except Exception as e:
+            logger.warning(f"failed to save trace {trace_file}: {str(e)}")
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block as a child of the current span. Attributes may be added to the yielded span."""
+    t = current()
+    s = Span(name, _span.get(), t.offset() if t else 0.0, attrs)
+    token = _span.set(s)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield s
+    finally:
+        s.wall_time = time.perf_counter() - wall_start
+        s.cpu_time = time.process_time() - cpu_start
+        _span.reset(token)
+        if t is not None:
+            t.add_span(s)
+
+
+@contextmanager
+def _profiled(t: Optional[Trace], stage_name: str):
+    if t is None or not t.should_profile(stage_name):
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # another profiler is active, e.g. an enclosing profiled stage
+        logger.warning(f"not profiling stage {stage_name}: {str(e)}")
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profile_file = os.path.join(t.output_dir or ".", f"profile-{stage_name}.prof")
+        try:
+            profiler.dump_stats(profile_file)
+            logger.info(f"profile of stage {stage_name} saved: {profile_file}")
+        except Exception as e:
+            logger.warning(f"failed to save profile {profile_file}: {str(e)}")
+
+
+@contextmanager
+def stage(name: str, records: list = None):
+    """
+    A pipeline stage: a span carrying the stage's resource usage (see
+    resources.stage), run under cProfile when the trace asks for it.
+    cProfile only sees the calling thread.
+    """
+    t = current()
+    with resources.stage(name, records) as usage:
+        with span(name, stage=True) as s:
+            with _profiled(t, name):
+                yield s
+    s.attrs["resources"] = usage.to_dict()
+
+
+def add(name: str, value=1):
+    """Add value to a counter of the current trace and of the enclosing spans."""
+    t = current()
+    if t is not None:
+        t.add(name, value, _span.get())
+
+
+def event(name: str, **data):
+    """Record a point event, e.g. one rendered segment, in the current trace."""
+    t = current()
+    if t is None:
+        return
+    s = _span.get()
+    t.add_event({"name": name, "time": round(t.offset(), 3), "span": s.path() if s else "", **data})
@@ -1,8 +1,11 @@
+import contextvars
 import json
 import locale
 import os
 from pathlib import Path
+import shutil
 import threading
+from contextlib import contextmanager, nullcontext
 from typing import Any
 from uuid import uuid4
 
@@ -11,6 +14,16 @@ from loguru import logger
 
 from . import const
 
+try:
+    import fcntl
+except ImportError:
+    # no file locks on Windows, file_lock() only serializes threads there
+    fcntl = None
+
+# per-path locks serializing the threads of this process where fcntl is missing
+_path_locks = {}
+_path_locks_lock = threading.Lock()
+
 urllib3.disable_warnings()
 
 
@@ -73,7 +86,8 @@ def storage_dir(sub_dir: str = "", create: bool = False):
     if sub_dir:
         d = os.path.join(d, sub_dir)
     if create and not os.path.exists(d):
-        os.makedirs(d)
+        # another process may be creating it at the same time
+        os.makedirs(d, exist_ok=True)
 
     return d
 
@@ -94,6 +108,51 @@ def task_dir(sub_dir: str = ""):
     return d
 
 
+_scratch_dir: contextvars.ContextVar = contextvars.ContextVar("scratch_dir", default="")
+
+
+def current_scratch_dir() -> str:
+    """Directory for temp files of the task running in this context, "" for none."""
+    return _scratch_dir.get()
+
+
+@contextmanager
+def scratch_dir(d: str):
+    """
+    Put temp files of renders run in this context into d, a directory of
+    its own, and remove it afterwards.
+    """
+    os.makedirs(d, exist_ok=True)
+    token = _scratch_dir.set(d)
+    try:
+        yield d
+    finally:
+        _scratch_dir.reset(token)
+        shutil.rmtree(d, ignore_errors=True)
+
+
+@contextmanager
+def file_lock(lock_path: str):
+    """
+    Hold an exclusive lock on lock_path, created if missing, against other
+    processes and threads. Without fcntl (Windows) only the threads of this
+    process are excluded. The file's mtime is refreshed, so files locked
+    recently can be told apart from abandoned ones.
+    """
+    if fcntl is None:
+        with _path_locks_lock:
+            thread_lock = _path_locks.setdefault(os.path.abspath(lock_path), threading.Lock())
+    else:
+        # flock() also excludes other threads, each opens the file on its own
+        thread_lock = nullcontext()
+    with thread_lock, open(lock_path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        # through the descriptor, the locked file may have been renamed meanwhile
+        os.utime(f.fileno() if os.utime in os.supports_fd else lock_path)
+        yield
+
+
 def font_dir(sub_dir: str = ""):
     d = resource_dir("fonts")
     if sub_dir:
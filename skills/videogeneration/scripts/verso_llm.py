@@ -11,6 +11,8 @@ import subprocess
 import uuid
 from typing import List, Optional
 
+from . import trace
+
 
 def get_verso_dir() -> str:
     """Get the Verso installation directory."""
@@ -56,20 +58,22 @@ def call_verso_agent(prompt: str, timeout: int = 120) -> str:
         if os.path.exists("/opt/homebrew/bin/pnpm"):
             pnpm_cmd = "/opt/homebrew/bin/pnpm"
             
-        result = subprocess.run(
-            [
-                pnpm_cmd, "run", "verso", "agent",
-                "-m", prompt,
-                "--agent", "utility",
-                "--session-id", session_id,
-                "--local",
-                "--json"
-            ],
-            cwd=verso_dir,
-            capture_output=True,
-            text=True,
-            timeout=timeout
-        )
+        with trace.span("llm", prompt_chars=len(prompt)) as span:
+            result = subprocess.run(
+                [
+                    pnpm_cmd, "run", "verso", "agent",
+                    "-m", prompt,
+                    "--agent", "utility",
+                    "--session-id", session_id,
+                    "--local",
+                    "--json"
+                ],
+                cwd=verso_dir,
+                capture_output=True,
+                text=True,
+                timeout=timeout
+            )
+        span.attrs["returncode"] = result.returncode
         
         if result.returncode == 0:
             output = result.stdout.strip()
@@ -1,33 +1,45 @@
+import bisect
 import glob
 import itertools
+import json
 import os
 import random
 import gc
 import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from typing import List, Union
 from loguru import logger
 from moviepy import (
-    AudioFileClip,
-    ColorClip,
-    CompositeAudioClip,
-    CompositeVideoClip,
-    ImageClip,
-    TextClip,
     VideoFileClip,
-    afx,
     concatenate_videoclips,
 )
-from moviepy.video.tools.subtitles import SubtitlesClip
-from PIL import ImageFont
+from moviepy.config import FFMPEG_BINARY
+from moviepy.video.tools.subtitles import file_to_subtitles
 
+from . import audio_mix
 from . import const
+from .config import config
+from .disk_cache import DiskCache, copy_file
 from .schema import (
     MaterialInfo,
+    RenderPlan,
+    RenderPlanSegment,
     VideoAspect,
     VideoConcatMode,
+    VideoCutMode,
     VideoParams,
     VideoTransitionMode,
 )
+from . import frame_transform
+from . import ken_burns
+from . import probe
+from . import resources
+from . import subtitle_overlay
+from . import text_layout
+from . import trace
 from . import video_effects
 from . import utils
 
@@ -37,12 +49,19 @@ import multiprocessing
 OPTIMAL_THREADS = max(1, multiprocessing.cpu_count() - 1)
 
 class SubClippedVideoClip:
-    def __init__(self, file_path, start_time=None, end_time=None, width=None, height=None, duration=None):
+    def __init__(self, file_path, start_time=None, end_time=None, width=None, height=None, duration=None, keyframe_aligned=False, stream_copied=False):
         self.file_path = file_path
         self.start_time = start_time
         self.end_time = end_time
         self.width = width
         self.height = height
+        # the segment starts on a keyframe, so it can be cut without decoding
+        self.keyframe_aligned = keyframe_aligned
+        # the rendered clip was copied from its source instead of encoded
+        self.stream_copied = stream_copied
+        # how a rendered segment was produced (encode, copy or cache) and how long it took
+        self.render_method = ""
+        self.render_time = 0.0
         if duration is None:
             self.duration = end_time - start_time
         else:
@@ -56,6 +75,37 @@ audio_codec = "aac"
 video_codec = "libx264"
 fps = 30
 
+# draft renders: a third of the output size at half the frame rate
+DRAFT_SCALE = 1 / 3
+DRAFT_FPS = 15
+DRAFT_PRESET = "ultrafast"
+
+
+class RenderSettings:
+    def __init__(self, width: int, height: int, fps: int = fps, preset: str = "medium"):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.preset = preset
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+
+def render_settings(video_aspect: VideoAspect, draft: bool = False) -> RenderSettings:
+    """Output size, frame rate and x264 preset for a full or draft render."""
+    video_width, video_height = VideoAspect(video_aspect).to_resolution()
+    if not draft:
+        return RenderSettings(video_width, video_height)
+    # x264 needs even dimensions
+    return RenderSettings(
+        int(video_width * DRAFT_SCALE) // 2 * 2,
+        int(video_height * DRAFT_SCALE) // 2 * 2,
+        fps=DRAFT_FPS,
+        preset=DRAFT_PRESET,
+    )
+
 def close_clip(clip):
     if clip is None:
         return
@@ -93,6 +143,17 @@ def close_clip(clip):
     del clip
     gc.collect()
 
+def scratch_prefix(output_file: str) -> str:
+    """
+    Prefix for temp files belonging to one output, so renders sharing a
+    directory don't collide. They go to the task's scratch directory when
+    one is set (utils.scratch_dir), next to the output otherwise.
+    """
+    output_dir = utils.current_scratch_dir() or os.path.dirname(output_file)
+    name = os.path.splitext(os.path.basename(output_file))[0]
+    return f"{output_dir}/temp-{name}"
+
+
 def delete_files(files: Union[List[str], str]):
     if isinstance(files, str):
         files = [files]
@@ -103,7 +164,7 @@ def delete_files(files: Union[List[str], str]):
         except:
             pass
 
-def get_bgm_file(bgm_type: str = "random", bgm_file: str = ""):
+def get_bgm_file(bgm_type: str = "random", bgm_file: str = "", rng: random.Random = None):
     if not bgm_type:
         return ""
 
@@ -116,51 +177,55 @@ def get_bgm_file(bgm_type: str = "random", bgm_file: str = ""):
         files = glob.glob(os.path.join(song_dir, suffix))
         if not files:
             return ""
-        return random.choice(files)
+        return (rng or random).choice(sorted(files))
 
     return ""
 
 
-def combine_videos(
-    combined_video_path: str,
-    video_paths: List[str],
-    audio_file: str,
-    video_aspect: VideoAspect = VideoAspect.portrait,
-    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
-    video_transition_mode: VideoTransitionMode = None,
-    max_clip_duration: int = 5,
-    threads: int = 2,
-) -> str:
-    audio_clip = AudioFileClip(audio_file)
-    audio_duration = audio_clip.duration
-    logger.info(f"audio duration: {audio_duration} seconds")
-    # Required duration of each clip
-    req_dur = audio_duration / len(video_paths)
-    req_dur = max_clip_duration
-    logger.info(f"maximum clip duration: {req_dur} seconds")
-    output_dir = os.path.dirname(combined_video_path)
+def _is_keyframe(t: float, keyframes: List[float]) -> bool:
+    i = bisect.bisect_left(keyframes, t - 0.001)
+    return i < len(keyframes) and keyframes[i] <= t + 0.001
 
-    aspect = VideoAspect(video_aspect)
-    video_width, video_height = aspect.to_resolution()
 
-    processed_clips = []
+def _snap_to_keyframe(target: float, keyframes: List[float], lower: float, tolerance: float) -> float:
+    """Return the last keyframe in (lower, target] no earlier than target - tolerance, else target."""
+    i = bisect.bisect_right(keyframes, target + 0.001) - 1
+    if i >= 0 and keyframes[i] > lower and keyframes[i] >= target - tolerance:
+        return keyframes[i]
+    return target
+
+
+def collect_segments(video_paths: List[str], max_clip_duration: int = 5, cut_mode: VideoCutMode = VideoCutMode.fixed, rng: random.Random = None) -> List[SubClippedVideoClip]:
+    """
+    Cut every source into windows of at most max_clip_duration, ordered round-robin across sources.
+
+    In keyframe mode window ends are moved back to a keyframe when one is
+    within keyframe_snap_tolerance seconds, so the next window starts on a
+    keyframe and can be cut with a stream copy.
+    """
+    rng = rng or random
+    keyframe_cut = cut_mode == VideoCutMode.keyframe
+    tolerance = float(config.app.get("keyframe_snap_tolerance", 1.0))
     subclipped_items = []
-    video_duration = 0
     for video_path in video_paths:
         try:
-            clip = VideoFileClip(video_path)
-            clip_duration = clip.duration
-            clip_w, clip_h = clip.size
-            close_clip(clip)
+            info = probe.probe(video_path, keyframes=keyframe_cut)
+            if not info.has_video:
+                raise ValueError("no video stream found")
+            clip_duration = info.duration
+            clip_w, clip_h = info.size
         except Exception as e:
             logger.error(f"failed to load video {video_path}: {str(e)}")
             continue
+        keyframes = (info.keyframes or []) if keyframe_cut else []
         
         # Extract ALL possible segments from each source video (squeezing)
         # This ensures every second of downloaded material is utilized.
         start_time = 0
         while start_time < clip_duration:
             end_time = min(start_time + max_clip_duration, clip_duration)
+            if keyframes and end_time < clip_duration:
+                end_time = _snap_to_keyframe(end_time, keyframes, start_time + 1.0, tolerance)
             # Only take segments that are at least 1 second long to avoid micro-clips
             if end_time - start_time >= 1.0:
                 subclipped_items.append(SubClippedVideoClip(
@@ -168,11 +233,11 @@ def combine_videos(
                     start_time=start_time, 
                     end_time=end_time, 
                     width=clip_w, 
-                    height=clip_h
+                    height=clip_h,
+                    keyframe_aligned=bool(keyframes) and _is_keyframe(start_time, keyframes),
                 ))
             start_time = end_time
 
-
     # Group segments by source video to implement round-robin selection
     # This ensures maximum diversity - each source is used once before any source is reused
     source_groups = {}
@@ -183,14 +248,17 @@ def combine_videos(
     
     # Shuffle segments within each source group
     for segments in source_groups.values():
-        random.shuffle(segments)
+        rng.shuffle(segments)
     
     # Create ordered list using round-robin: pick one from each source in rotation
     # This maximizes source diversity throughout the video
     diverse_subclipped_items = []
     source_keys = list(source_groups.keys())
-    random.shuffle(source_keys)  # Randomize which source goes first
+    rng.shuffle(source_keys)  # Randomize which source goes first
     
+    if not source_groups:
+        return []
+
     max_segments_per_source = max(len(segments) for segments in source_groups.values())
     for round_index in range(max_segments_per_source):
         for source_key in source_keys:
@@ -198,119 +266,690 @@ def combine_videos(
                 diverse_subclipped_items.append(source_groups[source_key][round_index])
     
     logger.info(f"organized {len(diverse_subclipped_items)} clips from {len(source_groups)} sources using round-robin selection")
-    subclipped_items = diverse_subclipped_items
+    return diverse_subclipped_items
 
-    
-    # Add downloaded clips over and over until the duration of the audio (max_duration) has been reached
+
+def loop_clips(clips: list, video_duration: float, audio_duration: float):
+    """Repeat clips until the video duration matches or exceeds the audio duration."""
+    if video_duration >= audio_duration:
+        return clips, video_duration
+
+    logger.warning(f"⚠️  INSUFFICIENT VIDEOS: video duration ({video_duration:.2f}s) is shorter than audio duration ({audio_duration:.2f}s)")
+    logger.warning(f"⚠️  FALLBACK: looping existing clips to match audio length - this may cause repetition!")
+    looped_clips = clips.copy()
+    for clip in itertools.cycle(clips):
+        if video_duration >= audio_duration:
+            break
+        looped_clips.append(clip)
+        video_duration += clip.duration
+    logger.info(f"video duration: {video_duration:.2f}s, audio duration: {audio_duration:.2f}s, looped {len(looped_clips)-len(clips)} clips")
+    return looped_clips, video_duration
+
+
+class SegmentJob:
+    def __init__(self, index, item, clip_file, video_width, video_height, transition=None, side="left", max_clip_duration=5, fps=fps, preset="medium"):
+        self.index = index
+        self.item = item
+        self.clip_file = clip_file
+        self.video_width = video_width
+        self.video_height = video_height
+        self.transition = transition
+        self.side = side
+        self.max_clip_duration = max_clip_duration
+        self.fps = fps
+        self.preset = preset
+
+    def __str__(self):
+        return f"SegmentJob(index={self.index}, item={self.item}, transition={self.transition}, side={self.side})"
+
+
+def _resolve_transition(video_transition_mode: VideoTransitionMode, rng=random):
+    if video_transition_mode is None or video_transition_mode.value == VideoTransitionMode.none.value:
+        return None
+    if video_transition_mode.value == VideoTransitionMode.shuffle.value:
+        return rng.choice([
+            VideoTransitionMode.fade_in.value,
+            VideoTransitionMode.fade_out.value,
+            VideoTransitionMode.slide_in.value,
+            VideoTransitionMode.slide_out.value,
+        ])
+    return video_transition_mode.value
+
+
+def plan_segments(
+    subclipped_items: List[SubClippedVideoClip],
+    audio_duration: float,
+    video_width: int,
+    video_height: int,
+    video_transition_mode: VideoTransitionMode = None,
+    max_clip_duration: int = 5,
+    scratch_prefix: str = "temp",
+    settings: RenderSettings = None,
+    rng: random.Random = None,
+) -> List[SegmentJob]:
+    """
+    Decide which segments to render and how, before any rendering happens.
+
+    Segments are taken in order until their summed duration exceeds the
+    audio duration; random transition choices are resolved here so the
+    result does not depend on whether segments render sequentially or in a pool.
+    """
+    rng = rng or random
+    settings = settings or RenderSettings(video_width, video_height)
+    jobs = []
+    planned_duration = 0
     for i, subclipped_item in enumerate(subclipped_items):
-        if video_duration > audio_duration:
+        if planned_duration > audio_duration:
             break
-        
-        logger.debug(f"processing clip {i+1}: {subclipped_item.width}x{subclipped_item.height}, current duration: {video_duration:.2f}s, remaining: {audio_duration - video_duration:.2f}s")
-        
+        shuffle_side = rng.choice(["left", "right", "top", "bottom"])
+        jobs.append(SegmentJob(
+            index=i + 1,
+            item=subclipped_item,
+            clip_file=f"{scratch_prefix}-clip-{i+1}.mp4",
+            video_width=video_width,
+            video_height=video_height,
+            transition=_resolve_transition(video_transition_mode, rng),
+            side=shuffle_side,
+            max_clip_duration=max_clip_duration,
+            fps=settings.fps,
+            preset=settings.preset,
+        ))
+        planned_duration += min(subclipped_item.duration, max_clip_duration)
+    return jobs
+
+
+def plan_render(video_paths: List[str], audio_file: str, subtitle_file: str, params: VideoParams) -> RenderPlan:
+    """
+    Make every random and content-dependent choice of a render up front.
+
+    The seed comes from params.seed or is drawn here, and is recorded with
+    the chosen segments, transitions and BGM, so the plan can be replayed.
+    """
+    seed = params.seed if params.seed is not None else random.randrange(2**31)
+    rng = random.Random(seed)
+    video_width, video_height = VideoAspect(params.video_aspect).to_resolution()
+    max_clip_duration = params.video_clip_duration or 5
+    audio_duration = probe.get_duration(audio_file)
+
+    subclipped_items = collect_segments(video_paths, max_clip_duration, params.cut_mode, rng)
+    segment_jobs = plan_segments(
+        subclipped_items=subclipped_items,
+        audio_duration=audio_duration,
+        video_width=video_width,
+        video_height=video_height,
+        video_transition_mode=params.video_transition_mode,
+        max_clip_duration=max_clip_duration,
+        rng=rng,
+    )
+    has_subtitle = bool(subtitle_file) and os.path.exists(subtitle_file)
+    return RenderPlan(
+        seed=seed,
+        params=params.model_dump(mode="json", warnings=False),
+        audio_file=os.path.abspath(audio_file),
+        audio_hash=probe.content_hash(audio_file),
+        subtitle_file=os.path.abspath(subtitle_file) if has_subtitle else "",
+        subtitle_hash=probe.content_hash(subtitle_file) if has_subtitle else "",
+        bgm_file=get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file, rng=rng),
+        audio_duration=audio_duration,
+        max_clip_duration=max_clip_duration,
+        segments=[
+            RenderPlanSegment(
+                file_path=os.path.abspath(job.item.file_path),
+                start_time=job.item.start_time,
+                end_time=job.item.end_time,
+                width=job.item.width,
+                height=job.item.height,
+                keyframe_aligned=job.item.keyframe_aligned,
+                transition=job.transition,
+                side=job.side,
+            )
+            for job in segment_jobs
+        ],
+    )
+
+
+def save_render_plan(plan: RenderPlan, plan_file: str):
+    with open(plan_file, "w", encoding="utf-8") as f:
+        f.write(plan.model_dump_json(indent=2))
+
+
+def load_render_plan(plan_file: str) -> RenderPlan:
+    """Load a saved plan, warning when the recorded audio or subtitles have changed since."""
+    with open(plan_file, "r", encoding="utf-8") as f:
+        plan = RenderPlan.model_validate_json(f.read())
+    for file_path, file_hash in ((plan.audio_file, plan.audio_hash), (plan.subtitle_file, plan.subtitle_hash)):
+        if file_path and file_hash and os.path.exists(file_path) and probe.content_hash(file_path) != file_hash:
+            logger.warning(f"{file_path} changed since the render plan was made, output will differ from the draft")
+    return plan
+
+
+def params_for_plan(params: VideoParams, plan: RenderPlan) -> VideoParams:
+    """Copy of params that uses the plan's BGM choice, including its choice of none."""
+    return params.model_copy(update={
+        "bgm_file": plan.bgm_file,
+        "bgm_type": params.bgm_type if plan.bgm_file else "",
+    })
+
+
+def jobs_from_plan(plan: RenderPlan, settings: RenderSettings, scratch_prefix: str = "temp") -> List[SegmentJob]:
+    return [
+        SegmentJob(
+            index=i + 1,
+            item=SubClippedVideoClip(
+                file_path=segment.file_path,
+                start_time=segment.start_time,
+                end_time=segment.end_time,
+                width=segment.width,
+                height=segment.height,
+                keyframe_aligned=segment.keyframe_aligned,
+            ),
+            clip_file=f"{scratch_prefix}-clip-{i+1}.mp4",
+            video_width=settings.width,
+            video_height=settings.height,
+            transition=segment.transition,
+            side=segment.side,
+            max_clip_duration=plan.max_clip_duration,
+            fps=settings.fps,
+            preset=settings.preset,
+        )
+        for i, segment in enumerate(plan.segments)
+    ]
+
+
+def _apply_transition(clip, transition, side):
+    if transition == VideoTransitionMode.fade_in.value:
+        return video_effects.fadein_transition(clip, 1)
+    if transition == VideoTransitionMode.fade_out.value:
+        return video_effects.fadeout_transition(clip, 1)
+    if transition == VideoTransitionMode.slide_in.value:
+        return video_effects.slidein_transition(clip, 1, side)
+    if transition == VideoTransitionMode.slide_out.value:
+        return video_effects.slideout_transition(clip, 1, side)
+    return clip
+
+
+def open_source_clip(file_path: str, src_size, dst_size) -> VideoFileClip:
+    """Open a source video, letting ffmpeg scale frames to their fitted size while decoding."""
+    return VideoFileClip(
+        file_path,
+        audio=False,
+        target_resolution=frame_transform.decoder_resolution(src_size, dst_size),
+        resize_algorithm="lanczos",
+    )
+
+
+def build_segment_clip(job: SegmentJob, source_clip: VideoFileClip = None):
+    """
+    Build the moviepy clip for one planned segment: cut, scale/letterbox, transition.
+
+    source_clip lets callers share one opened source between its segments.
+    """
+    subclipped_item = job.item
+    video_size = (job.video_width, job.video_height)
+    source_size = (subclipped_item.width, subclipped_item.height)
+    logger.debug(f"processing clip {job.index}: {subclipped_item.width}x{subclipped_item.height}")
+
+    if source_clip is None:
+        source_clip = open_source_clip(subclipped_item.file_path, source_size, video_size)
+    clip = source_clip.subclipped(subclipped_item.start_time, subclipped_item.end_time)
+    # Not all videos are same size, so we need to resize and pad them
+    if tuple(clip.size) != video_size:
+        clip = clip.image_transform(frame_transform.LetterboxTransform(source_size, video_size))
+
+    clip = _apply_transition(clip, job.transition, job.side)
+
+    if clip.duration > job.max_clip_duration:
+        clip = clip.subclipped(0, job.max_clip_duration)
+    return clip
+
+
+def _segment_cache() -> Union[DiskCache, None]:
+    max_mb = config.app.get("segment_cache_max_mb", 2048)
+    if not max_mb or int(max_mb) <= 0:
+        return None
+    return DiskCache(utils.storage_dir("cache_segments", create=True), int(max_mb) * 1024 * 1024)
+
+
+# bump when segment rendering changes pixels so old cache entries are not reused
+SEGMENT_CACHE_VERSION = 2
+
+
+def segment_cache_key(job: SegmentJob) -> str:
+    """Key a rendered segment by source content and everything that affects its pixels."""
+    item = job.item
+    side = job.side if job.transition in (VideoTransitionMode.slide_in.value, VideoTransitionMode.slide_out.value) else None
+    return utils.md5(json.dumps([
+        SEGMENT_CACHE_VERSION,
+        probe.content_hash(item.file_path),
+        round(item.start_time, 3),
+        round(item.end_time, 3),
+        job.video_width,
+        job.video_height,
+        job.transition,
+        side,
+        job.max_clip_duration,
+        job.fps,
+        job.preset,
+        video_codec,
+    ]))
+
+
+def can_copy_segment(job: SegmentJob) -> bool:
+    """Check that a segment's source pixels can be used as is: no transition, scaling or fps change."""
+    item = job.item
+    if not item.keyframe_aligned or job.transition is not None:
+        return False
+    if (item.width, item.height) != (job.video_width, job.video_height):
+        return False
+    if min(item.duration, job.max_clip_duration) < 1.0:
+        return False
+    try:
+        info = probe.probe(item.file_path)
+    except Exception:
+        return False
+    return info.video_codec == "h264" and abs(info.fps - job.fps) < 0.01
+
+
+def copy_segment(job: SegmentJob) -> SubClippedVideoClip:
+    """Cut a keyframe-aligned segment out of its source without re-encoding, video stream only."""
+    item = job.item
+    duration = min(item.duration, job.max_clip_duration)
+    try:
+        subprocess.run(
+            [
+                FFMPEG_BINARY, "-y", "-loglevel", "error",
+                "-ss", f"{item.start_time:.6f}", "-i", item.file_path,
+                "-t", f"{duration:.6f}", "-map", "0:v:0", "-c", "copy", "-an",
+                "-avoid_negative_ts", "make_zero", "-movflags", "+faststart",
+                job.clip_file,
+            ],
+            check=True,
+            capture_output=True,
+        )
+    except subprocess.CalledProcessError as e:
+        delete_files(job.clip_file)
+        raise RuntimeError(e.stderr.decode("utf-8", errors="ignore").strip()) from e
+    return SubClippedVideoClip(
+        file_path=job.clip_file,
+        duration=probe.get_duration(job.clip_file),
+        width=item.width,
+        height=item.height,
+        stream_copied=True,
+    )
+
+
+class SourceReader:
+    """
+    One decoder per source, shared by all segments cut from it.
+
+    The source is opened on first use. Segments read through it in source
+    time order continue decoding where the previous one stopped (moviepy's
+    reader skips forward instead of seeking), so only the frame being
+    encoded is held in memory and each source costs one ffmpeg process.
+    """
+
+    def __init__(self, file_path: str, src_size, dst_size):
+        self.file_path = file_path
+        self.src_size = src_size
+        self.dst_size = dst_size
+        self._clip = None
+
+    def clip(self) -> VideoFileClip:
+        if self._clip is None:
+            self._clip = open_source_clip(self.file_path, self.src_size, self.dst_size)
+        return self._clip
+
+    def close(self):
+        close_clip(self._clip)
+        self._clip = None
+
+
+def render_segment(job: SegmentJob, threads: int = OPTIMAL_THREADS, allow_copy: bool = True, source: SourceReader = None) -> Union[SubClippedVideoClip, None]:
+    """
+    Render one planned segment to its temp clip file.
+
+    Segments that need no transform are stream copied from their source when
+    allow_copy is set; others reuse the segment cache when possible. Frames
+    are decoded through source when given, otherwise from a reader opened
+    for this segment alone.
+    """
+    started = time.perf_counter()
+    if allow_copy and can_copy_segment(job):
         try:
-            clip = VideoFileClip(subclipped_item.file_path).subclipped(subclipped_item.start_time, subclipped_item.end_time)
-            clip_duration = clip.duration
-            # Not all videos are same size, so we need to resize them
-            clip_w, clip_h = clip.size
-            if clip_w != video_width or clip_h != video_height:
-                clip_ratio = clip.w / clip.h
-                video_ratio = video_width / video_height
-                
-                if clip_ratio == video_ratio:
-                    clip = clip.resized(new_size=(video_width, video_height))
-                else:
-                    if clip_ratio > video_ratio:
-                        scale_factor = video_width / clip_w
-                    else:
-                        scale_factor = video_height / clip_h
-
-                    new_width = int(clip_w * scale_factor)
-                    new_height = int(clip_h * scale_factor)
-
-                    background = ColorClip(size=(video_width, video_height), color=(0, 0, 0)).with_duration(clip_duration)
-                    clip_resized = clip.resized(new_size=(new_width, new_height)).with_position("center")
-                    clip = CompositeVideoClip([background, clip_resized])
-                    
-            shuffle_side = random.choice(["left", "right", "top", "bottom"])
-            if video_transition_mode is None or video_transition_mode.value == VideoTransitionMode.none.value:
-                clip = clip
-            elif video_transition_mode.value == VideoTransitionMode.fade_in.value:
-                clip = video_effects.fadein_transition(clip, 1)
-            elif video_transition_mode.value == VideoTransitionMode.fade_out.value:
-                clip = video_effects.fadeout_transition(clip, 1)
-            elif video_transition_mode.value == VideoTransitionMode.slide_in.value:
-                clip = video_effects.slidein_transition(clip, 1, shuffle_side)
-            elif video_transition_mode.value == VideoTransitionMode.slide_out.value:
-                clip = video_effects.slideout_transition(clip, 1, shuffle_side)
-            elif video_transition_mode.value == VideoTransitionMode.shuffle.value:
-                transition_funcs = [
-                    lambda c: video_effects.fadein_transition(c, 1),
-                    lambda c: video_effects.fadeout_transition(c, 1),
-                    lambda c: video_effects.slidein_transition(c, 1, shuffle_side),
-                    lambda c: video_effects.slideout_transition(c, 1, shuffle_side),
-                ]
-                shuffle_transition = random.choice(transition_funcs)
-                clip = shuffle_transition(clip)
-
-            if clip.duration > max_clip_duration:
-                clip = clip.subclipped(0, max_clip_duration)
-                
-            # wirte clip to temp file
-            clip_file = f"{output_dir}/temp-clip-{i+1}.mp4"
-            clip.write_videofile(clip_file, logger=None, fps=fps, codec=video_codec, threads=OPTIMAL_THREADS)
-            
-            close_clip(clip)
-        
-            processed_clips.append(SubClippedVideoClip(file_path=clip_file, duration=clip.duration, width=clip_w, height=clip_h))
-            video_duration += clip.duration
-            
+            clip = copy_segment(job)
+            logger.debug(f"stream copied clip {job.index}: {job.item}")
+            return _rendered(clip, "copy", started)
+        except Exception as e:
+            logger.warning(f"failed to stream copy clip {job.index}, re-encoding: {str(e)}")
+
+    cache = _segment_cache()
+    cache_key = ""
+    if cache is not None:
+        try:
+            cache_key = segment_cache_key(job)
+        except Exception as e:
+            logger.warning(f"failed to compute segment cache key: {str(e)}")
+        rendered = _cached_segment(cache, cache_key, job, started) if cache_key else None
+        if rendered is not None:
+            return rendered
+
+    # variants rendered at the same time cut the same segments from the same
+    # sources: one of them encodes a segment, the others wait and copy it
+    with cache.lock(cache_key) if cache_key else nullcontext():
+        if cache_key:
+            rendered = _cached_segment(cache, cache_key, job, started)
+            if rendered is not None:
+                return rendered
+
+        try:
+            clip = build_segment_clip(job, source.clip() if source else None)
+            # the combined video's audio is replaced in generate_video, so segments carry none;
+            # this also keeps every temp clip stream-compatible for the concat merge
+            clip.write_videofile(
+                job.clip_file, logger=None, fps=job.fps, codec=video_codec, preset=job.preset, audio=False, threads=threads
+            )
+
+            # a shared reader stays open for the source's next segment
+            if source is None:
+                close_clip(clip)
         except Exception as e:
             logger.error(f"failed to process clip: {str(e)}")
-    
+            return None
+
+        if cache_key:
+            try:
+                cache.put(cache_key, job.clip_file, ".mp4")
+            except Exception as e:
+                logger.warning(f"failed to cache segment {job.index}: {str(e)}")
+
+    rendered = SubClippedVideoClip(file_path=job.clip_file, duration=clip.duration, width=job.item.width, height=job.item.height)
+    return _rendered(rendered, "encode", started)
+
+
+def _cached_segment(cache: DiskCache, cache_key: str, job: SegmentJob, started: float) -> Union[SubClippedVideoClip, None]:
+    cached_file = cache.get(cache_key, ".mp4")
+    if not cached_file:
+        return None
+    try:
+        copy_file(cached_file, job.clip_file)
+        clip = SubClippedVideoClip(file_path=job.clip_file, duration=probe.get_duration(job.clip_file), width=job.item.width, height=job.item.height)
+        logger.debug(f"segment cache hit for clip {job.index}: {cached_file}")
+        return _rendered(clip, "cache", started)
+    except Exception as e:
+        # evicted by another process since get(), encode it instead
+        logger.warning(f"failed to reuse cached segment {job.index}, encoding it: {str(e)}")
+    return None
+
+
+def _rendered(clip: SubClippedVideoClip, method: str, started: float) -> SubClippedVideoClip:
+    clip.render_method = method
+    clip.render_time = time.perf_counter() - started
+    return clip
+
+
+def _trace_segments(jobs: List[SegmentJob], clips: List[Union[SubClippedVideoClip, None]]):
+    """Record rendered segments in the current trace, in the parent process for pooled renders."""
+    for job, clip in zip(jobs, clips):
+        if clip is None:
+            trace.add("segments_failed")
+            continue
+        frames = int(round(clip.duration * job.fps))
+        trace.add(f"segments_{clip.render_method}")
+        trace.add("frames_rendered", frames)
+        trace.event(
+            "segment",
+            index=job.index,
+            source=job.item.file_path,
+            method=clip.render_method,
+            frames=frames,
+            seconds=round(clip.render_time, 3),
+            fps=round(frames / clip.render_time, 1) if clip.render_time > 0 else 0,
+        )
+
+
+def render_source_segments(jobs: List[SegmentJob], threads: int = OPTIMAL_THREADS, allow_copy: bool = True) -> List[Union[SubClippedVideoClip, None]]:
+    """Render segments cut from one source in source time order through a single SourceReader."""
+    item = jobs[0].item
+    source = SourceReader(item.file_path, (item.width, item.height), (jobs[0].video_width, jobs[0].video_height))
+    try:
+        return [render_segment(job, threads, allow_copy, source) for job in jobs]
+    finally:
+        source.close()
+
+
+def group_jobs_by_source(jobs: List[SegmentJob], min_groups: int = 1) -> List[List[SegmentJob]]:
+    """
+    Group jobs by source file, each group sorted by start time.
+
+    Groups are split into contiguous halves until there are at least
+    min_groups of them, so a pool isn't left idle when there are few sources.
+    """
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job.item.file_path, []).append(job)
+    groups = [sorted(g, key=lambda j: j.item.start_time) for g in groups.values()]
+
+    while len(groups) < min_groups:
+        groups.sort(key=len)
+        largest = groups.pop()
+        if len(largest) < 2:
+            groups.append(largest)
+            break
+        middle = len(largest) // 2
+        groups += [largest[:middle], largest[middle:]]
+    return groups
+
+
+def render_segments(jobs: List[SegmentJob], workers: int = 1, threads_per_worker: int = 0, allow_copy: bool = True) -> List[Union[SubClippedVideoClip, None]]:
+    """
+    Render planned segments, optionally in a process pool.
+
+    Segments are rendered per source so each source is decoded once, front
+    to back. Results are returned in plan order regardless of render order,
+    with None for segments that failed to render. Fewer workers are started
+    when the requested number would not fit in the memory budget.
+    """
+    if not jobs:
+        return []
+
+    workers = max(1, min(workers, len(jobs)))
+    groups = group_jobs_by_source(jobs, min_groups=workers if workers > 1 else 1)
+    results = {}
+    if workers <= 1 or len(groups) <= 1:
+        threads = threads_per_worker or OPTIMAL_THREADS
+        for group in groups:
+            for job, clip in zip(group, render_source_segments(group, threads, allow_copy)):
+                results[job.index] = clip
+        clips = [results[job.index] for job in jobs]
+        _trace_segments(jobs, clips)
+        return clips
+
+    workers = min(workers, len(groups))
+    threads = threads_per_worker or max(1, OPTIMAL_THREADS // workers)
+    worker_mb = resources.estimate_render_mb(jobs[0].video_width, jobs[0].video_height, threads)
+    workers = resources.fit_workers(workers, worker_mb, "render workers")
+    if workers <= 1:
+        return render_segments(jobs, workers=1, threads_per_worker=threads_per_worker, allow_copy=allow_copy)
+    logger.info(f"rendering {len(jobs)} segments from {len(groups)} source groups with {workers} workers, {threads} threads each")
+    # spawn rather than fork: variants may start pools from worker threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        rendered = executor.map(render_source_segments, groups, [threads] * len(groups), [allow_copy] * len(groups))
+        for group, clips in zip(groups, rendered):
+            for job, clip in zip(group, clips):
+                results[job.index] = clip
+    clips = [results[job.index] for job in jobs]
+    _trace_segments(jobs, clips)
+    return clips
+
+
+def combine_videos(
+    combined_video_path: str,
+    video_paths: List[str],
+    audio_file: str,
+    video_aspect: VideoAspect = VideoAspect.portrait,
+    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+    video_transition_mode: VideoTransitionMode = None,
+    max_clip_duration: int = 5,
+    threads: int = 2,
+    workers: int = 1,
+    threads_per_worker: int = 0,
+    cut_mode: VideoCutMode = VideoCutMode.fixed,
+    draft: bool = False,
+    render_plan: RenderPlan = None,
+) -> str:
+    """
+    Render the planned segments and join them into a silent combined video.
+
+    With render_plan the segments are taken from the plan instead of being
+    chosen here; draft renders them at draft size, frame rate and preset.
+    """
+    audio_duration = probe.get_duration(audio_file)
+    logger.info(f"audio duration: {audio_duration} seconds")
+    logger.info(f"maximum clip duration: {max_clip_duration} seconds")
+
+    settings = render_settings(video_aspect, draft)
+
+    processed_clips = []
+    video_duration = 0
+    if render_plan is not None:
+        segment_jobs = jobs_from_plan(render_plan, settings, scratch_prefix(combined_video_path))
+    else:
+        subclipped_items = collect_segments(video_paths, max_clip_duration, cut_mode)
+
+        # Plan every segment up front so the cutoff and transitions don't depend on render order
+        segment_jobs = plan_segments(
+            subclipped_items=subclipped_items,
+            audio_duration=audio_duration,
+            video_width=settings.width,
+            video_height=settings.height,
+            video_transition_mode=video_transition_mode,
+            max_clip_duration=max_clip_duration,
+            scratch_prefix=scratch_prefix(combined_video_path),
+            settings=settings,
+        )
+
+    rendered = render_segments(segment_jobs, workers=workers, threads_per_worker=threads_per_worker)
+
+    # copied segments keep their source's encoding; if the clips don't all
+    # match, encode the copied ones too rather than losing the stream copy merge
+    copied = [i for i, clip in enumerate(rendered) if clip is not None and clip.stream_copied]
+    if copied and not can_stream_copy([c.file_path for c in rendered if c is not None]):
+        logger.info(f"re-encoding {len(copied)} stream copied clips to match the encoded ones")
+        reencoded = render_segments(
+            [segment_jobs[i] for i in copied], workers=workers, threads_per_worker=threads_per_worker, allow_copy=False
+        )
+        for i, clip in zip(copied, reencoded):
+            rendered[i] = clip
+    elif copied:
+        logger.info(f"stream copied {len(copied)} of {len(rendered)} clips")
+
+    for clip in rendered:
+        if clip is None:
+            continue
+        processed_clips.append(clip)
+        video_duration += clip.duration
+
     # loop processed clips until the video duration matches or exceeds the audio duration.
-    if video_duration < audio_duration:
-        logger.warning(f"⚠️  INSUFFICIENT VIDEOS: video duration ({video_duration:.2f}s) is shorter than audio duration ({audio_duration:.2f}s)")
-        logger.warning(f"⚠️  FALLBACK: looping existing clips to match audio length - this may cause repetition!")
-        base_clips = processed_clips.copy()
-        for clip in itertools.cycle(base_clips):
-            if video_duration >= audio_duration:
-                break
-            processed_clips.append(clip)
-            video_duration += clip.duration
-        logger.info(f"video duration: {video_duration:.2f}s, audio duration: {audio_duration:.2f}s, looped {len(processed_clips)-len(base_clips)} clips")
-     
-    # merge video clips progressively, avoid loading all videos at once to avoid memory overflow
+    processed_clips, video_duration = loop_clips(processed_clips, video_duration, audio_duration)
+
     logger.info("starting clip merging process")
     if not processed_clips:
         logger.warning("no clips available for merging")
         return combined_video_path
-    
+
+    clip_files = [clip.file_path for clip in processed_clips]
+
     # if there is only one clip, use it directly
     if len(processed_clips) == 1:
         logger.info("using single clip directly")
-        shutil.copy(processed_clips[0].file_path, combined_video_path)
-        delete_files(processed_clips)
-        logger.info("video combining completed")
-        return combined_video_path
-    
-    # create initial video file as base
+        shutil.copy(clip_files[0], combined_video_path)
+    elif can_stream_copy(clip_files):
+        # every temp clip was encoded with the same settings, join them without re-encoding
+        try:
+            merge_clips_stream_copy(clip_files, combined_video_path)
+        except Exception as e:
+            logger.warning(f"stream copy merge failed, falling back to re-encoding: {str(e)}")
+            merge_clips_progressive(processed_clips, combined_video_path, settings)
+    else:
+        logger.info("clip parameters differ, merging with re-encoding")
+        merge_clips_progressive(processed_clips, combined_video_path, settings)
+
+    # clean temp files
+    delete_files(list(dict.fromkeys(clip_files)))
+
+    logger.info("video combining completed")
+    return combined_video_path
+
+
+def _stream_params(file_path: str) -> tuple:
+    info = probe.probe(file_path)
+    return (
+        info.video_codec,
+        info.video_profile,
+        info.size,
+        info.fps,
+        info.has_audio,
+        info.audio_fps,
+    )
+
+
+def can_stream_copy(clip_files: List[str]) -> bool:
+    """Check that all clips share codec, resolution, fps and audio layout."""
+    try:
+        params = {_stream_params(f) for f in dict.fromkeys(clip_files)}
+    except Exception as e:
+        logger.warning(f"failed to probe clips for stream copy: {str(e)}")
+        return False
+    return len(params) == 1
+
+
+def merge_clips_stream_copy(clip_files: List[str], combined_video_path: str):
+    """Join clips in a single pass with the ffmpeg concat demuxer, no re-encoding."""
+    list_file = f"{scratch_prefix(combined_video_path)}-concat-list.txt"
+    with open(list_file, "w", encoding="utf-8") as f:
+        for clip_file in clip_files:
+            escaped = os.path.abspath(clip_file).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    logger.info(f"merging {len(clip_files)} clips with stream copy")
+    try:
+        subprocess.run(
+            [
+                FFMPEG_BINARY, "-y", "-loglevel", "error",
+                "-f", "concat", "-safe", "0", "-i", list_file,
+                "-c", "copy", "-movflags", "+faststart",
+                combined_video_path,
+            ],
+            check=True,
+            capture_output=True,
+        )
+    except subprocess.CalledProcessError as e:
+        delete_files(combined_video_path)
+        raise RuntimeError(e.stderr.decode("utf-8", errors="ignore").strip()) from e
+    finally:
+        delete_files(list_file)
+
+
+def merge_clips_progressive(processed_clips: List[SubClippedVideoClip], combined_video_path: str, settings: RenderSettings = None):
+    """Merge clips two at a time, re-encoding the growing file each step."""
+    # merge video clips progressively, avoid loading all videos at once to avoid memory overflow
     base_clip_path = processed_clips[0].file_path
-    temp_merged_video = f"{output_dir}/temp-merged-video.mp4"
-    temp_merged_next = f"{output_dir}/temp-merged-next.mp4"
-    
+    temp_dir = os.path.dirname(scratch_prefix(combined_video_path))
+    temp_merged_video = f"{scratch_prefix(combined_video_path)}-merged-video.mp4"
+    temp_merged_next = f"{scratch_prefix(combined_video_path)}-merged-next.mp4"
+
     # copy first clip as initial merged video
     shutil.copy(base_clip_path, temp_merged_video)
-    
+
     # merge remaining video clips one by one
     for i, clip in enumerate(processed_clips[1:], 1):
         logger.info(f"merging clip {i}/{len(processed_clips)-1}, duration: {clip.duration:.2f}s")
-        
+
         try:
             # load current base video and next clip to merge
             base_clip = VideoFileClip(temp_merged_video)
             next_clip = VideoFileClip(clip.file_path)
-            
+
             # merge these two clips
             merged_clip = concatenate_videoclips([base_clip, next_clip])
 
@@ -319,115 +958,37 @@ def combine_videos(
                 filename=temp_merged_next,
                 threads=OPTIMAL_THREADS,
                 logger=None,
-                temp_audiofile_path=output_dir,
+                temp_audiofile_path=temp_dir,
                 audio_codec=audio_codec,
-                fps=fps,
+                fps=settings.fps if settings else fps,
+                preset=settings.preset if settings else "medium",
             )
             close_clip(base_clip)
             close_clip(next_clip)
             close_clip(merged_clip)
-            
+
             # replace base file with new merged file
             delete_files(temp_merged_video)
             os.rename(temp_merged_next, temp_merged_video)
-            
+
         except Exception as e:
             logger.error(f"failed to merge clip: {str(e)}")
             continue
-    
-    # after merging, rename final result to target file name
-    os.rename(temp_merged_video, combined_video_path)
-    
-    # clean temp files
-    clip_files = [clip.file_path for clip in processed_clips]
-    delete_files(clip_files)
-            
-    logger.info("video combining completed")
-    return combined_video_path
 
-
-def wrap_text(text, max_width, font="Arial", fontsize=60):
-    # Create ImageFont
-    font = ImageFont.truetype(font, fontsize)
-
-    def get_text_size(inner_text):
-        inner_text = inner_text.strip()
-        left, top, right, bottom = font.getbbox(inner_text)
-        return right - left, bottom - top
-
-    width, height = get_text_size(text)
-    if width <= max_width:
-        return text, height
-
-    processed = True
-
-    _wrapped_lines_ = []
-    words = text.split(" ")
-    _txt_ = ""
-    for word in words:
-        _before = _txt_
-        _txt_ += f"{word} "
-        _width, _height = get_text_size(_txt_)
-        if _width <= max_width:
-            continue
-        else:
-            if _txt_.strip() == word.strip():
-                processed = False
-                break
-            _wrapped_lines_.append(_before)
-            _txt_ = f"{word} "
-    _wrapped_lines_.append(_txt_)
-    if processed:
-        _wrapped_lines_ = [line.strip() for line in _wrapped_lines_]
-        result = "\n".join(_wrapped_lines_).strip()
-        height = len(_wrapped_lines_) * height
-        return result, height
-
-    _wrapped_lines_ = []
-    chars = list(text)
-    _txt_ = ""
-    for word in chars:
-        _before = _txt_
-        _txt_ += word
-        _width, _height = get_text_size(_txt_)
-        if _width <= max_width:
-            continue
-        else:
-            if _before:
-                _wrapped_lines_.append(_before)
-                _txt_ = word
-            else:
-                # If a single character is wider than max_width,
-                # we have to take it as a line though it will clip.
-                _wrapped_lines_.append(_txt_)
-                _txt_ = ""
-    if _txt_:
-        _wrapped_lines_.append(_txt_)
-    result = "\n".join(_wrapped_lines_).strip()
-    height = len(_wrapped_lines_) * height
-    return result, height
+    # after merging, move final result to target file name
+    shutil.move(temp_merged_video, combined_video_path)
 
 
-def generate_video(
-    video_path: str,
-    audio_path: str,
-    subtitle_path: str,
-    output_file: str,
-    params: VideoParams,
-):
-    aspect = VideoAspect(params.video_aspect)
-    video_width, video_height = aspect.to_resolution()
+def wrap_text(text, max_width, font="Arial", fontsize=60):
+    return text_layout.wrap_text(text, max_width, font_path=font, font_size=fontsize)
 
-    logger.info(f"generating video: {video_width} x {video_height}")
-    logger.info(f"  ① video: {video_path}")
-    logger.info(f"  ② audio: {audio_path}")
-    logger.info(f"  ③ subtitle: {subtitle_path}")
-    logger.info(f"  ④ output: {output_file}")
 
-    # https://github.com/harry0703/MoneyPrinterTurbo/issues/217
-    # PermissionError: [WinError 32] The process cannot access the file because it is being used by another process: 'final-1.mp4.tempTEMP_MPY_wvf_snd.mp3'
-    # write into the same directory as the output file
-    output_dir = os.path.dirname(output_file)
+def overlay_subtitles(video_clip, subtitle_path: str, params: VideoParams):
+    """Burn the subtitles into a video clip."""
+    full_width, full_height = VideoAspect(params.video_aspect).to_resolution()
+    video_width, video_height = render_settings(params.video_aspect, params.draft).size
+    # drafts are smaller, scale the text so the layout matches the full render
+    scale = video_height / full_height
 
     font_path = ""
     if params.subtitle_enabled:
@@ -450,151 +1011,407 @@ def generate_video(
 
         logger.info(f"  ⑤ font: {font_path}")
 
-    def create_text_clip(subtitle_item):
+    def create_caption(subtitle_item):
         params.font_size = int(params.font_size)
         params.stroke_width = int(params.stroke_width)
+        font_size = max(1, int(params.font_size * scale))
+        stroke_width = int(params.stroke_width * scale)
         phrase = subtitle_item[1]
         # Use 0.85 instead of 0.9 to give more margin on sides
         max_width = video_width * 0.85
         wrapped_txt, txt_height = wrap_text(
-            phrase, max_width=max_width, font=font_path, fontsize=params.font_size
+            phrase, max_width=max_width, font=font_path, fontsize=font_size
         )
         # Add extra vertical padding to prevent character clipping
-        vertical_padding = params.font_size * 0.5
+        vertical_padding = font_size * 0.5
         # Add extra horizontal padding to prevent side clipping (especially for stroke)
-        horizontal_padding = params.font_size * 0.5
-        interline = int(params.font_size * 0.25)
+        horizontal_padding = font_size * 0.5
+        interline = int(font_size * 0.25)
         
         size = (
             int(max_width + horizontal_padding), 
             int(txt_height + vertical_padding + (interline * (wrapped_txt.count("\n") + 1)))
         )
 
-        _clip = TextClip(
+        sprite = subtitle_overlay.rasterize_caption(
             text=wrapped_txt,
-            font=font_path,
-            font_size=params.font_size,
+            font_path=font_path,
+            font_size=font_size,
             color=params.text_fore_color,
             bg_color=params.text_background_color,
             stroke_color=params.stroke_color,
-            stroke_width=params.stroke_width,
+            stroke_width=stroke_width,
             interline=interline,
             size=size,
         )
-        duration = subtitle_item[0][1] - subtitle_item[0][0]
-        _clip = _clip.with_start(subtitle_item[0][0])
-        _clip = _clip.with_end(subtitle_item[0][1])
-        _clip = _clip.with_duration(duration)
+        x = (video_width - sprite.width) / 2
         if params.subtitle_position == "bottom":
             # Restored to 0.95 - font rendering fix (size/interline params) prevents clipping
-            _clip = _clip.with_position(("center", video_height * 0.95 - _clip.h))
+            y = video_height * 0.95 - sprite.height
         elif params.subtitle_position == "top":
-            _clip = _clip.with_position(("center", video_height * 0.05))
+            y = video_height * 0.05
         elif params.subtitle_position == "custom":
             # Ensure the subtitle is fully within the screen bounds
-            margin = 10  # Additional margin, in pixels
-            max_y = video_height - _clip.h - margin
+            margin = 10 * scale  # Additional margin, in pixels at full size
+            max_y = video_height - sprite.height - margin
             min_y = margin
-            custom_y = (video_height - _clip.h) * (params.custom_position / 100)
-            custom_y = max(
+            custom_y = (video_height - sprite.height) * (params.custom_position / 100)
+            y = max(
                 min_y, min(custom_y, max_y)
             )  # Constrain the y value within the valid range
-            _clip = _clip.with_position(("center", custom_y))
         else:  # center
-            _clip = _clip.with_position(("center", "center"))
-        return _clip
+            y = (video_height - sprite.height) / 2
+        (start, end) = subtitle_item[0]
+        return subtitle_overlay.Caption(start, end, sprite, x, y)
 
-    video_clip = VideoFileClip(video_path).without_audio()
-    audio_clip = AudioFileClip(audio_path).with_effects(
-        [afx.MultiplyVolume(params.voice_volume)]
+    if subtitle_path and os.path.exists(subtitle_path):
+        captions = [
+            create_caption(subtitle_item=item)
+            for item in file_to_subtitles(subtitle_path, encoding="utf-8")
+        ]
+        video_clip = video_clip.transform(subtitle_overlay.SubtitleOverlay(captions))
+
+    return video_clip
+
+
+def mix_final_audio(audio_path: str, duration: float, output_file: str, params: VideoParams) -> str:
+    """Mix the voice and BGM for output_file, returning the path of the encoded mix."""
+    # https://github.com/harry0703/MoneyPrinterTurbo/issues/217
+    # write into the same directory as the output file
+    mixed_audio_file = f"{scratch_prefix(output_file)}-audio.m4a"
+    bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
+    return audio_mix.mix(
+        voice_file=audio_path,
+        duration=duration,
+        output_file=mixed_audio_file,
+        voice_volume=params.voice_volume,
+        bgm_file=bgm_file,
+        bgm_volume=params.bgm_volume,
     )
 
-    def make_textclip(text):
-        return TextClip(
-            text=text,
-            font=font_path,
-            font_size=params.font_size,
-        )
 
-    if subtitle_path and os.path.exists(subtitle_path):
-        sub = SubtitlesClip(
-            subtitles=subtitle_path, encoding="utf-8", make_textclip=make_textclip
+def write_final_video(video_clip, audio_path: str, subtitle_path: str, output_file: str, params: VideoParams):
+    """Burn in subtitles and write the video with the pre-mixed audio track muxed in as is."""
+    settings = render_settings(params.video_aspect, params.draft)
+    mixed_audio_file = mix_final_audio(audio_path, video_clip.duration, output_file, params)
+    video_clip = overlay_subtitles(video_clip, subtitle_path, params)
+    frames = int(round(video_clip.duration * settings.fps))
+    try:
+        with trace.span("encode", file=os.path.basename(output_file), frames=frames) as span:
+            video_clip.write_videofile(
+                output_file,
+                audio=mixed_audio_file,
+                audio_codec="copy",
+                threads=params.n_threads or OPTIMAL_THREADS,
+                logger=None,
+                fps=settings.fps,
+                preset=settings.preset,
+            )
+        span.attrs["fps"] = round(frames / span.wall_time, 1) if span.wall_time > 0 else 0
+        trace.add("frames_rendered", frames)
+    finally:
+        close_clip(video_clip)
+        delete_files(mixed_audio_file)
+
+
+def generate_video(
+    video_path: str,
+    audio_path: str,
+    subtitle_path: str,
+    output_file: str,
+    params: VideoParams,
+):
+    video_width, video_height = render_settings(params.video_aspect, params.draft).size
+
+    logger.info(f"generating video: {video_width} x {video_height}")
+    logger.info(f"  ① video: {video_path}")
+    logger.info(f"  ② audio: {audio_path}")
+    logger.info(f"  ③ subtitle: {subtitle_path}")
+    logger.info(f"  ④ output: {output_file}")
+
+    video_clip = VideoFileClip(video_path).without_audio()
+    write_final_video(video_clip, audio_path, subtitle_path, output_file, params)
+
+
+def render_video(
+    video_paths: List[str],
+    audio_path: str,
+    subtitle_path: str,
+    output_file: str,
+    params: VideoParams,
+    combined_video_path: str = "",
+    render_plan: RenderPlan = None,
+    duration_limit: float = 0,
+) -> str:
+    """
+    Render the final video with a single encode.
+
+    Segments, scaling/padding, transitions and subtitle overlays are
+    assembled into one timeline and written once together with the pre-mixed
+    audio, with no temp clips. Segments come from render_plan when given.
+    If combined_video_path is given (debugging), the silent combined timeline
+    is also written there. duration_limit stops the video (and the mix)
+    after that many seconds.
+    """
+    settings = render_settings(params.video_aspect, params.draft)
+    video_width, video_height = settings.size
+
+    audio_duration = probe.get_duration(audio_path)
+    if duration_limit:
+        audio_duration = min(audio_duration, duration_limit)
+
+    logger.info(f"rendering video in a single pass: {video_width} x {video_height}")
+    logger.info(f"  ① videos: {len(video_paths)} sources")
+    logger.info(f"  ② audio: {audio_path}, duration: {audio_duration} seconds")
+    logger.info(f"  ③ subtitle: {subtitle_path}")
+    logger.info(f"  ④ output: {output_file}")
+
+    if render_plan is not None:
+        segment_jobs = jobs_from_plan(render_plan, settings, scratch_prefix(output_file))
+    else:
+        max_clip_duration = params.video_clip_duration or 5
+        subclipped_items = collect_segments(video_paths, max_clip_duration)
+        segment_jobs = plan_segments(
+            subclipped_items=subclipped_items,
+            audio_duration=audio_duration,
+            video_width=video_width,
+            video_height=video_height,
+            video_transition_mode=params.video_transition_mode,
+            max_clip_duration=max_clip_duration,
+            scratch_prefix=scratch_prefix(output_file),
+            settings=settings,
         )
-        text_clips = []
-        for item in sub.subtitles:
-            clip = create_text_clip(subtitle_item=item)
-            text_clips.append(clip)
-        video_clip = CompositeVideoClip([video_clip, *text_clips])
 
-    bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
-    if bgm_file:
-        try:
-            bgm_clip = AudioFileClip(bgm_file).with_effects(
-                [
-                    afx.MultiplyVolume(params.bgm_volume),
-                    afx.AudioFadeOut(3),
-                    afx.AudioLoop(duration=video_clip.duration),
-                ]
+    # open each source once and cut all of its segments from the same reader
+    sources = {}
+    try:
+        segment_clips = []
+        video_duration = 0
+        for job in segment_jobs:
+            file_path = job.item.file_path
+            try:
+                if file_path not in sources:
+                    sources[file_path] = open_source_clip(
+                        file_path, (job.item.width, job.item.height), (video_width, video_height)
+                    )
+                clip = build_segment_clip(job, source_clip=sources[file_path])
+            except Exception as e:
+                logger.error(f"failed to process clip: {str(e)}")
+                continue
+            segment_clips.append(clip)
+            video_duration += clip.duration
+
+        segment_clips, video_duration = loop_clips(segment_clips, video_duration, audio_duration)
+        if not segment_clips:
+            logger.warning("no clips available for rendering")
+            return ""
+
+        video_clip = concatenate_videoclips(segment_clips)
+        if duration_limit and video_clip.duration > duration_limit:
+            video_clip = video_clip.subclipped(0, duration_limit)
+        if combined_video_path:
+            logger.info(f"writing intermediate combined video: {combined_video_path}")
+            video_clip.write_videofile(
+                combined_video_path, logger=None, fps=settings.fps, codec=video_codec, preset=settings.preset,
+                audio=False, threads=OPTIMAL_THREADS,
             )
-            audio_clip = CompositeAudioClip([audio_clip, bgm_clip])
-        except Exception as e:
-            logger.error(f"failed to add bgm: {str(e)}")
-
-    video_clip = video_clip.with_audio(audio_clip)
-    video_clip.write_videofile(
-        output_file,
-        audio_codec=audio_codec,
-        temp_audiofile_path=output_dir,
-        threads=params.n_threads or OPTIMAL_THREADS,
-        logger=None,
-        fps=fps,
+
+        if render_plan is not None:
+            params = params_for_plan(params, render_plan)
+        write_final_video(video_clip, audio_path, subtitle_path, output_file, params)
+    finally:
+        # also when writing failed, the readers hold ffmpeg processes
+        for source in sources.values():
+            close_clip(source)
+
+    logger.info("single pass rendering completed")
+    return output_file
+
+
+def render_preview(
+    audio_path: str,
+    subtitle_path: str,
+    output_file: str,
+    params: VideoParams,
+    render_plan: RenderPlan,
+    seconds: float,
+) -> str:
+    """
+    Render the first seconds of a planned video at draft quality.
+
+    Uses the plan's leading segments with the real narration, subtitles and
+    BGM, so the teaser shows what the full render will start with.
+    """
+    segments = []
+    planned_duration = 0
+    for segment in render_plan.segments:
+        if planned_duration >= seconds:
+            break
+        segments.append(segment)
+        planned_duration += min(segment.end_time - segment.start_time, render_plan.max_clip_duration)
+
+    logger.info(f"rendering {seconds}s preview from {len(segments)} segments: {output_file}")
+    return render_video(
+        video_paths=list(dict.fromkeys(segment.file_path for segment in segments)),
+        audio_path=audio_path,
+        subtitle_path=subtitle_path,
+        output_file=output_file,
+        params=params.model_copy(update={"draft": True, "keep_intermediates": False}),
+        render_plan=render_plan.model_copy(update={"segments": segments}),
+        duration_limit=seconds,
     )
-    video_clip.close()
-    del video_clip
 
 
-def preprocess_video(materials: List[MaterialInfo], clip_duration=4):
+# zoom added per second of an image clip, the old clip.resized(lambda t: 1 + 0.03 * t)
+IMAGE_ZOOM_PER_SECOND = 0.03
+# image clips are never larger than the largest output frame
+IMAGE_MAX_SIZE = (1920, 1920)
+# bump when image clip rendering changes pixels so old cache entries are not reused
+IMAGE_CLIP_CACHE_VERSION = 1
+
+
+def _image_clip_cache() -> Union[DiskCache, None]:
+    max_mb = config.app.get("image_clip_cache_max_mb", 1024)
+    if not max_mb or int(max_mb) <= 0:
+        return None
+    return DiskCache(utils.storage_dir("cache_image_clips", create=True), int(max_mb) * 1024 * 1024)
+
+
+def image_clip_size(image_size, video_size=None):
+    """Frame size of an image clip: the image fitted into video_size, or capped at IMAGE_MAX_SIZE."""
+    if video_size:
+        width, height = frame_transform.fit_size(image_size, video_size)
+    else:
+        width, height = image_size
+        scale = min(1.0, IMAGE_MAX_SIZE[0] / width, IMAGE_MAX_SIZE[1] / height)
+        width, height = int(width * scale), int(height * scale)
+    # x264 needs even dimensions
+    return max(2, width // 2 * 2), max(2, height // 2 * 2)
+
+
+def image_clip_cache_key(image_path: str, frame_size, clip_duration: float) -> str:
+    return utils.md5(json.dumps([
+        IMAGE_CLIP_CACHE_VERSION,
+        probe.content_hash(image_path),
+        list(frame_size),
+        clip_duration,
+        IMAGE_ZOOM_PER_SECOND,
+        fps,
+        video_codec,
+    ]))
+
+
+def render_image_clip(image_path: str, output_file: str, frame_size, clip_duration: float, threads: int = OPTIMAL_THREADS) -> str:
+    """Render the zoomed clip of one image, returning output_file or "" on failure."""
+    # a fresh file, never written through into a file of an earlier render
+    delete_files(output_file)
+    try:
+        ken_burns.render(
+            image_path,
+            output_file,
+            frame_size,
+            duration=clip_duration,
+            end_zoom=1 + clip_duration * IMAGE_ZOOM_PER_SECOND,
+            fps=fps,
+            threads=threads,
+        )
+    except Exception as e:
+        logger.error(f"failed to process image {image_path}: {str(e)}")
+        delete_files(output_file)
+        return ""
+    return output_file
+
+
+def preprocess_video(materials: List[MaterialInfo], clip_duration=4, video_size=None, workers: int = 1):
+    """
+    Turn image materials into slowly zooming video clips, in place.
+
+    Images are told apart from videos by extension. Each image clip is
+    written next to its image as {image}-{w}x{h}.mp4; clips are cached by image
+    content, frame size and duration, and the ones not cached are rendered
+    by up to workers processes. Images smaller than 480x480 are dropped.
+
+    Args:
+        video_size: Output resolution the clips are fitted into, so images
+            are only decoded and encoded at the size the video uses. Without
+            it the image's own size is used, capped at IMAGE_MAX_SIZE.
+    """
+    result = []
+    jobs = []
+    cache = _image_clip_cache()
     for material in materials:
         if not material.url:
             continue
 
         ext = utils.parse_extension(material.url)
+        is_image = ext in const.FILE_TYPE_IMAGES
         try:
-            clip = VideoFileClip(material.url)
-        except Exception:
-            clip = ImageClip(material.url)
+            if is_image:
+                width, height = ken_burns.image_size(material.url)
+            else:
+                info = probe.probe(material.url)
+                width, height = info.width, info.height
+        except Exception as e:
+            logger.warning(f"failed to read material {material.url}: {str(e)}")
+            continue
 
-        width = clip.size[0]
-        height = clip.size[1]
         if width < 480 or height < 480:
             logger.warning(f"low resolution material: {width}x{height}, minimum 480x480 required")
+            if is_image:
+                continue
+        result.append(material)
+        if not is_image:
             continue
 
-        if ext in const.FILE_TYPE_IMAGES:
-            logger.info(f"processing image: {material.url}")
-            # Create an image clip and set its duration to 3 seconds
-            clip = (
-                ImageClip(material.url)
-                .with_duration(clip_duration)
-                .with_position("center")
-            )
-            # Apply a zoom effect using the resize method.
-            # A lambda function is used to make the zoom effect dynamic over time.
-            # The zoom effect starts from the original size and gradually scales up to 120%.
-            # t represents the current time, and clip.duration is the total duration of the clip (3 seconds).
-            # Note: 1 represents 100% size, so 1.2 represents 120% size.
-            zoom_clip = clip.resized(
-                lambda t: 1 + (clip_duration * 0.03) * (t / clip.duration)
-            )
+        frame_size = image_clip_size((width, height), video_size)
+        # one file per frame size, portrait and landscape runs of an image don't share it
+        video_file = f"{material.url}-{frame_size[0]}x{frame_size[1]}.mp4"
+        cache_key = ""
+        if cache is not None:
+            cache_key = image_clip_cache_key(material.url, frame_size, clip_duration)
+            cached_file = cache.get(cache_key, ".mp4")
+            if cached_file:
+                try:
+                    copy_file(cached_file, video_file)
+                except OSError as e:
+                    # evicted meanwhile or unreadable, rendered again below
+                    logger.warning(f"failed to copy cached image clip {cached_file}: {str(e)}")
+                else:
+                    logger.info(f"image clip cache hit: {material.url}")
+                    trace.add("image_clip_cache_hits")
+                    material.url = video_file
+                    continue
+        jobs.append((material, frame_size, video_file, cache_key))
+
+    if jobs:
+        frame_w, frame_h = max(job[1] for job in jobs)
+        workers = max(1, min(workers, len(jobs)))
+        threads = max(1, OPTIMAL_THREADS // workers)
+        workers = resources.fit_workers(
+            workers, resources.estimate_render_mb(frame_w, frame_h, threads), "image workers"
+        )
+        threads = max(1, OPTIMAL_THREADS // workers)
+        logger.info(f"processing {len(jobs)} images with {workers} workers")
+        args = [
+            (material.url, video_file, frame_size, clip_duration, threads)
+            for material, frame_size, video_file, _ in jobs
+        ]
+        with trace.span("images", count=len(jobs), workers=workers):
+            if workers <= 1:
+                outputs = [render_image_clip(*a) for a in args]
+            else:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                    outputs = list(executor.map(render_image_clip, *zip(*args)))
 
-            # Optionally, create a composite video clip containing the zoomed clip.
-            # This is useful when you want to add other elements to the video.
-            final_clip = CompositeVideoClip([zoom_clip])
-
-            # Output the video to a file.
-            video_file = f"{material.url}.mp4"
-            final_clip.write_videofile(video_file, fps=30, logger=None, threads=OPTIMAL_THREADS)
-            close_clip(clip)
-            material.url = video_file
-            logger.success(f"image processed: {video_file}")
-    return materials
\ No newline at end of file
+        for (material, _, _, cache_key), output in zip(jobs, outputs):
+            if not output:
+                result.remove(material)
+                continue
+            if cache_key:
+                try:
+                    cache.put(cache_key, output, ".mp4")
+                except Exception as e:
+                    logger.warning(f"failed to cache image clip {output}: {str(e)}")
+            material.url = output
+            logger.success(f"image processed: {output}")
+    return result
@@ -15,8 +15,9 @@ import edge_tts
 from edge_tts import SubMaker, submaker
 # from edge_tts.submaker import mktimestamp
 from loguru import logger
-from moviepy.audio.io.AudioFileClip import AudioFileClip
 
+from . import probe
+from . import trace
 from . import utils
 
 def mktimestamp(microseconds: int) -> str:
@@ -127,6 +128,29 @@ def convert_rate_to_percent(rate: float) -> str:
     return f"{percent}%"
 
 
+# Typical edge-tts speaking rates at voice_rate 1.0
+WORDS_PER_SECOND = 2.6
+CJK_CHARS_PER_SECOND = 4.5
+PAUSE_SECONDS = 0.3
+
+_CJK_CHARS = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+_WORDS = re.compile(r"[^\W_]+")
+_PAUSES = re.compile(r"[,.;:!?，。；：！？、…]+")
+
+
+def estimate_duration(text: str, voice_rate: float = 1.0) -> float:
+    """
+    Rough narration length of text in seconds, for planning before TTS has
+    run: CJK characters and other words at typical speaking rates, plus a
+    short pause per punctuation mark.
+    """
+    cjk_chars = len(_CJK_CHARS.findall(text))
+    words = len(_WORDS.findall(_CJK_CHARS.sub(" ", text)))
+    pauses = len(_PAUSES.findall(text))
+    seconds = cjk_chars / CJK_CHARS_PER_SECOND + words / WORDS_PER_SECOND + pauses * PAUSE_SECONDS
+    return seconds / max(voice_rate or 1.0, 0.1)
+
+
 def tts(
     text: str,
     voice_name: str,
@@ -166,7 +190,8 @@ def tts(
                             sub_maker.feed(chunk)
                 return sub_maker
 
-            sub_maker = asyncio.run(_do())
+            with trace.span("tts", voice=voice_name, attempt=i + 1, chars=len(text)):
+                sub_maker = asyncio.run(_do())
             if not sub_maker or not sub_maker.cues:
                 logger.warning("TTS returned empty subtitles, retrying...")
                 continue
@@ -408,6 +433,34 @@ def create_subtitle(sub_maker: submaker.SubMaker, text: str, subtitle_file: str)
         logger.error(f"subtitle creation failed: {str(e)}")
 
 
+def sub_maker_to_dict(sub_maker: submaker.SubMaker) -> dict:
+    """Timings of a SubMaker as plain data, e.g. to checkpoint a TTS run."""
+    return {
+        "type": sub_maker.type,
+        "cues": [
+            [cue.start.total_seconds(), cue.end.total_seconds(), cue.content]
+            for cue in sub_maker.cues
+        ],
+    }
+
+
+def sub_maker_from_dict(data: dict) -> submaker.SubMaker:
+    """Rebuild a SubMaker saved with sub_maker_to_dict."""
+    from datetime import timedelta
+    from edge_tts.srt_composer import Subtitle
+
+    sub_maker = SubMaker()
+    sub_maker.type = data.get("type")
+    sub_maker.cues = [
+        Subtitle(
+            index=i + 1,
+            start=timedelta(seconds=start),
+            end=timedelta(seconds=end),
+            content=content,
+        )
+        for i, (start, end, content) in enumerate(data.get("cues", []))
+    ]
+    return sub_maker
 
 
 def _get_audio_duration_from_submaker(sub_maker: submaker.SubMaker) -> float:
@@ -424,8 +477,7 @@ def _get_audio_duration_from_mp3(mp3_file: str) -> float:
         return 0.0
 
     try:
-        with AudioFileClip(mp3_file) as audio:
-            return audio.duration
+        return probe.get_duration(mp3_file)
     except Exception as e:
         logger.error(f"Failed to get audio duration: {str(e)}")
         return 0.0
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the skill's modules are imported as the "scripts" package, as generate.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
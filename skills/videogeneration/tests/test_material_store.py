@@ -0,0 +1,16 @@
+import os
+
+from scripts.material_store import MaterialStore
+
+URL = "https://videos.pexels.com/video-files/1/clip.mp4?token=abc"
+
+
+def test_lookup_drops_corrupt_legacy_file(tmp_path):
+    store = MaterialStore(str(tmp_path), 1024 * 1024)
+    legacy_path = tmp_path / f"vid-{store.url_key(URL)}.mp4"
+    legacy_path.write_bytes(b"not a video")
+
+    assert store.lookup(URL) is None
+    assert not legacy_path.exists()
+    assert store.entries() == []
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".mp4")] == []
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from scripts import search_cache
+from scripts.disk_cache import DiskCache
+
+PARAMS = {"query": "ocean", "per_page": 20, "key": "secret"}
+CACHED = {"hits": [{"id": 1}]}
+
+
+def valid(response):
+    return "hits" in response
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = DiskCache(str(tmp_path), 1024 * 1024)
+    monkeypatch.setattr(search_cache, "_cache", lambda: cache)
+    monkeypatch.setattr(search_cache, "offline", lambda: False)
+    return cache
+
+
+def store_expired(cache):
+    key = search_cache.cache_key("pixabay", PARAMS)
+    search_cache._store(cache, key, "pixabay", PARAMS, CACHED)
+    file_path = cache.get(key, ".json")
+    with open(file_path, "r", encoding="utf-8") as f:
+        entry = json.load(f)
+    # older than the default fresh and stale windows
+    entry["fetched_at"] -= 365 * 24 * 3600
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(entry, f)
+    return key
+
+
+def test_expired_entry_served_when_refetch_returns_error(cache):
+    key = store_expired(cache)
+
+    response = search_cache.search("pixabay", PARAMS, lambda: {"error": "rate limited"}, valid)
+
+    assert response == CACHED
+    assert search_cache._load(cache, key)["response"] == CACHED
+
+
+def test_expired_entry_served_when_refetch_fails(cache):
+    store_expired(cache)
+
+    def fetch():
+        raise ConnectionError("offline")
+
+    assert search_cache.search("pixabay", PARAMS, fetch, valid) == CACHED
+
+
+def test_expired_entry_replaced_by_valid_refetch(cache):
+    key = store_expired(cache)
+    fresh = {"hits": [{"id": 2}]}
+
+    assert search_cache.search("pixabay", PARAMS, lambda: fresh, valid) == fresh
+    assert search_cache._load(cache, key)["response"] == fresh
+
+
+def test_error_returned_without_cached_entry(cache):
+    error = {"error": "rate limited"}
+
+    assert search_cache.search("pixabay", PARAMS, lambda: error, valid) == error
@@ -0,0 +1,30 @@
+import threading
+import time
+
+import pytest
+
+from scripts import utils
+
+
+@pytest.mark.parametrize("without_fcntl", [False, True])
+def test_file_lock_serializes_threads(tmp_path, monkeypatch, without_fcntl):
+    if without_fcntl:
+        monkeypatch.setattr(utils, "fcntl", None)
+    lock_path = str(tmp_path / "a.lock")
+    holders = []
+    overlaps = []
+
+    def hold():
+        with utils.file_lock(lock_path):
+            holders.append(1)
+            if len(holders) > 1:
+                overlaps.append(len(holders))
+            time.sleep(0.02)
+            holders.pop()
+
+    threads = [threading.Thread(target=hold) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert overlaps == []
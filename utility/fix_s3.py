@@ -49,7 +49,7 @@ def generate_fixed_s3():
     ]
     
     print("🎬 Processing materials...")
-    from moviepy import ImageClip, VideoFileClip, CompositeVideoClip, concatenate_videoclips
+    from moviepy import ImageClip, VideoFileClip, concatenate_videoclips
     from moviepy.video.fx import Loop
     
     clips = []
@@ -93,24 +93,34 @@ def generate_fixed_s3():
     params.font_name = "Arial Unicode.ttf"
     
     # Use moviepy directly for final write to ensure it works
-    from moviepy.video.tools.subtitles import SubtitlesClip
-    from moviepy import TextClip
-    
-    def make_textclip(text):
-        return TextClip(
-            text=text,
-            font="/System/Library/Fonts/Supplemental/Arial Unicode.ttf",
+    from moviepy.video.tools.subtitles import file_to_subtitles
+    from moviepy import AudioFileClip
+    from scripts import subtitle_overlay, text_layout
+
+    font_path = "/System/Library/Fonts/Supplemental/Arial Unicode.ttf"
+    caption_width = int(1920 * 0.8)
+
+    def make_caption(item):
+        (start, end), text = item
+        wrapped, text_height = text_layout.wrap_text(text, caption_width, font_path, 60)
+        interline = 15
+        size = (caption_width, text_height + 30 + interline * (wrapped.count("\n") + 1))
+        sprite = subtitle_overlay.rasterize_caption(
+            text=wrapped,
+            font_path=font_path,
             font_size=60,
-            color='white',
-            stroke_color='black',
+            color="white",
+            bg_color=None,
+            stroke_color="black",
             stroke_width=2,
-            method='caption',
-            size=(int(1920*0.8), None)
-        ).with_position(('center', int(1080*0.85)))
+            interline=interline,
+            size=size,
+        )
+        return subtitle_overlay.Caption(start, end, sprite, (1920 - sprite.width) / 2, int(1080 * 0.85))
 
-    sub = SubtitlesClip(subtitle_file, make_textclip=make_textclip, encoding='utf-8')
-    final_clip = CompositeVideoClip([full_video, sub.with_start(0)])
-    final_clip = final_clip.with_audio(voice.AudioFileClip(audio_file))
+    captions = [make_caption(item) for item in file_to_subtitles(subtitle_file, encoding="utf-8")]
+    final_clip = full_video.transform(subtitle_overlay.SubtitleOverlay(captions))
+    final_clip = final_clip.with_audio(AudioFileClip(audio_file))
     
     final_clip.write_videofile(final_output, fps=30, codec="libx264", audio_codec="aac", threads=1)
     